@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Batch mode: every image in a directory or manifest, processed concurrently, journaled so an
+interrupted run picks up where it stopped, and summarized in one consolidated report
+
+Run from the backend directory, for example:
+    python batch.py /data/flight_0612 --workers 4
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from detection_store import DetectionStore
+from reports import write_batch_report
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+INTERRUPTED = "interrupted"
+
+
+def collect_images(source, extensions):
+    """Absolute image paths from a directory (searched recursively, sorted) or a manifest file
+    listing one path per line, relative to the manifest; blank lines and `#` comments are skipped"""
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(source)
+                       for name in names if name.lower().endswith(extensions))
+    elif os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            lines = [line.strip() for line in f]
+        paths = [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+    else:
+        raise ValueError(f"No such directory or manifest: {source}")
+    return [os.path.abspath(path) for path in paths]
+
+
+def batch_id_for(paths):
+    """The same images always give the same id, so rerunning a batch resumes it"""
+    return hashlib.sha256("\n".join(paths).encode()).hexdigest()[:12]
+
+
+def image_names(paths):
+    """Names unique within the batch: paths relative to the deepest folder they share"""
+    if len(paths) == 1:
+        return [os.path.basename(paths[0])]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return [os.path.relpath(path, root).replace(os.sep, "_") for path in paths]
+
+
+class BatchRun:
+    """A batch's images and its journal, `progress.jsonl` in the batch's state folder.
+
+    Every finished image is appended to the journal as soon as it completes.
+    On a rerun, images journaled as done whose detection store still exists
+    are skipped; failed and unfinished ones are processed again.
+    """
+
+    def __init__(self, batch_id, paths, state_dir):
+        self.batch_id = batch_id
+        self.paths = paths
+        self.names = image_names(paths)
+        self.root = os.path.join(state_dir, batch_id)
+        self.journal_path = os.path.join(self.root, "progress.jsonl")
+        self.lock = threading.Lock()
+        self.status = PENDING
+        self.error = None
+        self.report = None
+        self.started_at = None
+        self.finished_at = None
+        self.failed = {}
+        self.manifest_path = os.path.join(self.root, "manifest.json")
+        os.makedirs(self.root, exist_ok=True)
+        if not os.path.exists(self.manifest_path):
+            self._write_manifest()
+        self.results = self._read_journal()
+        self.resumed = len(self.results)
+
+    def _write_manifest(self):
+        with open(self.manifest_path, "w") as f:
+            json.dump({'batch_id': self.batch_id, 'images': self.paths, 'report': self.report}, f)
+
+    @classmethod
+    def open(cls, state_dir, batch_id):
+        """A batch started earlier, possibly by another process, or None"""
+        manifest = os.path.join(state_dir, os.path.basename(batch_id), "manifest.json")
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest) as f:
+            saved = json.load(f)
+        batch = cls(batch_id, saved['images'], state_dir)
+        batch.report = saved.get('report')
+        batch.status = DONE if len(batch.results) == len(batch.paths) else INTERRUPTED
+        return batch
+
+    def _read_journal(self):
+        results = {}
+        if not os.path.exists(self.journal_path):
+            return results
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short when the last run was killed
+                    continue
+                if entry['status'] == DONE and os.path.exists(entry['detections_path']):
+                    results[entry['index']] = entry
+                else:
+                    results.pop(entry['index'], None)
+        return results
+
+    def record(self, entry):
+        with self.lock:
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if entry['status'] == DONE:
+                self.results[entry['index']] = entry
+                self.failed.pop(entry['index'], None)
+            else:
+                self.failed[entry['index']] = entry
+
+    def run(self, process, workers=4):
+        """Call `process(path, name, index)` for every image not done yet, `workers` at a time.
+        It returns the journal fields of a finished image: summary, detections_path and outputs"""
+        def one(index):
+            start = time.perf_counter()
+            entry = {'index': index, 'image': self.names[index], 'path': self.paths[index]}
+            try:
+                entry.update(process(self.paths[index], self.names[index], index), status=DONE)
+            except Exception as e:
+                entry.update(status=FAILED, error=str(getattr(e, "detail", e)))
+            entry['seconds'] = round(time.perf_counter() - start, 3)
+            self.record(entry)
+
+        self.status = RUNNING
+        self.started_at = time.time()
+        todo = [index for index in range(len(self.paths)) if index not in self.results]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"batch-{self.batch_id}") as pool:
+            list(pool.map(one, todo))
+        self.finished_at = time.time()
+
+    def finish(self):
+        """Mark the batch finished, once its report is written"""
+        self.status = FAILED if self.failed else DONE
+
+    def write_report(self, path, report_format, class_names):
+        """The consolidated report over every finished image, in manifest order"""
+        done = [self.results[index] for index in sorted(self.results)]
+        parts = ((entry['image'], DetectionStore.load(entry['detections_path'])) for entry in done)
+        write_batch_report([(entry['image'], entry['summary']) for entry in done], parts, path,
+                           report_format, class_names)
+        self.report = path
+        self._write_manifest()
+
+    def to_dict(self):
+        with self.lock:
+            results = [self.results[index] for index in sorted(self.results)]
+            failed = [self.failed[index] for index in sorted(self.failed)]
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else None
+        processed = len(results) - self.resumed + len(failed)
+        return {
+            'batch_id': self.batch_id,
+            'status': self.status,
+            'total': len(self.paths),
+            'done': len(results),
+            'failed': len(failed),
+            'pending': len(self.paths) - len(results) - len(failed),
+            'resumed': self.resumed,
+            'images_per_second': round(processed / elapsed, 3) if elapsed and processed else None,
+            'total_panels': sum(entry['summary']['total_panels'] for entry in results),
+            'report': self.report and f"/reports/{os.path.basename(self.report)}",
+            'error': self.error,
+            'failures': [{'image': entry['image'], 'error': entry['error']} for entry in failed],
+        }
+
+
+def main():
+    from main import open_batch, process_batch, BATCH_WORKERS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of images, or a manifest file listing one image path per line")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="images processed at once")
+    parser.add_argument("--restart", action="store_true", help="ignore the journal of an earlier run")
+    args = parser.parse_args()
+
+    batch = process_batch(open_batch(args.source, args.restart), args.workers)
+    summary = batch.to_dict()
+    print(json.dumps(summary, indent=2))
+    if summary['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Shared model batches: calls from many threads, each with a few tiles or crops, merged into full batches
+"""
+
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Runs `func(items) -> results` on one thread for callers on any thread.
+
+    The dispatcher takes the oldest waiting call and adds later ones while they
+    fit in `batch_size`, waiting up to `max_wait` seconds for more before it
+    runs a short batch. Each caller blocks until its own results, in order,
+    are ready. A single call larger than `batch_size` runs in several batches.
+    """
+
+    def __init__(self, func, batch_size, max_wait=0.01, name="batcher"):
+        self.func = func
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self._carry = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def __call__(self, items):
+        items = list(items)
+        if not items:
+            return []
+        future = Future()
+        self.requests.put((items, future))
+        return future.result()
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def _next(self, timeout=None):
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        return self.requests.get(timeout=timeout)
+
+    def _run(self):
+        while True:
+            request = self._next()
+            if request is None:
+                return
+            batch, count = [request], len(request[0])
+            deadline = time.perf_counter() + self.max_wait
+            while count < self.batch_size:
+                try:
+                    request = self._next(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    # Closing: run this batch first, then stop on the next round
+                    self.requests.put(None)
+                    break
+                if count + len(request[0]) > self.batch_size:
+                    # Starts the next batch, so neither is split
+                    self._carry = request
+                    break
+                batch.append(request)
+                count += len(request[0])
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        items = [item for request_items, _ in batch for item in request_items]
+        try:
+            results = []
+            for start in range(0, len(items), self.batch_size):
+                chunk = items[start:start + self.batch_size]
+                results += list(self.func(chunk))
+                self.batches += 1
+                self.items += len(chunk)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        offset = 0
+        for request_items, future in batch:
+            future.set_result(results[offset:offset + len(request_items)])
+            offset += len(request_items)
+
+    def close(self):
+        """Finish the calls already queued, then stop the dispatcher"""
+        self.requests.put(None)
+        self._thread.join()
@@ -0,0 +1,1333 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmarks for the Solar Panel Classification Backend
+
+Run from the backend directory, for example:
+    python benchmark.py yolo-batch --tiles 64 --batch-sizes 1 4 8 16
+"""
+
+import os
+import time
+import contextlib
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+from processor import (
+    SolarPanelProcessor, TILE_SIZE, TILE_OVERLAP, YOLO_MODEL_PATH, CLASSIFIER_PATH, CLASS_NAMES, classifier_transform,
+    CASCADE_MODEL_PATH
+)
+
+
+def synthetic_mosaic(width, height, seed=0):
+    """Random BGR mosaic, enough to drive the models at realistic tile sizes"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+
+def mosaic_for_tiles(count, panel_like=False):
+    """Mosaic holding at least `count` full tiles, eight per row"""
+    cols = min(count, 8)
+    rows = -(-count // cols)
+    mosaic = synthetic_mosaic(cols * TILE_SIZE, rows * TILE_SIZE)
+    if panel_like:
+        # Dark blue with mild noise passes is_likely_panel, so boxes survive filtering
+        mosaic = (mosaic // 16 + np.array([112, 82, 62], dtype=np.uint8)).astype(np.uint8)
+    return mosaic
+
+
+def load_detector(processor, weights):
+    """Trained YOLO if present, otherwise an untrained yolov8n of the same family"""
+    from ultralytics import YOLO
+    weights = weights if os.path.exists(weights) else "yolov8n.yaml"
+    print(f"YOLO weights: {weights}")
+    processor.yolo_model = YOLO(weights)
+
+
+def bench_yolo_batch(args):
+    """Report YOLO tiles/sec for each batch size"""
+    processor = SolarPanelProcessor()
+    load_detector(processor, args.weights)
+    tiles = processor.tile_image_with_mapping(mosaic_for_tiles(args.tiles))[:args.tiles]
+
+    # Warm up so the first batch size doesn't pay for lazy initialisation
+    processor.yolo_batch_size = 1
+    processor.run_yolo_and_store_boxes(tiles[:2])
+
+    for batch_size in args.batch_sizes:
+        processor.yolo_batch_size = batch_size
+        start = time.perf_counter()
+        processor.run_yolo_and_store_boxes(tiles)
+        elapsed = time.perf_counter() - start
+        print(f"batch={batch_size:<4} {len(tiles) / elapsed:8.2f} tiles/sec")
+
+
+def synthetic_crops(count, seed=0):
+    """Random BGR crops with the size spread of detected panels"""
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(20, 300, size=(count, 2))
+    return [rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8) for h, w in sizes]
+
+
+def load_classifier(processor):
+    """Trained classifier if present, otherwise deterministic random weights"""
+    import torch
+    if os.path.exists(CLASSIFIER_PATH):
+        print(f"Classifier weights: {CLASSIFIER_PATH}")
+        processor.load_classifier_model()
+    else:
+        print("Classifier weights: random (seed 0)")
+        torch.manual_seed(0)
+        processor.load_classifier_model(weights_path=None)
+
+
+def classify_per_crop(processor, crops):
+    """Reference path: PIL transform and one forward pass per crop"""
+    import torch
+    from PIL import Image
+
+    transform = classifier_transform()
+    labels = []
+    for crop in crops:
+        tensor = transform(Image.fromarray(crop[:, :, ::-1].copy())).unsqueeze(0).to(processor.device)
+        with torch.no_grad():
+            pred = processor.classifier_model(tensor)
+        labels.append(CLASS_NAMES[torch.argmax(pred, dim=1).item()])
+    return labels
+
+
+def classify_batched(processor, crops):
+    """Batched path used by classify_detected_panels"""
+    labels = []
+    for start in range(0, len(crops), processor.classifier_batch_size):
+        batch = [processor.preprocess_crop(c) for c in crops[start:start + processor.classifier_batch_size]]
+        labels.extend(processor.classify_crops(batch)[0])
+    return labels
+
+
+def classifier_drift(processor, crops):
+    """Largest absolute difference of the classifier inputs and logits between the batched path
+    and the per-crop PIL transform it has to reproduce"""
+    import torch
+    from PIL import Image
+
+    transform = classifier_transform()
+    reference = torch.stack([transform(Image.fromarray(crop[:, :, ::-1].copy())) for crop in crops])
+    batched = processor.classifier_inputs([processor.preprocess_crop(crop) for crop in crops]).cpu()
+    with torch.no_grad():
+        logits = [(processor.classifier_model(reference[i:i + 16].to(processor.device)).cpu(),
+                   processor.classifier_model(batched[i:i + 16].to(processor.device)).cpu())
+                  for i in range(0, len(crops), 16)]
+    return (float((reference - batched).abs().max()),
+            max(float((a - b).abs().max()) for a, b in logits))
+
+
+def bench_classify_batch(args):
+    """Report classifier crops/sec per batch size and how far it is from the per-crop PIL path.
+
+    Inputs and logits are compared, not just labels: untrained weights give
+    every crop the same label, which would hide any preprocessing drift.
+    """
+    processor = SolarPanelProcessor()
+    load_classifier(processor)
+    crops = synthetic_crops(args.crops)
+
+    start = time.perf_counter()
+    reference = classify_per_crop(processor, crops)
+    elapsed = time.perf_counter() - start
+    print(f"per-crop   {len(crops) / elapsed:8.2f} crops/sec")
+
+    baseline = None
+    for batch_size in args.batch_sizes:
+        processor.classifier_batch_size = batch_size
+        start = time.perf_counter()
+        labels = classify_batched(processor, crops)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or labels
+        agreement = np.mean([a == b for a, b in zip(labels, reference)])
+        identical = labels == baseline
+        print(f"batch={batch_size:<4} {len(crops) / elapsed:8.2f} crops/sec  "
+              f"agreement with per-crop PIL path {agreement:.1%}  identical across batch sizes: {identical}")
+
+    input_drift, logit_drift = classifier_drift(processor, crops)
+    print(f"largest difference from the PIL path: inputs {input_drift:.4f} "
+          f"({input_drift * 127.5:.1f} grey levels), logits {logit_drift:.4f}")
+    if input_drift != 0:
+        raise SystemExit("batched preprocessing must match the PIL path exactly")
+
+
+class StubBoxes:
+    """Stand-in for ultralytics Boxes: `data` rows are x1, y1, x2, y2, conf, cls"""
+
+    def __init__(self, boxes, conf=0.9):
+        self.data = np.array([[*box, conf, 0] for box in boxes], dtype=np.float32).reshape(-1, 6)
+
+
+class EmptyDetections:
+    """Stand-in for an ultralytics result without boxes"""
+    boxes = StubBoxes([])
+
+
+def stub_detector(images, **kwargs):
+    """Detector that finds nothing, so only tiling and I/O are measured"""
+    return [EmptyDetections() for _ in images]
+
+
+class StubDetections:
+    """Stand-in for an ultralytics result holding a fixed grid of boxes"""
+
+    def __init__(self, boxes):
+        self.boxes = StubBoxes(boxes)
+
+
+def grid_detector(boxes_per_tile, box_size=40):
+    """Detector that reports a grid of `boxes_per_tile` panel-sized boxes on every tile"""
+    per_row = max(1, TILE_SIZE // box_size)
+    boxes = [[(i % per_row) * box_size, (i // per_row % per_row) * box_size,
+              (i % per_row) * box_size + box_size - 2, (i // per_row % per_row) * box_size + box_size - 2]
+             for i in range(boxes_per_tile)]
+    return lambda images, **kwargs: [StubDetections(boxes) for _ in images]
+
+
+def write_synthetic_tiff(path, width, height, compression=None, block_rows=256):
+    """Single-strip RGB TIFF, the layout tifffile and PIL write by default, filled through a
+    memory map so the generator stays small too"""
+    import tifffile
+    rng = np.random.default_rng(0)
+    block = rng.integers(0, 256, size=(block_rows, width, 3), dtype=np.uint8)
+    if compression is None:
+        pixels = tifffile.memmap(path, shape=(height, width, 3), dtype=np.uint8, photometric="rgb")
+    else:
+        pixels = np.memmap(tempfile.TemporaryFile(), dtype=np.uint8, mode="w+", shape=(height, width, 3))
+    for y in range(0, height, block_rows):
+        pixels[y:y + block_rows] = block[:height - y]
+    if compression is None:
+        pixels.flush()
+    else:
+        tifffile.imwrite(path, pixels, photometric="rgb", compression=compression, rowsperstrip=height)
+    del pixels
+
+
+def write_synthetic_jpeg(path, width, height):
+    import cv2
+    cv2.imwrite(path, synthetic_mosaic(width, height))
+
+
+def bench_stream_memory(args):
+    """Report peak heap use of the pipeline versus mosaic height for each input format"""
+    processor = SolarPanelProcessor(band_rows=args.band_rows)
+    processor.yolo_model = stub_detector
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for fmt in args.formats:
+            for height in args.heights:
+                if fmt == "jpg":
+                    path = os.path.join(workdir, f"mosaic_{height}.jpg")
+                    write_synthetic_jpeg(path, args.width, height)
+                else:
+                    path = os.path.join(workdir, f"mosaic_{height}.tif")
+                    write_synthetic_tiff(path, args.width, height, "zlib" if fmt == "tiff-zlib" else None)
+
+                # tracemalloc sees NumPy buffers but not the disk-backed canvas pages
+                tracemalloc.start()
+                start = time.perf_counter()
+                result = processor.run_pipeline(path)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                del result
+                os.remove(path)
+
+                image_mb = args.width * height * 3 / 2**20
+                print(f"{fmt:<9} {args.width}x{height:<6} decoded {image_mb:8.1f} MB  "
+                      f"peak heap {peak / 2**20:8.1f} MB  {elapsed:6.2f}s")
+
+
+def bench_concurrent_jobs(args):
+    """Report images/sec when several uploads share one processor from worker threads"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    processor = SolarPanelProcessor()
+    load_detector(processor, args.weights)
+    load_classifier(processor)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(workdir, f"image_{i}.jpg")
+            write_synthetic_jpeg(path, args.size, args.size)
+            paths.append(path)
+
+        processor.process_image(paths[0], "warmup.jpg")
+        for workers in args.workers:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(lambda path: processor.process_image(path, os.path.basename(path)), paths))
+            elapsed = time.perf_counter() - start
+            print(f"workers={workers:<3} {len(paths) / elapsed:8.2f} images/sec")
+
+
+def bench_cpu_stages(args):
+    """Report speedup of box filtering, crop resizing and annotation versus worker count"""
+    processor = SolarPanelProcessor()
+    processor.yolo_model = grid_detector(args.boxes)
+    mosaic = mosaic_for_tiles(args.tiles, panel_like=True)
+
+    baseline = None
+    for workers in args.workers:
+        processor.cpu_workers = workers
+        canvas = mosaic.copy()
+        tiles = processor.tile_image_with_mapping(canvas)[:args.tiles]
+
+        start = time.perf_counter()
+        processor.run_yolo_and_store_boxes(tiles)
+        crops = processor.map_tiles(processor.extract_crops, tiles)
+        panels = [{'classification': 'Clean', 'confidence': 0.99,
+                   'mosaic_bbox': [x1 + tile.x_start, y1 + tile.y_start, x2 + tile.x_start, y2 + tile.y_start]}
+                  for tile, tile_crops in zip(tiles, crops) for _, (x1, y1, x2, y2), _ in tile_crops]
+        processor.annotate_mosaic(canvas, panels)
+        elapsed = time.perf_counter() - start
+
+        baseline = baseline or elapsed
+        boxes = sum(len(tile.boxes) for tile in tiles)
+        print(f"workers={workers:<3} {elapsed:7.3f}s  {len(tiles) / elapsed:8.1f} tiles/sec  "
+              f"speedup x{baseline / elapsed:.2f}  ({boxes} boxes kept)")
+
+
+def bench_pipeline_stages(args):
+    """Report per-stage busy time, throughput and queue depths of the streaming stages.
+
+    Inference is simulated with fixed per-tile and per-crop delays, so the
+    numbers show how well decoding, detection and classification overlap.
+    """
+    detect = grid_detector(args.boxes)
+
+    def slow_detector(images, **kwargs):
+        time.sleep(args.detect_ms / 1000 * len(images))
+        return detect(images)
+
+    def slow_classifier(crops):
+        time.sleep(args.classify_ms / 1000 * len(crops))
+        return ["Clean"] * len(crops), [0.99] * len(crops)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "mosaic.tiff")
+        write_synthetic_tiff(path, args.width, args.height, "zlib")
+        for queue_size in args.queue_sizes:
+            processor = SolarPanelProcessor(pipeline_queue_size=queue_size)
+            processor.yolo_model = slow_detector
+            processor.classify_crops = slow_classifier
+            # Random pixels don't look like panels; keep every box so classification has work
+            processor.is_likely_panel = lambda crop: True
+            metrics = processor.run_pipeline(path).metrics
+
+            print(f"queue={queue_size:<3} wall {metrics['wall_seconds']:.2f}s  bottleneck: {metrics['bottleneck']}")
+            for stage in metrics['stages']:
+                print(f"  {stage['stage']:<9} busy {stage['busy_seconds']:7.2f}s  starved {stage['starved_seconds']:7.2f}s  "
+                      f"blocked {stage['blocked_seconds']:7.2f}s  {stage['tiles_per_second'] or 0:9.1f} tiles/sec")
+            for q in metrics['queues']:
+                print(f"  {q['queue']:<18} depth mean {q['mean_depth']:.2f} max {q['max_depth']}/{q['capacity']}")
+
+
+def backend_variants(backends, quantizations):
+    """(backend, quantize) pairs that can run here, skipping ONNX without ONNX Runtime. INT8 runs
+    on ONNX only: elsewhere dynamic quantization covers just the classifier's Linear head, which
+    leaves the convolutions, and so the cost, unchanged"""
+    from inference_backends import require_onnxruntime
+    for backend in backends:
+        if backend == "onnx":
+            try:
+                require_onnxruntime()
+            except RuntimeError as e:
+                print(f"skipping onnx: {e}")
+                continue
+        for quantize in quantizations:
+            if quantize and backend != "onnx":
+                continue
+            yield backend, quantize
+
+
+def classifier_logits(processor, crops, batch_size):
+    """Raw classifier outputs for crops, before softmax and argmax"""
+    import torch
+    with torch.no_grad():
+        return torch.cat([processor.classifier_model(processor.classifier_inputs(crops[i:i + batch_size])).float().cpu()
+                          for i in range(0, len(crops), batch_size)]).numpy()
+
+
+def raw_detections(yolo, images, batch_size):
+    """The detector's predictions before the confidence filter and NMS, (images, 4 + classes, anchors).
+    Untrained weights score every anchor far below YOLO_CONF, so the final boxes would compare nothing."""
+    import torch
+    yolo(images[:1], verbose=False)
+    predictor = yolo.predictor
+    outputs = []
+    with torch.no_grad():
+        for i in range(0, len(images), batch_size):
+            out = predictor.model(predictor.preprocess(images[i:i + batch_size]))
+            # Eager PyTorch also returns the per-level feature maps
+            out = out[0] if isinstance(out, (list, tuple)) else out
+            outputs.append(np.asarray(out.cpu() if hasattr(out, "cpu") else out, dtype=np.float32))
+    return np.concatenate(outputs)
+
+
+def bench_backends(args):
+    """Classifier and detector latency per inference backend, with parity of their raw outputs
+    against the first backend"""
+    import torch
+    from processor import CLASSIFIER_INPUT_SIZE
+
+    crops = [SolarPanelProcessor().preprocess_crop(c) for c in synthetic_crops(args.crops)]
+    tiles = [tile.image for tile in SolarPanelProcessor().tile_image_with_mapping(mosaic_for_tiles(args.tiles))]
+    tiles = tiles[:args.tiles]
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        reference = None
+        for backend, quantize in backend_variants(args.backends, args.quantize):
+            processor = SolarPanelProcessor(inference_backend=backend, quantize=quantize,
+                                            intra_op_threads=args.threads, export_dir=export_dir)
+            load_classifier(processor)
+            processor.classify_crops(crops[:2])
+
+            start = time.perf_counter()
+            labels = []
+            for begin in range(0, len(crops), args.batch_size):
+                labels += processor.classify_crops(crops[begin:begin + args.batch_size])[0]
+            elapsed = time.perf_counter() - start
+
+            single = torch.zeros((1, 3, CLASSIFIER_INPUT_SIZE, CLASSIFIER_INPUT_SIZE))
+            start = time.perf_counter()
+            with torch.no_grad():
+                for _ in range(args.repeats):
+                    processor.classifier_model(single)
+            latency = (time.perf_counter() - start) / args.repeats
+
+            # Logits, not labels: untrained weights give nearly every crop the same label
+            logits = classifier_logits(processor, crops, args.batch_size)
+            reference = reference or (labels, logits)
+            agreement = np.mean([a == b for a, b in zip(labels, reference[0])])
+            drift = float(np.abs(logits - reference[1]).max())
+            name = backend + (f"+{quantize}" if quantize else "")
+            print(f"classifier {name:<17} {len(crops) / elapsed:8.1f} crops/sec  latency {latency * 1000:7.1f} ms  "
+                  f"vs {args.backends[0]}: label agreement {agreement:.1%}, max logit difference {drift:.2e}")
+
+        reference = None
+        for backend, quantize in backend_variants(args.backends, args.quantize):
+            from inference_backends import export_detector
+            from ultralytics import YOLO
+            weights = args.weights if os.path.exists(args.weights) else "yolov8n.yaml"
+            processor = SolarPanelProcessor(yolo_batch_size=args.batch_size)
+            processor.yolo_model = YOLO(export_detector(weights, backend, quantize, export_dir, "bench"), task="detect")
+            list(processor.detect_tiles(tiles[:1]))
+
+            start = time.perf_counter()
+            counts = [len(result.boxes.data) for result in processor.detect_tiles(tiles)]
+            elapsed = time.perf_counter() - start
+
+            raw = raw_detections(processor.yolo_model, tiles, args.batch_size)
+            reference = reference or (counts, raw)
+            agreement = np.mean([a == b for a, b in zip(counts, reference[0])])
+            name = backend + (f"+{quantize}" if quantize else "")
+            if raw.shape == reference[1].shape:
+                difference = np.abs(raw - reference[1])
+                parity = (f"max box difference {difference[:, :4].max():.2e} px, "
+                          f"max class score difference {difference[:, 4:].max():.2e}")
+            else:
+                parity = f"raw output shape {raw.shape} differs from {reference[1].shape}"
+            print(f"detector   {name:<17} {len(tiles) / elapsed:8.2f} tiles/sec  {sum(counts)} boxes  "
+                  f"vs {args.backends[0]}: per-tile box count agreement {agreement:.1%}, {parity}")
+
+
+def random_boxes(count, rng, size=TILE_SIZE):
+    """Boxes of mixed sizes, some too small to keep and some running off the tile"""
+    x1 = rng.integers(0, size - 10, count)
+    y1 = rng.integers(0, size - 10, count)
+    w = rng.integers(5, 250, count)
+    h = rng.integers(5, 250, count)
+    return np.stack([x1, y1, np.minimum(x1 + w, size), np.minimum(y1 + h, size)], axis=1)
+
+
+def likely_panels_per_box(processor, image, boxes):
+    """Reference path: one crop, HSV conversion and three means per box"""
+    keep = []
+    for x1, y1, x2, y2 in boxes.tolist():
+        crop = image[max(0, y1):min(image.shape[0], y2), max(0, x1):min(image.shape[1], x2)]
+        keep.append(crop.shape[0] >= 20 and crop.shape[1] >= 20 and processor.is_likely_panel(crop))
+    return np.array(keep, dtype=bool)
+
+
+def bench_panel_filter(args):
+    """Report boxes/sec of the per-box filter and likely_panels, and check their decisions agree"""
+    processor = SolarPanelProcessor()
+    rng = np.random.default_rng(0)
+    # Half panel-like tiles, half random ones, so both outcomes are common
+    tiles = [mosaic_for_tiles(1, panel_like=i % 2 == 0)[:TILE_SIZE, :TILE_SIZE] for i in range(args.tiles)]
+    tiles = [np.ascontiguousarray(tile) for tile in tiles]
+    for count in args.boxes:
+        boxes = [random_boxes(count, rng) for _ in tiles]
+
+        start = time.perf_counter()
+        reference = [likely_panels_per_box(processor, tile, b) for tile, b in zip(tiles, boxes)]
+        per_box = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vectorized = [processor.likely_panels(tile, b) for tile, b in zip(tiles, boxes)]
+        summed = time.perf_counter() - start
+
+        identical = all(np.array_equal(a, b) for a, b in zip(reference, vectorized))
+        kept = sum(int(k.sum()) for k in vectorized)
+        total = count * len(tiles)
+        print(f"boxes/tile={count:<5} per-box {total / per_box:10.0f} boxes/sec  "
+              f"likely_panels {total / summed:10.0f} boxes/sec  speedup x{per_box / summed:.1f}  "
+              f"kept {kept}/{total}  identical decisions: {identical}")
+        if not identical:
+            raise SystemExit("panel filter decisions differ")
+
+
+def seam_mosaic(width, height, panel_size=(150, 90), seed=0):
+    """Grey mosaic with panel-like rectangles on a loose grid, some straddling tile seams.
+    Returns the mosaic and the ground-truth boxes."""
+    rng = np.random.default_rng(seed)
+    mosaic = np.full((height, width, 3), 100, dtype=np.uint8)
+    panel_w, panel_h = panel_size
+    truth = []
+    for row in range(40, height - panel_h - 80, panel_h + 90):
+        for column in range(40, width - panel_w - 80, panel_w + 110):
+            x, y = column + int(rng.integers(0, 40)), row + int(rng.integers(0, 40))
+            noise = rng.integers(0, 16, size=(panel_h, panel_w, 3), dtype=np.uint8)
+            mosaic[y:y + panel_h, x:x + panel_w] = noise + np.array([112, 82, 62], dtype=np.uint8)
+            truth.append([x, y, x + panel_w, y + panel_h])
+    return mosaic, truth
+
+
+def contour_detector(images, imgsz=None, **kwargs):
+    """Detector that boxes every saturated blob, clipped panels included.
+    With `imgsz` it looks at a copy scaled to that size, like YOLO at a reduced input size"""
+    import cv2
+    results = []
+    for image in images:
+        scale = imgsz / max(image.shape[:2]) if imgsz else 1.0
+        if scale != 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        saturation = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)[:, :, 1]
+        contours, _ = cv2.findContours((saturation > 60).astype(np.uint8), cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            boxes.append([int(x / scale), int(y / scale), int((x + w) / scale), int((y + h) / scale)])
+        results.append(StubDetections(boxes))
+    return results
+
+
+def bench_seam_check(args):
+    """Check that panels straddling tile seams are drawn and counted exactly once"""
+    import cv2
+    processor = SolarPanelProcessor(tile_overlap=args.overlap)
+    processor.yolo_model = contour_detector
+    processor.classify_crops = lambda crops: (["Clean"] * len(crops), [0.99] * len(crops))
+    mosaic, truth = seam_mosaic(args.width, args.height)
+    stride = processor.tile_stride
+    straddling = sum(1 for x1, y1, x2, y2 in truth
+                     if x1 // stride != (x2 - 1) // stride or y1 // stride != (y2 - 1) // stride)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "seams.png")
+        cv2.imwrite(path, mosaic)
+        start = time.perf_counter()
+        result = processor.run_pipeline(path)
+        elapsed = time.perf_counter() - start
+
+    panels = result.classification_results
+    # Labels sit inside the boxes, so every drawn box is one outer green contour
+    green = np.all(result.mosaic == (0, 255, 0), axis=-1).astype(np.uint8)
+    contours, _ = cv2.findContours(green, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    drawn = len(contours)
+
+    # Drawing cell by cell must match drawing every panel onto the whole mosaic
+    serial = mosaic.copy()
+    for panel in panels:
+        processor.draw_panel(serial, panel)
+    identical = np.array_equal(serial, np.asarray(result.mosaic))
+
+    print(f"{args.width}x{args.height} overlap={args.overlap}: {len(truth)} panels "
+          f"({straddling} on seams), counted {len(panels)}, drawn {drawn}, "
+          f"matches serial drawing: {identical}  {elapsed:.2f}s")
+    if not (len(truth) == len(panels) == drawn and identical):
+        raise SystemExit("seam check failed")
+
+
+def rss_mb(pids):
+    """Summed resident memory of processes, read from /proc (Linux)"""
+    total = 0
+    for pid in pids:
+        with open(f"/proc/{pid}/status") as f:
+            total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    return total / 1024
+
+
+def serving_env():
+    """Point spawned processes at stand-in models when the trained weights are missing"""
+    if not os.path.exists(YOLO_MODEL_PATH):
+        os.environ["YOLO_MODEL_PATH"] = "yolov8n.yaml"
+    if not os.path.exists(CLASSIFIER_PATH):
+        os.environ["CLASSIFIER_PATH"] = ""
+
+
+_replica = None
+
+
+def _init_replica():
+    global _replica
+    _replica = SolarPanelProcessor(cpu_workers=1)
+    _replica.warm_up()
+
+
+def _replica_process(path):
+    _replica.process_image(path, os.path.basename(path))
+    return os.getpid()
+
+
+def bench_serving(args):
+    """Images/sec and total memory: one process with shared model workers versus one model copy per process"""
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    import multiprocessing
+    from inference_pool import InferencePool
+
+    serving_env()
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(workdir, f"image_{i}.jpg")
+            write_synthetic_jpeg(path, args.size, args.size)
+            paths.append(path)
+
+        for workers in args.workers:
+            # Jobs share one processor; the models live once per inference worker
+            pool = InferencePool(workers)
+            processor = SolarPanelProcessor(inference_pool=pool)
+            try:
+                processor.load_models()
+                processor.process_image(paths[0], "warmup.jpg")
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as jobs:
+                    list(jobs.map(lambda path: processor.process_image(path, os.path.basename(path)), paths))
+                elapsed = time.perf_counter() - start
+                memory = rss_mb([os.getpid()] + pool.pids())
+            finally:
+                pool.shutdown()
+            print(f"pool     workers={workers:<3} {len(paths) / elapsed:8.2f} images/sec  {memory:8.0f} MB RSS")
+
+            # Like `uvicorn --workers N`: every process loads its own models and caches
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_replica) as replicas:
+                list(replicas.map(_replica_process, paths[:workers]))
+                start = time.perf_counter()
+                pids = set(replicas.map(_replica_process, paths))
+                elapsed = time.perf_counter() - start
+                memory = rss_mb([os.getpid()] + [process.pid for process in replicas._processes.values()])
+            print(f"replicas workers={workers:<3} {len(paths) / elapsed:8.2f} images/sec  {memory:8.0f} MB RSS  "
+                  f"({len(pids)} processes used)")
+
+
+def bench_pyramid(args):
+    """Compare writing one annotated JPEG with writing the Deep Zoom pyramid, and what a viewer downloads"""
+    import cv2
+    from tile_pyramid import build_pyramid, tile_grid
+    processor = SolarPanelProcessor(cpu_workers=args.workers)
+    mosaic = synthetic_mosaic(args.width, args.height)
+    # Noise barely compresses; a smooth mosaic gives realistic JPEG sizes
+    mosaic = cv2.GaussianBlur(mosaic, (0, 0), 8)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        jpeg_path = os.path.join(workdir, "annotated.jpg")
+        start = time.perf_counter()
+        processor.restitch_tiles(mosaic, jpeg_path)
+        jpeg_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pyramid = build_pyramid(mosaic, os.path.join(workdir, "annotated.dzi"), args.tile_size,
+                                map_tiles=processor.map_tiles, workdir=workdir)
+        pyramid_seconds = time.perf_counter() - start
+        files_dir = os.path.join(workdir, "annotated_files")
+        tiles = sum(len(os.listdir(os.path.join(files_dir, level))) for level in os.listdir(files_dir))
+
+        # A viewport fitted to the whole mosaic loads one level, the coarsest that covers it
+        top = pyramid['levels'] - 1
+        scale = min(args.viewport[0] / args.width, args.viewport[1] / args.height)
+        level = min(top, top + int(np.ceil(np.log2(scale))))
+        level_dir = os.path.join(files_dir, str(level))
+        fitted = sum(os.path.getsize(os.path.join(level_dir, name)) for name in os.listdir(level_dir))
+        # Zoomed to full resolution, only the tiles under the viewport
+        grid = tile_grid(args.viewport[0], args.viewport[1], args.tile_size)
+        zoomed = sum(os.path.getsize(os.path.join(files_dir, str(top), f"{col}_{row}.jpg")) for _, _, col, row in grid)
+        jpeg_mb = os.path.getsize(jpeg_path) / 2**20
+
+    print(f"{args.width}x{args.height}: single JPEG {jpeg_seconds:6.2f}s {jpeg_mb:8.2f} MB   "
+          f"pyramid {pyramid_seconds:6.2f}s, {pyramid['levels']} levels, {tiles} tiles")
+    print(f"viewer download for a {args.viewport[0]}x{args.viewport[1]} view: fitted {fitted / 2**20:6.2f} MB, "
+          f"zoomed to 1:1 {zoomed / 2**20:6.2f} MB, versus {jpeg_mb:8.2f} MB for the whole JPEG")
+
+
+def synthetic_panels(count, width, height, seed=0):
+    """Panel dicts shaped like a run's results, scattered over a width x height mosaic"""
+    rng = np.random.default_rng(seed)
+    stride = TILE_SIZE - TILE_OVERLAP
+    panels = []
+    for i in range(count):
+        x, y = int(rng.integers(0, width - 200)), int(rng.integers(0, height - 150))
+        w, h = int(rng.integers(20, 200)), int(rng.integers(20, 150))
+        tile_x, tile_y = x // stride * stride, y // stride * stride
+        panels.append({
+            'panel_id': f"tile_{tile_x}_{tile_y}.jpg_{i % 8}",
+            'classification': CLASS_NAMES[i % len(CLASS_NAMES)],
+            'confidence': float(rng.random()),
+            'detection_confidence': float(rng.random()),
+            'bbox': [x - tile_x, y - tile_y, x + w - tile_x, y + h - tile_y],
+            'mosaic_bbox': [x, y, x + w, y + h],
+        })
+    return panels
+
+
+def bench_detections(args):
+    """Region queries on the detection store versus scanning the panel list, and response sizes"""
+    import json
+    from detection_store import DetectionStore
+    panels = synthetic_panels(args.panels, args.width, args.height)
+    start = time.perf_counter()
+    store = DetectionStore.from_panels(panels, args.width, args.height, CLASS_NAMES)
+    build_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(1)
+    regions = [(int(x), int(y), int(x) + args.viewport[0], int(y) + args.viewport[1])
+               for x, y in zip(rng.integers(0, args.width, args.queries), rng.integers(0, args.height, args.queries))]
+
+    start = time.perf_counter()
+    scanned = [sum(1 for p in panels if p['mosaic_bbox'][0] < x2 and p['mosaic_bbox'][2] > x1
+                   and p['mosaic_bbox'][1] < y2 and p['mosaic_bbox'][3] > y1) for x1, y1, x2, y2 in regions]
+    scan_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+    start = time.perf_counter()
+    indexed = [store.query(region)[0] for region in regions]
+    index_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "detections.npz")
+        store.save(path)
+        store_mb = os.path.getsize(path) / 2**20
+    full_mb = len(json.dumps(panels)) / 2**20
+    page_kb = len(json.dumps(store.to_dicts(store.query(regions[0], limit=1000)[1]))) / 2**10
+
+    print(f"{args.panels} panels: store built in {build_seconds:.2f}s, {store_mb:.1f} MB on disk "
+          f"versus {full_mb:.1f} MB of JSON in one response")
+    print(f"{args.viewport[0]}x{args.viewport[1]} region query: list scan {scan_ms:8.2f} ms, "
+          f"grid index {index_ms:6.3f} ms, same counts: {scanned == indexed}, one page {page_kb:.1f} KB")
+    if scanned != indexed:
+        raise SystemExit("detection store disagrees with the list scan")
+
+
+def legacy_excel_report(panels, path):
+    """The report as it used to be written: per-class scans and pandas through openpyxl"""
+    import pandas as pd
+    counts = {name: len([p for p in panels if p['classification'] == name]) for name in CLASS_NAMES}
+    summary = pd.DataFrame({'Metric': ['Total Panels Detected'] + [f'{name} Panels' for name in CLASS_NAMES],
+                            'Value': [len(panels)] + list(counts.values())})
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        summary.to_excel(writer, sheet_name='Summary', index=False)
+        pd.DataFrame(panels).to_excel(writer, sheet_name='Detailed Results', index=False)
+    return counts
+
+
+def bench_reports(args):
+    """Time and peak Python heap of each report writer"""
+    from detection_store import DetectionStore
+    from reports import write_report
+    panels = synthetic_panels(args.panels, 40000, 30000)
+    store = DetectionStore.from_panels(panels, 40000, 30000, CLASS_NAMES)
+
+    writers = [("legacy xlsx", lambda path: legacy_excel_report(panels, path), "xlsx")]
+    writers += [(fmt, lambda path, fmt=fmt: write_report(store, path, fmt), fmt) for fmt in args.formats]
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, write, extension in writers:
+            path = os.path.join(workdir, f"report.{extension}")
+            start = time.perf_counter()
+            try:
+                write(path)
+            except RuntimeError as e:
+                print(f"{name:<12} skipped: {e}")
+                continue
+            elapsed = time.perf_counter() - start
+            # Separate run: tracing slows allocation-heavy code several times over
+            tracemalloc.start()
+            write(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name:<12} {args.panels} panels {elapsed:7.2f}s  peak heap {peak / 2**20:8.1f} MB  "
+                  f"file {os.path.getsize(path) / 2**20:6.1f} MB")
+            os.remove(path)
+
+
+def bench_locations(args):
+    """Panel locations: per-panel versus vectorized transform, then streamed export time and peak heap"""
+    import json
+    from detection_store import DetectionStore
+    from georeference import Georeference
+    from reports import location_chunks
+    panels = synthetic_panels(args.panels, 40000, 30000)
+    store = DetectionStore.from_panels(panels, 40000, 30000, CLASS_NAMES)
+    # A 5 cm UTM 33N orthomosaic
+    georeference = Georeference(40000, 30000, affine=(0.05, 0.0, 448000.0, 0.0, -0.05, 5412000.0), epsg=32633)
+
+    sample = store.panels[:min(len(store), 10000)]
+    start = time.perf_counter()
+    looped = [georeference.to_lat_lon([(p['x1'] + p['x2']) / 2], [(p['y1'] + p['y2']) / 2]) for p in sample]
+    loop_seconds = (time.perf_counter() - start) * len(store) / len(sample)
+    start = time.perf_counter()
+    store.add_locations(georeference)
+    vector_seconds = time.perf_counter() - start
+    error = max(abs(float(lat[0]) - row['latitude']) + abs(float(lon[0]) - row['longitude'])
+                for (lat, lon), row in zip(looped, store.panels[:len(sample)]))
+    print(f"{args.panels} panels: per-panel transform {loop_seconds:7.2f}s (extrapolated), "
+          f"vectorized {vector_seconds * 1000:7.1f} ms, largest difference {error:.1e} degrees")
+
+    def whole_geojson():
+        """Everything built in memory first, the way a single JSON response would be"""
+        features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [p['longitude'], p['latitude']]},
+                     'properties': p} for p in store.to_dicts(store.panels)]
+        return len(json.dumps({'type': 'FeatureCollection', 'features': features}))
+
+    exports = [("geojson in one piece", whole_geojson)]
+    exports += [(f"{fmt} streamed", lambda fmt=fmt: sum(len(chunk) for chunk in location_chunks(store, fmt)))
+                for fmt in args.formats]
+    for name, export in exports:
+        start = time.perf_counter()
+        size = export()
+        elapsed = time.perf_counter() - start
+        # Separate run: tracing slows allocation-heavy code several times over
+        tracemalloc.start()
+        export()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:<21} {elapsed:7.2f}s  peak heap {peak / 2**20:8.1f} MB  output {size / 2**20:6.1f} MB")
+
+
+# Module tints (BGR) of the synthetic arrays: saturated enough for contour_detector and the panel filter
+MODULE_TINTS = np.array([[112, 82, 62], [120, 96, 80], [100, 74, 58], [130, 104, 84]], dtype=np.uint8)
+
+
+def panel_array_mosaic(width, height, coverage=0.5, module=(60, 36), gap=4, seed=0, padding=0.0):
+    """Ground texture with a rectangular array of panel modules in about `coverage` of 1024px blocks,
+    and a black no-data margin over the right and bottom `padding` share, as in orthomosaics.
+    Returns the mosaic and the number of modules drawn."""
+    import cv2
+    rng = np.random.default_rng(seed)
+    # Coarse grey noise scaled up: textured like ground, unsaturated so nothing there is detected
+    ground = rng.integers(80, 140, size=(-(-height // 8), -(-width // 8)), dtype=np.uint8)
+    ground = cv2.resize(ground, (width, height), interpolation=cv2.INTER_LINEAR)
+    mosaic = np.repeat(ground[:, :, None], 3, axis=2)
+    module_w, module_h = module
+    modules = 0
+    block = 1024
+    for block_y in range(0, height, block):
+        for block_x in range(0, width, block):
+            if rng.random() >= coverage:
+                continue
+            rows, cols = int(rng.integers(2, 6)), int(rng.integers(6, 14))
+            array_w, array_h = cols * (module_w + gap), rows * (module_h + gap)
+            x0 = block_x + int(rng.integers(0, max(1, block - array_w)))
+            y0 = block_y + int(rng.integers(0, max(1, block - array_h)))
+            for row in range(rows):
+                for col in range(cols):
+                    x, y = x0 + col * (module_w + gap), y0 + row * (module_h + gap)
+                    if x + module_w > width or y + module_h > height:
+                        continue
+                    noise = rng.integers(0, 16, size=(module_h, module_w, 3), dtype=np.uint8)
+                    mosaic[y:y + module_h, x:x + module_w] = noise + MODULE_TINTS[int(rng.integers(0, 4))]
+                    modules += 1
+    if padding:
+        # Arrays under the margin are blanked too; the count covers only what is left visible
+        mosaic[:, int(width * (1 - padding)):] = 0
+        mosaic[int(height * (1 - padding)):] = 0
+        saturation = cv2.cvtColor(mosaic, cv2.COLOR_BGR2HSV)[:, :, 1]
+        modules = cv2.connectedComponents((saturation > 60).astype(np.uint8))[0] - 1
+    return mosaic, modules
+
+
+def stub_classifier(crops):
+    """Deterministic labels from each crop's mean, so class counts are stable across runs"""
+    labels = [CLASS_NAMES[int(crop.mean()) // 4 % len(CLASS_NAMES)] for crop in crops]
+    return labels, [0.9] * len(crops)
+
+
+def end_to_end_processor(args):
+    """A processor with the requested detector and classifier: stub, random weights or the trained ones"""
+    import torch
+    from ultralytics import YOLO
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    processor = SolarPanelProcessor(cpu_workers=args.cpu_workers, result_cache=None, tile_cache=None,
+                                    tile_pyramid=not args.no_pyramid, report_format=args.report_format)
+    for name, path in (("detector", YOLO_MODEL_PATH), ("classifier", CLASSIFIER_PATH)):
+        if getattr(args, name) == "real" and not os.path.exists(path):
+            raise SystemExit(f"--{name} real needs the trained weights at {path}")
+
+    if args.detector == "stub":
+        processor.yolo_model = contour_detector
+    else:
+        processor.yolo_model = YOLO(YOLO_MODEL_PATH if args.detector == "real" else "yolov8n.yaml")
+    if args.classifier == "stub":
+        processor.classifier_model = "stub"
+        processor.classify_crops = stub_classifier
+    else:
+        processor.load_classifier_model(CLASSIFIER_PATH if args.classifier == "real" else None)
+    return processor
+
+
+def environment_info():
+    """What a result depends on besides the code: versions, CPU and the commit measured"""
+    import platform
+    import subprocess
+    import cv2
+    import torch
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def median_run(runs):
+    """Medians over repeats of the headline numbers and of each stage's wall time"""
+    stages = sorted({name for run in runs for name in run['stages']})
+    return {
+        **{key: round(float(np.median([run[key] for run in runs])), 4)
+           for key in ('wall_seconds', 'report_seconds', 'tiles_per_second', 'panels_per_second', 'peak_rss_mb')},
+        'stage_seconds': {name: round(float(np.median([run['stages'].get(name, {}).get('wall_seconds', 0.0)
+                                                       for run in runs])), 4) for name in stages},
+    }
+
+
+def compare_to_baseline(results, baseline_path, tolerance):
+    """Print throughput and memory against an earlier run; True if throughput held within tolerance"""
+    import sys
+    import json
+    with open(baseline_path) as f:
+        baseline = {entry['size']: entry['median'] for entry in json.load(f)['results']}
+    ok = True
+    for entry in results:
+        before = baseline.get(entry['size'])
+        if before is None:
+            print(f"{entry['size']}: not in baseline", file=sys.stderr)
+            continue
+        now = entry['median']
+        ratio = now['tiles_per_second'] / before['tiles_per_second']
+        print(f"{entry['size']}: {before['tiles_per_second']:.1f} -> {now['tiles_per_second']:.1f} tiles/sec "
+              f"(x{ratio:.2f}), peak RSS {before['peak_rss_mb']:.0f} -> {now['peak_rss_mb']:.0f} MB",
+              file=sys.stderr)
+        ok &= ratio >= 1 - tolerance
+    return ok
+
+
+def use_scratch_outputs(workdir):
+    """Send process_image's outputs and workspaces to a scratch directory instead of the server's folders"""
+    import processor as backend
+    backend.OUTPUT_DIR = os.path.join(workdir, "outputs")
+    backend.WORKSPACE_DIR = os.path.join(workdir, "workspaces")
+    os.makedirs(backend.OUTPUT_DIR)
+    return backend.OUTPUT_DIR
+
+
+def bench_end_to_end(args):
+    """process_image on synthetic panel-array mosaics, reported as JSON comparable across commits"""
+    import json
+    import cv2
+
+    processor = end_to_end_processor(args)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        output_dir = use_scratch_outputs(workdir)
+        for size in args.sizes:
+            width, height = (int(v) for v in size.lower().split("x"))
+            mosaic, modules = panel_array_mosaic(width, height, args.coverage, seed=args.seed)
+            path = os.path.join(workdir, f"mosaic_{size}.png" if args.format == "png" else f"mosaic_{size}.jpg")
+            cv2.imwrite(path, mosaic)
+            del mosaic
+
+            runs = []
+            for repeat in range(args.warmup + args.repeats):
+                start = time.perf_counter()
+                result = processor.process_image(path, f"bench_{size}.{args.format}")
+                returned = time.perf_counter()
+                # Reports are written after process_image returns; the single report thread runs in order
+                processor.report_pool.submit(lambda: None).result()
+                finished = time.perf_counter()
+                if repeat < args.warmup:
+                    continue
+                profile = result['profile']
+                tiles, panels = result['stats']['tiles'], result['summary']['total_panels']
+                runs.append({
+                    'wall_seconds': round(finished - start, 4),
+                    'report_seconds': round(finished - returned, 4),
+                    'tiles_per_second': round(tiles / (finished - start), 2),
+                    'panels_per_second': round(panels / (finished - start), 2),
+                    'peak_rss_mb': round((profile['peak_rss_bytes'] or 0) / 2**20, 1),
+                    'tiles': tiles,
+                    'panels': panels,
+                    'stages': profile['stages'],
+                    'counts': profile['counts'],
+                })
+                for name in os.listdir(output_dir):
+                    target = os.path.join(output_dir, name)
+                    shutil.rmtree(target) if os.path.isdir(target) else os.remove(target)
+
+            results.append({
+                'size': size,
+                'width': width,
+                'height': height,
+                'modules_drawn': modules,
+                'file_mb': round(os.path.getsize(path) / 2**20, 2),
+                'median': median_run(runs),
+                'runs': runs,
+            })
+            os.remove(path)
+
+    report = {
+        'benchmark': 'end-to-end',
+        'environment': environment_info(),
+        'config': {
+            'detector': args.detector, 'classifier': args.classifier, 'format': args.format,
+            'coverage': args.coverage, 'seed': args.seed, 'repeats': args.repeats, 'warmup': args.warmup,
+            'cpu_workers': args.cpu_workers, 'threads': args.threads, 'tile_size': TILE_SIZE,
+            'tile_overlap': processor.tile_overlap, 'yolo_batch_size': processor.yolo_batch_size,
+            'classifier_batch_size': processor.classifier_batch_size, 'band_rows': processor.band_rows,
+            'tile_pyramid': processor.tile_pyramid, 'report_format': processor.report_format,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline and not compare_to_baseline(results, args.baseline, args.tolerance):
+        raise SystemExit(f"throughput fell by more than {args.tolerance:.0%} against {args.baseline}")
+
+
+def bench_batch(args):
+    """Images/sec over a folder of frames: one at a time, concurrently, and concurrently with shared model batches"""
+    import cv2
+    from concurrent.futures import ThreadPoolExecutor
+
+    with tempfile.TemporaryDirectory() as workdir:
+        use_scratch_outputs(workdir)
+        paths = []
+        for i in range(args.images + 1):
+            mosaic, _ = panel_array_mosaic(args.width, args.height, coverage=1.0, seed=i)
+            paths.append(os.path.join(workdir, f"frame_{i}.jpg"))
+            cv2.imwrite(paths[-1], mosaic)
+        warmup, paths = paths[0], paths[1:]
+
+        baseline = None
+        for label, workers, shared in [("one at a time", 1, False), (f"{args.workers} concurrent", args.workers, False),
+                                       (f"{args.workers} concurrent, shared batches", args.workers, True)]:
+            processor = end_to_end_processor(args)
+            processor.process_image(warmup, "warmup.jpg")
+            sharing = processor.shared_batches(args.wait_ms / 1000) if shared else contextlib.nullcontext()
+            with sharing as batchers:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(lambda path: processor.process_image(path, os.path.basename(path),
+                                                                                 batchers=batchers), paths))
+                processor.report_pool.submit(lambda: None).result()
+                elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            panels = sum(result['summary']['total_panels'] for result in results)
+            batches = ""
+            if shared:
+                batches = (f"  mean batch: {batchers['detect'].mean_batch_size:.1f} tiles, "
+                           f"{batchers['classify'].mean_batch_size:.1f} crops")
+            print(f"{label:<34} {len(paths) / elapsed:7.2f} images/sec  x{baseline / elapsed:.2f}  "
+                  f"{panels} panels{batches}")
+
+
+def bench_prescreen(args):
+    """Tiles skipped by each pre-screen and the panels it costs, against running YOLO on every tile"""
+    import cv2
+    mosaic, modules = panel_array_mosaic(args.width, args.height, args.coverage, seed=args.seed, padding=args.padding)
+    processor = end_to_end_processor(args)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "mosaic.png")
+        cv2.imwrite(path, mosaic)
+        del mosaic
+        reference = None
+        worst = 1.0
+        for mode in ["", *args.modes]:
+            processor.prescreen = mode
+            start = time.perf_counter()
+            result = processor.run_pipeline(path)
+            elapsed = time.perf_counter() - start
+            found = {tuple(panel['mosaic_bbox']) for panel in result.classification_results}
+            reference = reference if reference is not None else found
+            recall = len(found & reference) / len(reference) if reference else 1.0
+            worst = min(worst, recall)
+            stats = result.stats
+            print(f"{mode or 'off':<7} {elapsed:7.2f}s  skipped {stats['prescreen_skipped']:>5}/{stats['tiles']} tiles  "
+                  f"{len(found)} panels  recall {recall:.2%} ({len(reference - found)} lost)")
+
+    print(f"{modules} modules drawn; recall is against the same detector on every tile")
+    if worst < args.min_recall:
+        raise SystemExit(f"pre-screen recall {worst:.2%} is below {args.min_recall:.2%}")
+
+
+def cascade_crops(args):
+    """Preprocessed crops: every image in --crop-dir, or the modules of a synthetic panel array"""
+    import cv2
+    processor = SolarPanelProcessor(result_cache=None, tile_cache=None)
+    if args.crop_dir:
+        names = sorted(os.listdir(args.crop_dir))[:args.crops]
+        crops = [cv2.imread(os.path.join(args.crop_dir, name)) for name in names]
+        crops = [crop for crop in crops if crop is not None]
+    else:
+        mosaic, _ = panel_array_mosaic(4096, 4096, coverage=1.0, seed=args.seed)
+        boxes = contour_detector([mosaic])[0].boxes.data[:args.crops, :4].astype(int)
+        crops = [mosaic[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+    return [processor.preprocess_crop(crop) for crop in crops]
+
+
+def classify_all(processor, crops, func):
+    """(seconds, labels, confidences) of `func(crops) -> (confidences, indices)` in classifier-sized batches"""
+    import torch
+    start = time.perf_counter()
+    results = [func(crops[i:i + processor.classifier_batch_size])
+               for i in range(0, len(crops), processor.classifier_batch_size)]
+    elapsed = time.perf_counter() - start
+    return elapsed, torch.cat([i for _, i in results]).numpy(), torch.cat([c for c, _ in results]).numpy()
+
+
+def bench_cascade(args):
+    """Per-class agreement of the classifier cascade with the full ResNet-50, and its speedup, per threshold"""
+    import torch
+    torch.set_num_threads(args.threads)
+    crops = cascade_crops(args)
+    processor = SolarPanelProcessor(result_cache=None, tile_cache=None, cascade=args.mode,
+                                    cascade_input_size=args.input_size)
+    load_classifier(processor)
+    if args.mode == "resnet18":
+        if os.path.exists(CASCADE_MODEL_PATH):
+            print(f"First-tier weights: {CASCADE_MODEL_PATH}")
+            processor.cascade_model = processor.load_small_classifier()
+        else:
+            print("First-tier weights: random (seed 0)")
+            torch.manual_seed(0)
+            processor.cascade_model = processor.load_small_classifier(weights_path=None)
+
+    # Warm both tiers so neither pays for first-call allocation in the timings
+    classify_all(processor, crops[:processor.classifier_batch_size], processor.classify_cascade)
+    full_time, reference, _ = classify_all(
+        processor, crops, lambda batch: processor.class_probabilities(processor.classifier_model, batch))
+    print(f"{len(crops)} crops; full ResNet-50 {len(crops) / full_time:8.2f} crops/sec")
+    print(f"{'threshold':>9} {'escalated':>9} {'crops/sec':>9} {'speedup':>7} {'agreement':>9}  "
+          + "  ".join(f"{name:>15}" for name in CLASS_NAMES))
+    for threshold in args.thresholds:
+        processor.cascade_threshold = threshold
+        # The escalation rate comes from the first tier alone, outside the timing
+        _, _, first_tier = classify_all(processor, crops, processor.cascade_first_tier)
+        elapsed, labels, _ = classify_all(processor, crops, processor.classify_cascade)
+        per_class = []
+        for index in range(len(CLASS_NAMES)):
+            mask = reference == index
+            per_class.append(f"{np.mean(labels[mask] == index):6.1%} of {mask.sum():>6}" if mask.any() else "-")
+        print(f"{threshold:>9.2f} {np.mean(first_tier < threshold):>9.1%} {len(crops) / elapsed:>9.2f} "
+              f"{full_time / elapsed:>6.2f}x {np.mean(labels == reference):>9.1%}  "
+              + "  ".join(f"{cell:>15}" for cell in per_class))
+    print("agreement per class: share of the crops the full model puts in that class that the cascade labels the same")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    yolo_parser = subparsers.add_parser("yolo-batch", help="YOLO throughput versus batch size")
+    yolo_parser.add_argument("--tiles", type=int, default=64)
+    yolo_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    yolo_parser.add_argument("--weights", default=YOLO_MODEL_PATH)
+    yolo_parser.set_defaults(func=bench_yolo_batch)
+
+    classify_parser = subparsers.add_parser("classify-batch", help="Classifier throughput versus batch size")
+    classify_parser.add_argument("--crops", type=int, default=256)
+    classify_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 32, 64])
+    classify_parser.set_defaults(func=bench_classify_batch)
+
+    memory_parser = subparsers.add_parser("stream-memory", help="Peak memory versus mosaic height")
+    memory_parser.add_argument("--width", type=int, default=4096)
+    memory_parser.add_argument("--heights", type=int, nargs="+", default=[2048, 8192, 32768])
+    # Single-strip TIFFs, uncompressed (memory-mapped) and deflate (inflated a band at a time)
+    memory_parser.add_argument("--formats", nargs="+", choices=["tiff", "tiff-zlib", "jpg"],
+                               default=["tiff", "tiff-zlib", "jpg"])
+    memory_parser.add_argument("--band-rows", type=int, default=1)
+    memory_parser.set_defaults(func=bench_stream_memory)
+
+    jobs_parser = subparsers.add_parser("concurrent-jobs", help="Throughput of concurrent uploads")
+    jobs_parser.add_argument("--images", type=int, default=8)
+    jobs_parser.add_argument("--size", type=int, default=2048)
+    jobs_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    jobs_parser.add_argument("--weights", default=YOLO_MODEL_PATH)
+    jobs_parser.set_defaults(func=bench_concurrent_jobs)
+
+    cpu_parser = subparsers.add_parser("cpu-stages", help="Per-tile CPU stage speedup versus worker count")
+    cpu_parser.add_argument("--tiles", type=int, default=64)
+    cpu_parser.add_argument("--boxes", type=int, default=100, help="detections per tile")
+    cpu_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    cpu_parser.set_defaults(func=bench_cpu_stages)
+
+    pipeline_parser = subparsers.add_parser("pipeline-stages", help="Per-stage metrics of the streaming stages")
+    pipeline_parser.add_argument("--width", type=int, default=4096)
+    pipeline_parser.add_argument("--height", type=int, default=4096)
+    pipeline_parser.add_argument("--boxes", type=int, default=10, help="detections per tile")
+    pipeline_parser.add_argument("--detect-ms", type=float, default=20, help="simulated YOLO time per tile")
+    pipeline_parser.add_argument("--classify-ms", type=float, default=2, help="simulated ResNet time per crop")
+    pipeline_parser.add_argument("--queue-sizes", type=int, nargs="+", default=[1, 2, 4])
+    pipeline_parser.set_defaults(func=bench_pipeline_stages)
+
+    filter_parser = subparsers.add_parser("panel-filter", help="Per-box versus whole-tile panel filter")
+    filter_parser.add_argument("--tiles", type=int, default=16)
+    filter_parser.add_argument("--boxes", type=int, nargs="+", default=[10, 100, 500])
+    filter_parser.set_defaults(func=bench_panel_filter)
+
+    backends_parser = subparsers.add_parser("backends", help="Latency and parity of the inference backends")
+    backends_parser.add_argument("--backends", nargs="+", choices=["torch", "torchscript", "onnx"],
+                                 default=["torch", "torchscript", "onnx"])
+    backends_parser.add_argument("--quantize", nargs="+", choices=["", "int8"], default=["", "int8"],
+                                 help="int8 runs on onnx only; with torch and torchscript it quantizes just the "
+                                      "classifier's Linear head, which has no effect on convolution cost")
+    backends_parser.add_argument("--crops", type=int, default=128)
+    backends_parser.add_argument("--tiles", type=int, default=16)
+    backends_parser.add_argument("--batch-size", type=int, default=16)
+    backends_parser.add_argument("--repeats", type=int, default=10, help="single-crop latency samples")
+    backends_parser.add_argument("--threads", type=int, default=0, help="intra-op threads, 0 for the default")
+    backends_parser.add_argument("--weights", default=YOLO_MODEL_PATH)
+    backends_parser.set_defaults(func=bench_backends)
+
+    seam_parser = subparsers.add_parser("seam-check", help="Panels on tile seams are counted and drawn once")
+    seam_parser.add_argument("--width", type=int, default=2048)
+    seam_parser.add_argument("--height", type=int, default=1536)
+    seam_parser.add_argument("--overlap", type=int, default=TILE_OVERLAP)
+    seam_parser.set_defaults(func=bench_seam_check)
+
+    serving_parser = subparsers.add_parser("serving", help="Shared inference workers versus one process per worker")
+    serving_parser.add_argument("--images", type=int, default=8)
+    serving_parser.add_argument("--size", type=int, default=2048)
+    serving_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    serving_parser.set_defaults(func=bench_serving)
+
+    pyramid_parser = subparsers.add_parser("pyramid", help="Deep Zoom pyramid cost and viewer download size")
+    pyramid_parser.add_argument("--width", type=int, default=8192)
+    pyramid_parser.add_argument("--height", type=int, default=8192)
+    pyramid_parser.add_argument("--tile-size", type=int, default=256)
+    pyramid_parser.add_argument("--workers", type=int, default=4)
+    pyramid_parser.add_argument("--viewport", type=int, nargs=2, default=[1024, 400])
+    pyramid_parser.set_defaults(func=bench_pyramid)
+
+    detections_parser = subparsers.add_parser("detections", help="Detection store region queries and sizes")
+    detections_parser.add_argument("--panels", type=int, default=200000)
+    detections_parser.add_argument("--width", type=int, default=40000)
+    detections_parser.add_argument("--height", type=int, default=30000)
+    detections_parser.add_argument("--queries", type=int, default=20)
+    detections_parser.add_argument("--viewport", type=int, nargs=2, default=[2048, 2048])
+    detections_parser.set_defaults(func=bench_detections)
+
+    reports_parser = subparsers.add_parser("reports", help="Report writers: time and peak memory")
+    reports_parser.add_argument("--panels", type=int, default=100000)
+    reports_parser.add_argument("--formats", nargs="+", choices=["xlsx", "csv", "parquet"],
+                                default=["xlsx", "csv", "parquet"])
+    reports_parser.set_defaults(func=bench_reports)
+
+    locations_parser = subparsers.add_parser("locations", help="Panel lat/lon transform and GeoJSON/CSV export")
+    locations_parser.add_argument("--panels", type=int, default=100000)
+    locations_parser.add_argument("--formats", nargs="+", choices=["geojson", "csv"], default=["geojson", "csv"])
+    locations_parser.set_defaults(func=bench_locations)
+
+    e2e_parser = subparsers.add_parser("end-to-end", help="Whole-image throughput and memory as JSON, for "
+                                       "comparing commits")
+    e2e_parser.add_argument("--sizes", nargs="+", default=["4096x3072"], help="mosaic sizes as WIDTHxHEIGHT")
+    e2e_parser.add_argument("--coverage", type=float, default=0.5, help="share of 1024px blocks holding an array")
+    e2e_parser.add_argument("--format", choices=["jpg", "png"], default="jpg")
+    e2e_parser.add_argument("--detector", choices=["stub", "random", "real"], default="stub",
+                            help="stub boxes saturated blobs; random is an untrained yolov8n and finds little")
+    e2e_parser.add_argument("--classifier", choices=["stub", "random", "real"], default="stub",
+                            help="stub labels crops by their mean; random is ResNet-50 with seeded weights")
+    e2e_parser.add_argument("--repeats", type=int, default=3)
+    e2e_parser.add_argument("--warmup", type=int, default=1)
+    e2e_parser.add_argument("--seed", type=int, default=0)
+    e2e_parser.add_argument("--cpu-workers", type=int, default=4)
+    e2e_parser.add_argument("--threads", type=int, default=1, help="torch intra-op threads")
+    e2e_parser.add_argument("--no-pyramid", action="store_true")
+    e2e_parser.add_argument("--report-format", choices=["xlsx", "csv", "parquet"], default="xlsx")
+    e2e_parser.add_argument("--output", help="write the JSON here instead of stdout")
+    e2e_parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    e2e_parser.add_argument("--tolerance", type=float, default=0.1,
+                            help="fail if tiles/sec falls by more than this fraction against the baseline")
+    e2e_parser.set_defaults(func=bench_end_to_end)
+
+    batch_parser = subparsers.add_parser("batch", help="Many frames: one at a time versus shared model batches")
+    batch_parser.add_argument("--images", type=int, default=12)
+    batch_parser.add_argument("--width", type=int, default=1024)
+    batch_parser.add_argument("--height", type=int, default=768)
+    batch_parser.add_argument("--workers", type=int, default=4, help="images in flight at once")
+    batch_parser.add_argument("--wait-ms", type=float, default=10, help="longest a shared batch waits to fill")
+    batch_parser.add_argument("--detector", choices=["stub", "random", "real"], default="random")
+    batch_parser.add_argument("--classifier", choices=["stub", "random", "real"], default="random")
+    batch_parser.add_argument("--cpu-workers", type=int, default=4)
+    batch_parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="torch intra-op threads")
+    batch_parser.add_argument("--no-pyramid", action="store_true")
+    batch_parser.add_argument("--report-format", choices=["xlsx", "csv", "parquet"], default="csv")
+    batch_parser.set_defaults(func=bench_batch)
+
+    prescreen_parser = subparsers.add_parser("prescreen", help="Tiles skipped before YOLO and the recall kept")
+    prescreen_parser.add_argument("--width", type=int, default=8192)
+    prescreen_parser.add_argument("--height", type=int, default=6144)
+    prescreen_parser.add_argument("--coverage", type=float, default=0.3)
+    prescreen_parser.add_argument("--padding", type=float, default=0.2, help="share of no-data margin")
+    prescreen_parser.add_argument("--seed", type=int, default=0)
+    prescreen_parser.add_argument("--modes", nargs="+", choices=["color", "lowres"], default=["color", "lowres"])
+    prescreen_parser.add_argument("--min-recall", type=float, default=1.0)
+    prescreen_parser.add_argument("--detector", choices=["stub", "random", "real"], default="stub",
+                                  help="use real for a meaningful lowres recall")
+    prescreen_parser.add_argument("--classifier", choices=["stub", "random", "real"], default="stub")
+    prescreen_parser.add_argument("--cpu-workers", type=int, default=4)
+    prescreen_parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="torch intra-op threads")
+    prescreen_parser.set_defaults(func=bench_prescreen, no_pyramid=True, report_format="csv")
+
+    cascade_parser = subparsers.add_parser("cascade", help="Classifier cascade: agreement with ResNet-50 and speedup")
+    cascade_parser.add_argument("--mode", choices=["lowres", "resnet18"], default="lowres")
+    cascade_parser.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.5, 0.7, 0.9, 0.95])
+    cascade_parser.add_argument("--input-size", type=int, default=112, help="first-tier input size of lowres")
+    cascade_parser.add_argument("--crops", type=int, default=512)
+    cascade_parser.add_argument("--crop-dir", help="folder of panel crop images; default: synthetic modules")
+    cascade_parser.add_argument("--seed", type=int, default=0)
+    cascade_parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="torch intra-op threads")
+    cascade_parser.set_defaults(func=bench_cascade)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
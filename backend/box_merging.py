@@ -0,0 +1,99 @@
+"""
+Mosaic-wide de-duplication of detections from overlapping tiles
+"""
+
+import numpy as np
+
+# Boxes are bucketed on a grid whose cells are as big as the largest box, so
+# overlapping boxes always sit in the same or adjacent cells. Looking "forward"
+# at these five cells visits every adjacent pair once.
+_NEIGHBOUR_OFFSETS = ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+
+def candidate_pairs(boxes):
+    """Index pairs (i, j), i != j, of boxes close enough that they might overlap"""
+    count = len(boxes)
+    if count < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    cell = max(float(np.max(boxes[:, 2:] - boxes[:, :2])), 1.0)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    cx = np.floor(centers[:, 0] / cell).astype(np.int64) + 1
+    cy = np.floor(centers[:, 1] / cell).astype(np.int64) + 1
+    columns = int(cx.max()) + 2
+    keys = cy * columns + cx
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    firsts, seconds = [], []
+    for dx, dy in _NEIGHBOUR_OFFSETS:
+        targets = keys + dy * columns + dx
+        lo = np.searchsorted(sorted_keys, targets, side="left")
+        hi = np.searchsorted(sorted_keys, targets, side="right")
+        counts = hi - lo
+        first = np.repeat(np.arange(count), counts)
+        # Position within each [lo, hi) run, expanded without a Python loop
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        second = order[np.repeat(lo, counts) + offsets]
+        if dx == 0 and dy == 0:
+            # Same cell: keep each unordered pair once
+            mask = first < second
+            first, second = first[mask], second[mask]
+        firsts.append(first)
+        seconds.append(second)
+
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def intersection_over_smaller(boxes, first, second):
+    """Overlap of each pair as a fraction of the smaller box, so a clipped half-panel
+    inside the full panel scores 1 even though their IoU is low"""
+    a, b = boxes[first], boxes[second]
+    width = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    height = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return width * height / np.maximum(np.minimum(area_a, area_b), 1e-9)
+
+
+def merge_duplicates(boxes, priorities, threshold=0.5):
+    """Greedy NMS over the whole mosaic: a box is kept unless a kept box of higher
+    priority overlaps it by more than `threshold`. Returns a boolean keep mask.
+
+    Equivalent to the usual sort-and-sweep NMS, but resolved in vectorized rounds
+    over the candidate pairs rather than one box at a time.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    priorities = np.asarray(priorities, dtype=np.float64)
+    count = len(boxes)
+    kept = np.zeros(count, dtype=bool)
+    if count == 0:
+        return kept
+
+    first, second = candidate_pairs(boxes)
+    overlapping = intersection_over_smaller(boxes, first, second) > threshold
+    first, second = first[overlapping], second[overlapping]
+
+    # Orient every pair as (dominant, dominated); ties go to the lower index
+    rank = np.empty(count, dtype=np.int64)
+    rank[np.lexsort((np.arange(count), -priorities))] = np.arange(count)
+    swap = rank[first] > rank[second]
+    dominant = np.where(swap, second, first)
+    dominated = np.where(swap, first, second)
+
+    suppressed = np.zeros(count, dtype=bool)
+    undecided = np.ones(count, dtype=bool)
+    while undecided.any():
+        # Boxes whose every dominator is already suppressed are kept ...
+        live = ~suppressed[dominant]
+        challenged = np.zeros(count, dtype=bool)
+        challenged[dominated[live]] = True
+        kept |= undecided & ~challenged
+        # ... and anything a kept box dominates is suppressed
+        beaten = np.zeros(count, dtype=bool)
+        beaten[dominated[kept[dominant]]] = True
+        suppressed |= undecided & beaten & ~kept
+        undecided &= ~(kept | suppressed)
+
+    return kept
@@ -0,0 +1,140 @@
+"""
+Detections of one mosaic as NumPy columns in mosaic coordinates, with a grid index for region queries
+"""
+
+import numpy as np
+
+PANEL_DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('x1', '<i4'), ('y1', '<i4'), ('x2', '<i4'), ('y2', '<i4'),
+    ('tile_x', '<i4'), ('tile_y', '<i4'), ('box', '<i4'),
+    ('label', 'i1'),
+    ('confidence', '<f4'),
+    ('detection_confidence', '<f4'),
+])
+# Added by add_locations: WGS84 position of each box centre
+LOCATION_FIELDS = [('latitude', '<f8'), ('longitude', '<f8')]
+# Side of one spatial index cell, in mosaic pixels
+GRID_CELL = 1024
+
+
+class DetectionStore:
+    """One row per panel, grouped by the index cell holding its top-left corner.
+
+    `cell_starts[c]:cell_starts[c + 1]` are the rows of cell `c` (row-major over
+    the mosaic), so the cells of one grid row are a single contiguous slice.
+    A box can reach into cells right of and below its own by at most the
+    largest box size, which region queries widen their search by.
+    """
+
+    def __init__(self, panels, cell_starts, width, height, class_names, cell_size=GRID_CELL):
+        self.panels = panels
+        self.cell_starts = cell_starts
+        self.width = width
+        self.height = height
+        self.class_names = list(class_names)
+        self.cell_size = cell_size
+        self.cols = max(1, -(-width // cell_size))
+        self.rows = max(1, -(-height // cell_size))
+        self.max_box = (int((panels['x2'] - panels['x1']).max()), int((panels['y2'] - panels['y1']).max())) \
+            if len(panels) else (0, 0)
+
+    @classmethod
+    def from_panels(cls, panels, width, height, class_names, cell_size=GRID_CELL):
+        """Build from the panel dicts of a finished run, keeping their order as `id`"""
+        records = np.zeros(len(panels), dtype=PANEL_DTYPE)
+        if panels:
+            boxes = np.array([panel['mosaic_bbox'] for panel in panels], dtype=np.int32)
+            local = np.array([panel['bbox'] for panel in panels], dtype=np.int32)
+            records['id'] = np.arange(len(panels))
+            records['x1'], records['y1'], records['x2'], records['y2'] = boxes.T
+            records['tile_x'] = boxes[:, 0] - local[:, 0]
+            records['tile_y'] = boxes[:, 1] - local[:, 1]
+            records['box'] = [int(panel['panel_id'].rsplit('_', 1)[1]) for panel in panels]
+            records['label'] = [class_names.index(panel['classification']) for panel in panels]
+            records['confidence'] = [panel['confidence'] for panel in panels]
+            records['detection_confidence'] = [panel['detection_confidence'] for panel in panels]
+
+        cols = max(1, -(-width // cell_size))
+        rows = max(1, -(-height // cell_size))
+        cells = (np.clip(records['y1'] // cell_size, 0, rows - 1) * cols +
+                 np.clip(records['x1'] // cell_size, 0, cols - 1))
+        order = np.argsort(cells, kind='stable')
+        cell_starts = np.searchsorted(cells[order], np.arange(rows * cols + 1)).astype(np.int64)
+        return cls(records[order], cell_starts, width, height, class_names, cell_size)
+
+    @property
+    def georeferenced(self):
+        return 'latitude' in self.panels.dtype.names
+
+    def add_locations(self, georeference):
+        """Latitude and longitude columns for every panel's box centre, mapped in one vectorized call"""
+        panels = np.zeros(len(self.panels), dtype=np.dtype(PANEL_DTYPE.descr + LOCATION_FIELDS))
+        for name in PANEL_DTYPE.names:
+            panels[name] = self.panels[name]
+        panels['latitude'], panels['longitude'] = georeference.to_lat_lon(
+            (self.panels['x1'] + self.panels['x2']) / 2, (self.panels['y1'] + self.panels['y2']) / 2)
+        self.panels = panels
+
+    def save(self, path):
+        np.savez(path, panels=self.panels, cell_starts=self.cell_starts,
+                 shape=np.array([self.width, self.height, self.cell_size]),
+                 class_names=np.array(self.class_names))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            width, height, cell_size = (int(v) for v in data['shape'])
+            return cls(data['panels'], data['cell_starts'], width, height,
+                       data['class_names'].tolist(), cell_size)
+
+    def _candidates(self, region):
+        """Rows whose top-left corner lies in a cell the region (widened by the largest box) touches"""
+        x1, y1, x2, y2 = region
+        size = self.cell_size
+        col_from = int(np.clip((x1 - self.max_box[0]) // size, 0, self.cols - 1))
+        col_to = int(np.clip((x2 - 1) // size, 0, self.cols - 1))
+        row_from = int(np.clip((y1 - self.max_box[1]) // size, 0, self.rows - 1))
+        row_to = int(np.clip((y2 - 1) // size, 0, self.rows - 1))
+        slices = [self.panels[self.cell_starts[row * self.cols + col_from]:
+                              self.cell_starts[row * self.cols + col_to + 1]]
+                  for row in range(row_from, row_to + 1)]
+        return np.concatenate(slices) if slices else self.panels[:0]
+
+    def query(self, region=None, classes=None, min_confidence=0.0, offset=0, limit=None):
+        """(total matches, one page of matching rows in run order).
+
+        `region` is (x1, y1, x2, y2) in mosaic pixels and matches any box
+        overlapping it; `classes` is a list of class names.
+        """
+        rows = self._candidates(region) if region is not None else self.panels
+        mask = np.ones(len(rows), dtype=bool)
+        if region is not None:
+            x1, y1, x2, y2 = region
+            mask &= (rows['x1'] < x2) & (rows['x2'] > x1) & (rows['y1'] < y2) & (rows['y2'] > y1)
+        if classes:
+            wanted = [self.class_names.index(name) for name in classes if name in self.class_names]
+            mask &= np.isin(rows['label'], wanted)
+        if min_confidence:
+            mask &= rows['confidence'] >= min_confidence
+
+        matches = rows[mask]
+        matches = matches[np.argsort(matches['id'], kind='stable')]
+        end = None if limit is None else offset + limit
+        return len(matches), matches[offset:end]
+
+    def to_dicts(self, rows):
+        """Rows in the same shape as the panels in processing results, plus their location if georeferenced"""
+        return [{
+            'panel_id': f"tile_{tile_x}_{tile_y}.jpg_{box}",
+            'classification': self.class_names[label],
+            'confidence': float(confidence),
+            'detection_confidence': float(detection_confidence),
+            'bbox': [x1 - tile_x, y1 - tile_y, x2 - tile_x, y2 - tile_y],
+            'mosaic_bbox': [x1, y1, x2, y2],
+            **({'latitude': location[0], 'longitude': location[1]} if location else {}),
+        } for _, x1, y1, x2, y2, tile_x, tile_y, box, label, confidence, detection_confidence, *location
+            in rows.tolist()]
+
+    def __len__(self):
+        return len(self.panels)
@@ -0,0 +1,221 @@
+"""
+Georeferencing: the pixel-to-WGS84 mapping of an image, read from its header alone, applied to
+every panel at once
+"""
+
+import re
+import numpy as np
+
+# WGS84 ellipsoid
+SEMI_MAJOR = 6378137.0
+FLATTENING = 1 / 298.257223563
+ECCENTRICITY2 = FLATTENING * (2 - FLATTENING)
+# Full-frame sensor width, the reference of FocalLengthIn35mmFilm, in millimetres
+FULL_FRAME_WIDTH = 36.0
+
+# GeoTIFF keys and values (GeoTIFF 1.0, section 6)
+GT_MODEL_TYPE = 1024
+GT_RASTER_TYPE = 1025
+GEOGRAPHIC_TYPE = 2048
+PROJECTED_CS_TYPE = 3072
+MODEL_GEOGRAPHIC = 2
+RASTER_PIXEL_IS_POINT = 2
+WGS84 = 4326
+WEB_MERCATOR = 3857
+GPS_IFD = 0x8825
+# EXIF and GPS tag ids
+FOCAL_LENGTH_35MM = 0xA405
+GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+GPS_IMG_DIRECTION = 17
+# DJI and similar drones record height above take-off and the camera heading in XMP
+XMP_FIELDS = {name: re.compile(rf'{name}\s*=\s*"?\s*([+-]?[0-9.]+)'.encode())
+              for name in ("RelativeAltitude", "GimbalYawDegree", "FlightYawDegree")}
+
+
+def dms_to_degrees(value, ref):
+    degrees, minutes, seconds = (float(v) for v in value)
+    degrees += minutes / 60 + seconds / 3600
+    return -degrees if ref in ("S", "W", b"S", b"W") else degrees
+
+
+def utm_to_lat_lon(easting, northing, zone, south):
+    """Inverse transverse Mercator on WGS84 (Snyder's series), element-wise"""
+    k0 = 0.9996
+    e2 = ECCENTRICITY2
+    ep2 = e2 / (1 - e2)
+    x = easting - 500000.0
+    y = northing - (10000000.0 if south else 0.0)
+
+    mu = y / k0 / (SEMI_MAJOR * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+    e1 = (1 - np.sqrt(1 - e2)) / (1 + np.sqrt(1 - e2))
+    phi1 = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * np.sin(2 * mu)
+            + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * np.sin(4 * mu)
+            + 151 * e1 ** 3 / 96 * np.sin(6 * mu) + 1097 * e1 ** 4 / 512 * np.sin(8 * mu))
+
+    sin1, cos1, tan1 = np.sin(phi1), np.cos(phi1), np.tan(phi1)
+    n1 = SEMI_MAJOR / np.sqrt(1 - e2 * sin1 ** 2)
+    r1 = SEMI_MAJOR * (1 - e2) / (1 - e2 * sin1 ** 2) ** 1.5
+    t1, c1 = tan1 ** 2, ep2 * cos1 ** 2
+    d = x / (n1 * k0)
+
+    lat = phi1 - (n1 * tan1 / r1) * (d ** 2 / 2 - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * ep2) * d ** 4 / 24
+                                     + (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * ep2 - 3 * c1 ** 2)
+                                     * d ** 6 / 720)
+    lon = (d - (1 + 2 * t1 + c1) * d ** 3 / 6
+           + (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * ep2 + 24 * t1 ** 2) * d ** 5 / 120) / cos1
+    return np.degrees(lat), np.degrees(lon) + (zone * 6 - 183)
+
+
+def web_mercator_to_lat_lon(x, y):
+    return np.degrees(2 * np.arctan(np.exp(y / SEMI_MAJOR)) - np.pi / 2), np.degrees(x / SEMI_MAJOR)
+
+
+class Georeference:
+    """Maps mosaic pixel coordinates (x right, y down, 0 at the top-left corner) to WGS84.
+
+    Either an affine transform into a map CRS, from GeoTIFF tags, or a nadir
+    camera model from EXIF: the GPS position at the image centre, a ground
+    sample distance in metres per pixel and the heading the top of the frame
+    faces, in degrees clockwise from north. A camera model without a ground
+    sample distance gives the image position only.
+    """
+
+    def __init__(self, width, height, affine=None, epsg=None, camera=None, source=None):
+        self.width = width
+        self.height = height
+        self.affine = affine
+        self.epsg = epsg
+        self.camera = camera
+        self.source = source
+        self._transformer = None
+        if affine is not None and not self._builtin_crs():
+            try:
+                from pyproj import Transformer
+            except ImportError:
+                self.affine = None
+            else:
+                self._transformer = Transformer.from_crs(epsg, WGS84, always_xy=True)
+
+    def _builtin_crs(self):
+        return self.epsg in (WGS84, WEB_MERCATOR) or 32601 <= self.epsg <= 32760
+
+    @property
+    def maps_panels(self):
+        return self.affine is not None or bool(self.camera and self.camera['gsd'])
+
+    def to_lat_lon(self, x, y):
+        """Latitude and longitude arrays of pixel coordinate arrays, in one vectorized pass"""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self.affine is not None:
+            a, b, c, d, e, f = self.affine
+            map_x, map_y = a * x + b * y + c, d * x + e * y + f
+            if self.epsg == WGS84:
+                return map_y, map_x
+            if self.epsg == WEB_MERCATOR:
+                return web_mercator_to_lat_lon(map_x, map_y)
+            if 32601 <= self.epsg <= 32760:
+                return utm_to_lat_lon(map_x, map_y, self.epsg % 100, self.epsg > 32700)
+            lon, lat = self._transformer.transform(map_x, map_y)
+            return np.asarray(lat), np.asarray(lon)
+
+        camera = self.camera
+        if not camera['gsd']:
+            return np.full(x.shape, camera['latitude']), np.full(y.shape, camera['longitude'])
+        # Metres right of and above the image centre, turned by the heading into east and north
+        right = (x - self.width / 2) * camera['gsd']
+        up = (self.height / 2 - y) * camera['gsd']
+        heading = np.radians(camera['heading'])
+        east = right * np.cos(heading) + up * np.sin(heading)
+        north = up * np.cos(heading) - right * np.sin(heading)
+        # Local tangent plane: fine over the few hundred metres one frame covers
+        lat0 = np.radians(camera['latitude'])
+        meridian = SEMI_MAJOR * (1 - ECCENTRICITY2) / (1 - ECCENTRICITY2 * np.sin(lat0) ** 2) ** 1.5
+        normal = SEMI_MAJOR / np.sqrt(1 - ECCENTRICITY2 * np.sin(lat0) ** 2)
+        return (camera['latitude'] + np.degrees(north / meridian),
+                camera['longitude'] + np.degrees(east / (normal * np.cos(lat0))))
+
+    def center(self):
+        """(latitude, longitude) of the image centre"""
+        lat, lon = self.to_lat_lon([self.width / 2], [self.height / 2])
+        return float(lat[0]), float(lon[0])
+
+    def to_dict(self):
+        return {'source': self.source, 'epsg': self.epsg, 'maps_panels': self.maps_panels,
+                **({'ground_sample_distance': self.camera['gsd'], 'heading': self.camera['heading']}
+                   if self.camera else {})}
+
+
+def geotiff_reference(path):
+    """Affine transform and EPSG code from a GeoTIFF's tags, or None; tifffile reads tags only"""
+    import tifffile
+    with tifffile.TiffFile(path) as tiff:
+        page = tiff.pages[0]
+        tags = {tag.code: tag.value for tag in page.tags.values()}
+        width, height = page.imagewidth, page.imagelength
+    directory = tags.get(34735)
+    if directory is None:
+        return None
+    keys = {directory[i]: directory[i + 3] for i in range(4, 4 + 4 * directory[3], 4) if directory[i + 1] == 0}
+    epsg = keys.get(GEOGRAPHIC_TYPE) if keys.get(GT_MODEL_TYPE) == MODEL_GEOGRAPHIC else keys.get(PROJECTED_CS_TYPE)
+    if not epsg or epsg == 32767:
+        # User-defined CRS, described by parameters this reader doesn't interpret
+        return None
+
+    # Pixel-is-point tiepoints refer to pixel centres; the mapping is from pixel corners
+    shift = 0.5 if keys.get(GT_RASTER_TYPE) == RASTER_PIXEL_IS_POINT else 0.0
+    if 34264 in tags:
+        m = tags[34264]
+        affine = (m[0], m[1], m[3] - shift * (m[0] + m[1]), m[4], m[5], m[7] - shift * (m[4] + m[5]))
+    elif 33550 in tags and 33922 in tags:
+        scale_x, scale_y = tags[33550][:2]
+        i, j, _, x, y, _ = tags[33922][:6]
+        affine = (scale_x, 0.0, x - (i + shift) * scale_x, 0.0, -scale_y, y + (j + shift) * scale_y)
+    else:
+        return None
+    reference = Georeference(width, height, affine=affine, epsg=epsg, source="geotiff")
+    return reference if reference.affine is not None else None
+
+
+def exif_reference(path, ground_sample_distance=0.0):
+    """Camera model from EXIF GPS and drone XMP, or None. PIL opens lazily, so no pixels are decoded."""
+    from PIL import Image
+    with Image.open(path) as image:
+        width, height = image.size
+        exif = image.getexif()
+        gps = exif.get_ifd(GPS_IFD)
+        focal_35mm = exif.get_ifd(0x8769).get(FOCAL_LENGTH_35MM)
+        xmp = image.info.get("xmp") or b""
+    if GPS_LATITUDE not in gps or GPS_LONGITUDE not in gps:
+        return None
+    if isinstance(xmp, str):
+        xmp = xmp.encode()
+    fields = {name: float(match.group(1)) for name, pattern in XMP_FIELDS.items()
+              for match in [pattern.search(xmp)] if match}
+
+    gsd = ground_sample_distance
+    if not gsd and focal_35mm and fields.get("RelativeAltitude", 0) > 0:
+        gsd = fields["RelativeAltitude"] * FULL_FRAME_WIDTH / (float(focal_35mm) * max(width, height))
+    heading = fields.get("GimbalYawDegree", fields.get("FlightYawDegree", float(gps.get(GPS_IMG_DIRECTION, 0))))
+    camera = {'latitude': dms_to_degrees(gps[GPS_LATITUDE], gps.get(GPS_LATITUDE_REF)),
+              'longitude': dms_to_degrees(gps[GPS_LONGITUDE], gps.get(GPS_LONGITUDE_REF)),
+              'gsd': gsd, 'heading': heading}
+    return Georeference(width, height, camera=camera, source="exif")
+
+
+def read_georeference(path, ground_sample_distance=0.0):
+    """The image's georeference from its header, GeoTIFF tags first, then EXIF; None without either.
+    `ground_sample_distance` (metres per pixel) overrides the one derived from EXIF."""
+    if path.lower().endswith((".tif", ".tiff")):
+        try:
+            reference = geotiff_reference(path)
+        except (ImportError, OSError, ValueError, KeyError, IndexError, RuntimeError):
+            # RuntimeError: pyproj rejecting the CRS
+            reference = None
+        if reference:
+            return reference
+    try:
+        return exif_reference(path, ground_sample_distance)
+    except (OSError, ValueError, ZeroDivisionError, TypeError):
+        # Unreadable or malformed metadata leaves the image unreferenced, not the job failed
+        return None
@@ -0,0 +1,132 @@
+"""
+CPU inference backends: eager PyTorch, TorchScript or ONNX Runtime, optionally with INT8 weights
+"""
+
+import os
+import shutil
+import hashlib
+import torch
+
+BACKENDS = ("torch", "torchscript", "onnx")
+QUANTIZATIONS = ("", "int8")
+CLASSIFIER_INPUT_SHAPE = (1, 3, 224, 224)
+
+
+def configure_threads(intra_op_threads):
+    """Cap PyTorch's intra-op threads; 0 keeps the library default"""
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+
+
+def require_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise RuntimeError("The onnx backend needs ONNX Runtime: pip install onnx onnxruntime")
+    return onnxruntime
+
+
+def quantize_onnx(source, destination):
+    """Dynamic INT8 quantization of an ONNX model's weights"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(source, destination, weight_type=QuantType.QInt8)
+
+
+def model_tag(model):
+    """Short hash of a model's weights, naming its exports so new weights are exported afresh"""
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:12]
+
+
+def export_name(stem, tag, backend, quantize):
+    extension = {"torchscript": ".torchscript", "onnx": ".onnx"}[backend]
+    return f"{stem}_{tag}{'_' + quantize if quantize else ''}{extension}"
+
+
+class OnnxClassifier:
+    """Runs an exported classifier in ONNX Runtime, taking and returning torch tensors"""
+
+    def __init__(self, path, intra_op_threads=0):
+        onnxruntime = require_onnxruntime()
+        options = onnxruntime.SessionOptions()
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def export_classifier(model, path, backend, quantize=""):
+    """Write `model` (eval mode, on CPU) to `path` in the given format"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    example = torch.zeros(CLASSIFIER_INPUT_SHAPE)
+    if backend == "torchscript":
+        if quantize == "int8":
+            # Dynamic quantization covers Linear layers; the convolutions stay float
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            scripted = torch.jit.freeze(torch.jit.trace(model, example))
+        scripted.save(path)
+    elif backend == "onnx":
+        target = path + ".float" if quantize else path
+        torch.onnx.export(model, example, target, input_names=["input"], output_names=["logits"],
+                          dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}}, opset_version=17)
+        if quantize:
+            quantize_onnx(target, path)
+            os.remove(target)
+    else:
+        raise ValueError(f"Cannot export to {backend!r}")
+
+
+def load_classifier_backend(model, backend, quantize, export_dir, intra_op_threads=0):
+    """Callable mapping an NCHW float batch to logits, exporting `model` first if needed"""
+    if backend not in BACKENDS or quantize not in QUANTIZATIONS:
+        raise ValueError(f"Unknown inference backend {backend!r} / quantization {quantize!r}")
+    if backend == "onnx":
+        require_onnxruntime()
+    if backend == "torch":
+        if quantize == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model.cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    path = os.path.join(export_dir, export_name("resnet50", model_tag(model), backend, quantize))
+    if not os.path.exists(path):
+        export_classifier(model.cpu(), path, backend, quantize)
+    if backend == "torchscript":
+        return torch.jit.optimize_for_inference(torch.jit.load(path, map_location="cpu"))
+    return OnnxClassifier(path, intra_op_threads)
+
+
+def export_detector(weights_path, backend, quantize, export_dir, tag):
+    """Path of the YOLO weights in the given format, exporting them on first use.
+
+    Exports keep ultralytics' default 640px input, the size the eager model
+    predicts at, so detections match. INT8 is only available for ONNX: the
+    detector has no Linear layers for PyTorch's dynamic quantization to act on.
+    """
+    if backend == "torch":
+        return weights_path
+    if quantize and backend != "onnx":
+        raise ValueError("INT8 detector weights need the onnx backend")
+
+    path = os.path.join(export_dir, export_name("yolo", tag, backend, quantize))
+    if os.path.exists(path):
+        return path
+
+    from ultralytics import YOLO
+    if backend == "onnx":
+        require_onnxruntime()
+    os.makedirs(export_dir, exist_ok=True)
+    exported = YOLO(weights_path).export(format=backend, dynamic=backend == "onnx", verbose=False)
+    if quantize:
+        quantize_onnx(exported, path)
+        os.remove(exported)
+    else:
+        shutil.move(exported, path)
+    return path
@@ -0,0 +1,155 @@
+"""
+Out-of-process model serving: worker processes each hold one copy of the models and
+receive pixels through shared memory, so only small arrays cross the process boundary
+"""
+
+import os
+import threading
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# Set in each worker process by _init_worker
+_worker = None
+
+
+class Boxes:
+    """The part of an ultralytics Boxes the pipeline reads: (n, 6) xyxy, conf, cls"""
+
+    def __init__(self, data):
+        self.data = data
+
+
+class Detections:
+    def __init__(self, data):
+        self.boxes = Boxes(data)
+
+
+def pack(images):
+    """Copy images into one new shared-memory segment; returns it and their shapes"""
+    shapes = [image.shape for image in images]
+    size = sum(int(np.prod(shape)) for shape in shapes)
+    segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    offset = 0
+    for image, shape in zip(images, shapes):
+        count = int(np.prod(shape))
+        np.ndarray(shape, dtype=np.uint8, buffer=segment.buf, offset=offset)[...] = image
+        offset += count
+    return segment, shapes
+
+
+def unpack(segment, shapes):
+    """Views of packed images; valid only while the segment stays open"""
+    images, offset = [], 0
+    for shape in shapes:
+        images.append(np.ndarray(shape, dtype=np.uint8, buffer=segment.buf, offset=offset))
+        offset += int(np.prod(shape))
+    return images
+
+
+def _init_worker(settings):
+    """Load and warm the models once per worker process"""
+    global _worker
+    from processor import SolarPanelProcessor
+    _worker = SolarPanelProcessor(cpu_workers=1, **settings)
+    _worker.warm_up()
+
+
+def _ping():
+    return os.getpid()
+
+
+def _detect(name, shapes, options):
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        images = unpack(segment, shapes)
+        results = list(_worker.detect_batch(images, **options))
+        data = [np.ascontiguousarray(r.boxes.data.cpu().numpy() if hasattr(r.boxes.data, "cpu") else r.boxes.data,
+                                     dtype=np.float32) for r in results]
+        del images, results
+        return data
+    finally:
+        segment.close()
+
+
+def _classify(name, shapes):
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        crops = unpack(segment, shapes)
+        labels, confidences = _worker.classify_crops(crops)
+        del crops
+        from processor import CLASS_NAMES
+        indices = np.array([CLASS_NAMES.index(label) for label in labels], dtype=np.int8)
+        return indices, np.array(confidences, dtype=np.float32)
+    finally:
+        segment.close()
+
+
+class InferencePool:
+    """A fixed set of model-serving processes shared by every job in this process.
+
+    Each batch is copied once into a fresh shared-memory segment and only its
+    name and the image shapes are sent to a worker; detections come back as one
+    (n, 6) float32 array per image and labels as class indices and confidences.
+    """
+
+    def __init__(self, workers, settings=None):
+        self.workers = workers
+        self.settings = settings or {}
+        self.executor = None
+        # Held to start, replace or submit to the executor; not while a call waits for its result
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Spawn the workers, if not running yet, and wait until they have loaded their models"""
+        with self._lock:
+            if self.executor is None:
+                self._start()
+
+    def _start(self):
+        # spawn, not fork: forking a process that has started torch threads can deadlock
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(self.settings,))
+        # Workers start on demand, so keep one ping per worker in flight
+        for future in [self.executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def pids(self):
+        return [process.pid for process in (self.executor._processes or {}).values()] if self.executor else []
+
+    def _call(self, func, images, *args):
+        segment, shapes = pack(images)
+        try:
+            with self._lock:
+                if self.executor is None:
+                    self._start()
+                future = self.executor.submit(func, segment.name, shapes, *args)
+            return future.result()
+        finally:
+            segment.close()
+            segment.unlink()
+
+    def detect(self, images, **options):
+        """Detections for a batch of BGR tiles, one result per image; `options` as for detect_batch"""
+        return [Detections(data) for data in self._call(_detect, images, options)]
+
+    def classify(self, crops):
+        """(class indices, confidences) for a batch of preprocessed BGR crops"""
+        return self._call(_classify, crops)
+
+    def restart(self):
+        """Replace the workers, e.g. so they load new weights. Calls already submitted finish
+        on the old workers; calls made meanwhile wait for the new ones."""
+        with self._lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+            self._start()
+
+    def shutdown(self):
+        with self._lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
@@ -0,0 +1,105 @@
+"""
+Background job queue: uploads are processed on a worker pool and polled for progress
+"""
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """Status of one submitted image"""
+    job_id: str
+    filename: str
+    status: str = QUEUED
+    stage: str = QUEUED
+    tiles_done: int = 0
+    tiles_total: int = 0
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self, include_result=False):
+        data = {
+            'job_id': self.job_id,
+            'filename': self.filename,
+            'status': self.status,
+            'stage': self.stage,
+            'tiles_done': self.tiles_done,
+            'tiles_total': self.tiles_total,
+            'progress': self.tiles_done / self.tiles_total if self.tiles_total else (1.0 if self.finished else 0.0),
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
+
+class JobQueue:
+    """Runs `process(path, filename, job_id, progress, **options)` for each job on a thread pool"""
+
+    def __init__(self, process, max_workers=2, history=1000):
+        self.process = process
+        self.history = history
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def new_job_id(self):
+        return uuid.uuid4().hex[:12]
+
+    def submit(self, image_path, filename, job_id=None, **options):
+        job = Job(job_id=job_id or self.new_job_id(), filename=filename)
+        with self.lock:
+            self.jobs[job.job_id] = job
+            self._prune()
+        self.executor.submit(self._run, job, image_path, options)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, image_path, options):
+        def progress(stage, tiles_done, tiles_total):
+            job.stage = stage
+            job.tiles_done = tiles_done
+            job.tiles_total = tiles_total
+            job.updated_at = time.time()
+
+        job.status = RUNNING
+        try:
+            job.result = {'filename': job.filename, **self.process(image_path, job.filename, job.job_id, progress,
+                                                                  **options)}
+            job.status = job.stage = DONE
+        except Exception as e:
+            job.error = str(getattr(e, "detail", e))
+            job.result = {'filename': job.filename, 'success': False, 'error': job.error}
+            job.status = job.stage = FAILED
+        job.updated_at = time.time()
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the history limit"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
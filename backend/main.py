@@ -1,26 +1,42 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
-import cv2
-import csv
-import json
+import asyncio
+import functools
 import shutil
+import logging
+import threading
 import zipfile
-import numpy as np
-import torch
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
 from PIL import Image, Image as PILImage
-from ultralytics import YOLO
-from torchvision import transforms
-from torchvision.models import resnet50
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from PIL.ExifTags import TAGS, GPSTAGS
+from tile_sources import TIFF_EXTENSIONS
+from jobs import JobQueue
+from result_cache import ResultCache
+from tile_cache import TileCache
+from inference_pool import InferencePool
+from uploads import stream_uploads, UploadError
+from detection_store import DetectionStore
+from reports import LOCATION_FORMATS, location_chunks
+from profiling import registry
+from batch import BatchRun, batch_id_for, collect_images, FAILED, PENDING, RUNNING
+from processor import (
+    SolarPanelProcessor, OUTPUT_DIR, WORKSPACE_DIR, CLASS_NAMES, YOLO_BATCH_SIZE, CLASSIFIER_BATCH_SIZE,
+    INFERENCE_BACKEND, QUANTIZE, INTRA_OP_THREADS, CLASSIFIER_CASCADE, CASCADE_THRESHOLD, CASCADE_INPUT_SIZE
+)
 
 app = FastAPI(title="Solar Panel Classification API")
+# Log next to uvicorn's own startup messages
+logger = logging.getLogger("uvicorn.error")
 
 # CORS middleware
 app.add_middleware(
@@ -33,348 +49,255 @@ app.add_middleware(
 
 # Constants
 UPLOAD_DIR = "uploads"
-OUTPUT_DIR = "outputs"
-TILE_SIZE = 512
-TILE_DIR = "temp_tiles"
-ANNOTATED_DIR = "temp_annotated"
-BOXES_DIR = "temp_boxes"
-CLASSIFIER_PATH = "../resnet50_pv_classifier.pth"
-YOLO_MODEL_PATH = "../runs/detect/train_yolo_v8_new_dataset4/weights/best.pt"
-CLASS_NAMES = ["Bird-drop", "Clean", "Dusty", "Physical-Damage"]
+BATCH_DIR = "batches"
+RESULT_CACHE_DIR = "result_cache"
+# Size cap of the finished-result cache; 0 disables it
+RESULT_CACHE_MB = int(os.environ.get("RESULT_CACHE_MB", 2048))
+# Tiles whose detections and labels are kept for reuse on later uploads; 0 disables it
+TILE_CACHE_ENTRIES = int(os.environ.get("TILE_CACHE_ENTRIES", 200000))
+TILE_CACHE_PATH = os.path.join(RESULT_CACHE_DIR, "tiles.sqlite")
+# Background worker threads for submitted jobs
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Separate model-serving processes shared by all jobs; 0 runs the models in this process
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+# Load and warm both models in the background at startup instead of on the first upload
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "1") == "1"
+# Folder whose image directories and manifests POST /batches may read
+BATCH_ROOT = os.environ.get("BATCH_ROOT", "batch_inputs")
+# Images of one batch processed at once; their tiles and crops share model batches
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 4))
+# Longest a shared model batch waits for other images' tiles or crops before running part-full
+SHARED_BATCH_WAIT_MS = float(os.environ.get("SHARED_BATCH_WAIT_MS", 10))
 
 # Setup directories
-for directory in [UPLOAD_DIR, OUTPUT_DIR, TILE_DIR, ANNOTATED_DIR, BOXES_DIR]:
+for directory in [UPLOAD_DIR, OUTPUT_DIR, WORKSPACE_DIR, RESULT_CACHE_DIR, BATCH_DIR]:
     os.makedirs(directory, exist_ok=True)
 
-# Setup transforms and models
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.5]*3, [0.5]*3)
-])
-Image.MAX_IMAGE_PIXELS = None
-
 # Mount static files
 app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
 
-def get_exif_data(image):
-    exif_data = {}
-    info = image._getexif()
-    if not info:
-        return None
-    for tag, value in info.items():
-        decoded = TAGS.get(tag, tag)
-        if decoded == "GPSInfo":
-            gps_data = {}
-            for t in value:
-                sub_decoded = GPSTAGS.get(t, t)
-                gps_data[sub_decoded] = value[t]
-            exif_data[decoded] = gps_data
-        else:
-            exif_data[decoded] = value
-    return exif_data
-
-def convert_to_degrees(value):
-    d, m, s = value
-    return float(d) + float(m)/60 + float(s)/3600
-
-def get_lat_lon(exif_data):
-    if not exif_data or "GPSInfo" not in exif_data:
-        return None, None
-    gps_info = exif_data["GPSInfo"]
-    lat = convert_to_degrees(gps_info["GPSLatitude"])
-    lon = convert_to_degrees(gps_info["GPSLongitude"])
-    if gps_info.get("GPSLatitudeRef") == "S":
-        lat = -lat
-    if gps_info.get("GPSLongitudeRef") == "W":
-        lon = -lon
-    return lat, lon
-class SolarPanelProcessor:
-    def __init__(self):
-        self.yolo_model = None
-        self.classifier_model = None
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        
-    def load_models(self):
-        """Load YOLO and ResNet models"""
-        if self.yolo_model is None:
-            self.yolo_model = YOLO(YOLO_MODEL_PATH)
-            
-        if self.classifier_model is None:
-            self.classifier_model = resnet50()
-            self.classifier_model.fc = torch.nn.Linear(
-                self.classifier_model.fc.in_features, len(CLASS_NAMES)
-            )
-            self.classifier_model.load_state_dict(
-                torch.load(CLASSIFIER_PATH, map_location="cpu"), strict=False
-            )
-            self.classifier_model.eval()
-            self.classifier_model.to(self.device)
-
-    def clear_directories(self, *dirs):
-        """Clear temporary directories"""
-        for folder in dirs:
-            if os.path.exists(folder):
-                shutil.rmtree(folder)
-            os.makedirs(folder)
-
-    def tile_image_with_mapping(self, image_path, output_folder, metadata_file="tile_metadata.csv"):
-        """Tile large image into smaller chunks"""
-        img = Image.open(image_path)
-        width, height = img.size
-        metadata_path = os.path.join(output_folder, metadata_file)
-        
-        tiles_info = []
-        with open(metadata_path, mode='w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['tile_name', 'x_start', 'y_start', 'width', 'height'])
-            
-            for y in range(0, height, TILE_SIZE):
-                for x in range(0, width, TILE_SIZE):
-                    right = min(x + TILE_SIZE, width)
-                    lower = min(y + TILE_SIZE, height)
-                    tile = img.crop((x, y, right, lower)).convert("RGB")
-                    tile_name = f"tile_{x}_{y}.jpg"
-                    tile.save(os.path.join(output_folder, tile_name))
-                    
-                    tile_info = {
-                        'tile_name': tile_name,
-                        'x_start': x,
-                        'y_start': y,
-                        'width': right - x,
-                        'height': lower - y
-                    }
-                    tiles_info.append(tile_info)
-                    writer.writerow([tile_name, x, y, right - x, lower - y])
-                    
-        return tiles_info
-
-    def is_likely_panel(self, crop):
-        """Filter to identify likely solar panels"""
-        hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
-        brightness = np.mean(hsv[:, :, 2])
-        saturation = np.mean(hsv[:, :, 1])
-        avg_rgb = np.mean(crop, axis=(0, 1)).mean()
-        return (40 < brightness < 180) and (30 < saturation < 140) and (30 < avg_rgb < 180)
-
-    def run_yolo_and_store_boxes(self):
-        """Run YOLO detection and store bounding boxes"""
-        detection_results = []
-        
-        for fname in sorted(os.listdir(TILE_DIR)):
-            if not fname.lower().endswith(('.jpg', '.jpeg', '.png')):
-                continue
-                
-            tile_path = os.path.join(TILE_DIR, fname)
-            img = cv2.imread(tile_path)
-            if img is None:
-                continue
-
-            results = self.yolo_model(img, conf=0.75, iou=0.84)[0]
-            valid_boxes = []
-            
-            for box in results.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-                crop = img[max(0, y1):min(img.shape[0], y2), max(0, x1):min(img.shape[1], x2)]
-                
-                if crop.shape[0] < 20 or crop.shape[1] < 20 or not self.is_likely_panel(crop):
-                    continue
-                    
-                valid_boxes.append([x1, y1, x2, y2])
-
-            if valid_boxes:
-                with open(os.path.join(BOXES_DIR, fname.replace(".jpg", ".json")), "w") as f:
-                    json.dump(valid_boxes, f)
-                    
-                detection_results.append({
-                    'tile': fname,
-                    'detections': len(valid_boxes)
-                })
-
-            cv2.imwrite(os.path.join(ANNOTATED_DIR, fname), img)
-            
-        return detection_results
-
-    def classify_detected_panels(self):
-        """Classify detected solar panels using ResNet"""
-        classification_results = []
-        
-        for json_file in sorted(os.listdir(BOXES_DIR)):
-            if not json_file.endswith(".json"):
-                continue
-
-            tile_name = json_file.replace(".json", ".jpg")
-            tile_path = os.path.join(ANNOTATED_DIR, tile_name)
-            
-            with open(os.path.join(BOXES_DIR, json_file), "r") as f:
-                boxes = json.load(f)
-
-            img = cv2.imread(tile_path)
-            rgb = img[:, :, ::-1]
-            
-            tile_results = []
-            
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = map(int, box)
-                crop = rgb[y1:y2, x1:x2]
-                
-                if crop.shape[0] < 20 or crop.shape[1] < 20:
-                    continue
-                    
-                tensor = transform(PILImage.fromarray(crop)).unsqueeze(0).to(self.device)
-                
-                with torch.no_grad():
-                    pred = self.classifier_model(tensor)
-                    confidence = torch.softmax(pred, dim=1)
-                    max_conf = torch.max(confidence).item()
-                    label = CLASS_NAMES[torch.argmax(pred, dim=1).item()]
-
-                color = (0, 255, 0) if label == "Clean" else (0, 0, 255)
-                center_x = x1 + (x2 - x1) // 2
-                center_y = y1 + (y2 - y1) // 2
-                
-                cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-                cv2.putText(img, f"{label} ({max_conf:.2f})", (center_x - 30, center_y), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
-                
-                tile_results.append({
-                    'panel_id': f"{tile_name}_{i}",
-                    'classification': label,
-                    'confidence': max_conf,
-                    'bbox': [x1, y1, x2, y2]
-                })
-
-            cv2.imwrite(tile_path, img)
-            
-            if tile_results:
-                classification_results.extend(tile_results)
-                
-        return classification_results
-
-    def restitch_tiles(self, metadata_csv, annotated_dir, save_path):
-        """Restitch tiles back into full image"""
-        df = pd.read_csv(metadata_csv)
-        full_width = df['x_start'].max() + df['width'].max()
-        full_height = df['y_start'].max() + df['height'].max()
-        canvas = np.zeros((full_height, full_width, 3), dtype=np.uint8)
-
-        for _, row in df.iterrows():
-            tile_path = os.path.join(annotated_dir, row['tile_name'])
-            tile = cv2.imread(tile_path)
-            if tile is None:
-                continue
-            x, y = int(row['x_start']), int(row['y_start'])
-            canvas[y:y+tile.shape[0], x:x+tile.shape[1]] = tile
-
-        cv2.imwrite(save_path, canvas)
-
-    def generate_excel_report(self, classification_results, image_name, output_path):
-        """Generate Excel report with classification results"""
-        # Create summary statistics
-        total_panels = len(classification_results)
-        class_counts = {}
-        for class_name in CLASS_NAMES:
-            class_counts[class_name] = len([r for r in classification_results if r['classification'] == class_name])
-        
-        # Create detailed results DataFrame
-        detailed_df = pd.DataFrame(classification_results)
-        
-        # Create summary DataFrame
-        summary_data = {
-            'Metric': ['Total Panels Detected'] + [f'{cls} Panels' for cls in CLASS_NAMES] + ['Processing Date'],
-            'Value': [total_panels] + [class_counts[cls] for cls in CLASS_NAMES] + [datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
-        }
-        summary_df = pd.DataFrame(summary_data)
-        
-        # Write to Excel with multiple sheets
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            summary_df.to_excel(writer, sheet_name='Summary', index=False)
-            detailed_df.to_excel(writer, sheet_name='Detailed Results', index=False)
-            
+
+# Initialize processor
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MB * 2**20)
+tile_cache = TileCache(TILE_CACHE_PATH, TILE_CACHE_ENTRIES)
+inference_pool = InferencePool(INFERENCE_WORKERS, settings={
+    'inference_backend': INFERENCE_BACKEND, 'quantize': QUANTIZE, 'intra_op_threads': INTRA_OP_THREADS,
+    'yolo_batch_size': YOLO_BATCH_SIZE, 'classifier_batch_size': CLASSIFIER_BATCH_SIZE,
+    'cascade': CLASSIFIER_CASCADE, 'cascade_threshold': CASCADE_THRESHOLD, 'cascade_input_size': CASCADE_INPUT_SIZE,
+}) if INFERENCE_WORKERS else None
+processor = SolarPanelProcessor(result_cache=result_cache, tile_cache=tile_cache, inference_pool=inference_pool)
+job_queue = JobQueue(processor.process_image, max_workers=JOB_WORKERS)
+
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png') + TIFF_EXTENSIONS
+
+def open_batch(source, restart=False, allowed_root=None):
+    """The batch for a directory or manifest, resuming its journal unless `restart`"""
+    paths = collect_images(source, SUPPORTED_EXTENSIONS)
+    if not paths:
+        raise ValueError(f"No supported images in {source}")
+    if allowed_root and any(os.path.commonpath([allowed_root, os.path.realpath(path)]) != allowed_root
+                            for path in paths):
+        raise ValueError("Batch images must be inside the batch root")
+    batch_id = batch_id_for(paths)
+    if restart:
+        shutil.rmtree(os.path.join(BATCH_DIR, batch_id), ignore_errors=True)
+    return BatchRun(batch_id, paths, BATCH_DIR)
+
+def process_batch(batch, workers=BATCH_WORKERS):
+    """Process a batch's remaining images concurrently with shared model batches, then write its
+    consolidated report"""
+    def process(path, name, index):
+        result = processor.process_image(path, name, f"{batch.batch_id}-{index:05d}", batchers=batchers)
+        store_id = result['detections']['url'].rsplit("/", 1)[-1]
         return {
-            'total_panels': total_panels,
-            'class_distribution': class_counts,
-            'file_path': output_path
+            'summary': {key: result['summary'][key] for key in ('total_panels', 'class_distribution')},
+            'detections_path': os.path.abspath(processor.detections_path(store_id)),
+            'annotated_image': result['annotated_image'],
+            'excel_report': result['excel_report'],
+            'cache_hit': result['cache_hit'],
         }
 
-    def process_image(self, image_path, image_name):
-        """Main processing pipeline"""
-        # Clear temporary directories
-        self.clear_directories(TILE_DIR, BOXES_DIR, ANNOTATED_DIR)
-        
-        # Load models
-        self.load_models()
-        
-        # Generate output paths
-        base_name = os.path.splitext(image_name)[0]
-        output_image_path = os.path.join(OUTPUT_DIR, f"{base_name}_annotated.jpg")
-        excel_path = os.path.join(OUTPUT_DIR, f"{base_name}_report.xlsx")
-        metadata_csv = os.path.join(TILE_DIR, "tile_metadata.csv")
-        
-        # Extract GPS data
-        img = Image.open(image_path)
-        exif = get_exif_data(img)
-        latitude, longitude = get_lat_lon(exif)
-
-        try:
-            # Run pipeline
-            tiles_info = self.tile_image_with_mapping(image_path, TILE_DIR)
-            detection_results = self.run_yolo_and_store_boxes()
-            classification_results = self.classify_detected_panels()
-            self.restitch_tiles(metadata_csv, ANNOTATED_DIR, output_image_path)
-            
-            # Generate Excel report
-            excel_report = self.generate_excel_report(classification_results, image_name, excel_path)
-            
-            return {
-                'success': True,
-                'annotated_image': f"/outputs/{os.path.basename(output_image_path)}",
-                'excel_report': f"/outputs/{os.path.basename(excel_path)}",
-                'summary': excel_report,
-                'detailed_results': classification_results,
-                'gps_latitude': latitude,
-                'gps_longitude': longitude
-            }
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
-
-# Initialize processor
-processor = SolarPanelProcessor()
+    try:
+        processor.load_models()
+        # Only this batch's images share model batches; other jobs keep running theirs alone
+        with processor.shared_batches(SHARED_BATCH_WAIT_MS / 1000) as batchers:
+            batch.run(process, workers)
+        if batch.results:
+            report_path = os.path.join(OUTPUT_DIR, f"batch_{batch.batch_id}_report.{processor.report_format}")
+            batch.write_report(report_path, processor.report_format, CLASS_NAMES)
+        batch.finish()
+    except Exception as e:
+        batch.status, batch.error = FAILED, str(e)
+        raise
+    return batch
+
+# Batches one after another, each spreading its images over BATCH_WORKERS threads
+batch_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch")
+batches = {}
+
+async def receive_uploads(request):
+    """Supported images from a multipart request (field `files`), each yielded once it is on disk"""
+    try:
+        async for upload in stream_uploads(request.stream(), request.headers.get("content-type"),
+                                           UPLOAD_DIR, SUPPORTED_EXTENSIONS):
+            yield upload
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Readiness, as opposed to liveness: models are loaded and warm
+model_status = {'status': 'loading' if PRELOAD_MODELS else 'ready', 'error': None, 'timings': {}}
+
+def warm_models():
+    try:
+        timings = processor.warm_up()
+    except Exception as e:
+        logger.exception("Model warm-up failed")
+        model_status.update(status='failed', error=str(e))
+        return
+    model_status.update(status='ready', timings={k: round(v, 3) for k, v in timings.items()})
+    logger.info("Models ready: imports %.2fs, load %.2fs, warm-up %.2fs",
+                timings['import'], timings['load'], timings['warm_up'])
+
+@app.on_event("startup")
+def preload_models():
+    logger.info("API module imported in %.2fs", time.perf_counter() - _IMPORT_STARTED)
+    if PRELOAD_MODELS:
+        # In the background, so liveness checks and downloads are answered meanwhile
+        threading.Thread(target=warm_models, name="warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    job_queue.shutdown()
+    batch_runner.shutdown(wait=False, cancel_futures=True)
+    # Let reports already started finish, so their downloads don't break
+    processor.report_pool.shutdown(wait=True)
+    if inference_pool:
+        inference_pool.shutdown()
+
+@app.post("/jobs")
+async def submit_jobs(request: Request, profile: bool = False):
+    """Queue uploaded images for background processing and return their job ids.
+    `profile` also samples each job's stacks into a flame-graph file"""
+    jobs = []
+    try:
+        # Each image is queued as soon as it has landed, while the rest are still uploading
+        async for upload in receive_uploads(request):
+            job = job_queue.submit(upload.path, upload.filename, upload.upload_id, image_digest=upload.digest,
+                                   sample_stacks=profile)
+            jobs.append(job.to_dict())
+    except HTTPException as e:
+        # A malformed body partway through: the jobs already queued keep running, so return their ids
+        if not jobs:
+            raise
+        return JSONResponse(jsonable_encoder({'detail': e.detail, 'jobs': jobs}), status_code=e.status_code)
+
+    if not jobs:
+        raise HTTPException(status_code=400, detail="No supported image files uploaded")
+
+    return {'jobs': jobs}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Stage and tile-level progress of a job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Result of a finished job, in the same shape as /process-upload entries"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status}")
+    return job.result
 
 @app.post("/process-upload")
-async def process_upload(files: List[UploadFile] = File(...)):
-    """Process uploaded images or folders"""
-    if not files:
-        raise HTTPException(status_code=400, detail="No files uploaded")
-    
-    results = []
-    
-    for file in files:
-        if not file.filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            continue
-            
-        # Save uploaded file
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Process image
+async def process_upload(request: Request, profile: bool = False):
+    """Process uploaded images or folders; `profile` as for /jobs"""
+    # One image at a time, in upload order, starting while later files are still arriving
+    turn = asyncio.Semaphore(1)
+
+    async def process(upload):
+        async with turn:
+            # Process image off the event loop so other requests keep being served
+            try:
+                result = await run_in_threadpool(processor.process_image, upload.path, upload.filename,
+                                                 upload.upload_id, image_digest=upload.digest,
+                                                 sample_stacks=profile)
+                return {'filename': upload.filename, **result}
+            except Exception as e:
+                return {'filename': upload.filename, 'success': False, 'error': str(e)}
+
+    tasks = []
+    upload_error = None
+    try:
+        async for upload in receive_uploads(request):
+            tasks.append(asyncio.create_task(process(upload)))
+    except HTTPException as e:
+        # A malformed body partway through: the images before it are still returned with the error
+        upload_error = e
+    finally:
+        # Images already received are finished even if the rest of the upload failed
+        results = await asyncio.gather(*tasks)
+
+    if upload_error and results:
+        return JSONResponse(jsonable_encoder({'detail': upload_error.detail, 'results': results}),
+                            status_code=upload_error.status_code)
+    if upload_error:
+        raise upload_error
+    if not results:
+        raise HTTPException(status_code=400, detail="No supported image files uploaded")
+    return {'results': results}
+
+@app.post("/batches")
+async def submit_batch(source: str, workers: int = Query(BATCH_WORKERS, ge=1, le=64), restart: bool = False):
+    """Process every image of a directory or manifest under BATCH_ROOT in the background.
+    Submitting the same source again resumes it, skipping images already done"""
+    root = os.path.realpath(BATCH_ROOT)
+    path = os.path.realpath(os.path.join(root, source))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(status_code=400, detail="Batch source must be inside the batch root")
+    try:
+        paths = collect_images(path, SUPPORTED_EXTENSIONS)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    running = paths and batches.get(batch_id_for(paths))
+    if running and running.status in (PENDING, RUNNING):
+        if restart:
+            raise HTTPException(status_code=409, detail="Batch is still running")
+        return running.to_dict()
+    try:
+        batch = open_batch(path, restart, allowed_root=root)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    batches[batch.batch_id] = batch
+    batch_runner.submit(process_batch, batch, workers)
+    return batch.to_dict()
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """Progress of a batch, with its consolidated report once finished"""
+    batch = batches.get(batch_id) or BatchRun.open(BATCH_DIR, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch.to_dict()
+
+@app.get("/reports/{filename}")
+async def download_report(filename: str):
+    """A result's report, waiting for it if it is still being written in the background"""
+    future = processor.pending_reports.get(filename)
+    if future is not None:
         try:
-            result = processor.process_image(file_path, file.filename)
-            results.append({
-                'filename': file.filename,
-                **result
-            })
+            await asyncio.wrap_future(future)
         except Exception as e:
-            results.append({
-                'filename': file.filename,
-                'success': False,
-                'error': str(e)
-            })
-    
-    return {'results': results}
+            raise HTTPException(status_code=500, detail=f"Report failed: {e}")
+    file_path = os.path.join(OUTPUT_DIR, filename)
+    if "/" in filename or not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Report not found")
+    return FileResponse(file_path, filename=filename, media_type='application/octet-stream')
 
 @app.get("/download/{filename}")
 async def download_file(filename: str):
@@ -389,10 +312,80 @@ async def download_file(filename: str):
         media_type='application/octet-stream'
     )
 
+@functools.lru_cache(maxsize=16)
+def load_detection_store(path, mtime):
+    """Stores stay loaded between page requests; the mtime in the key picks up rewritten files"""
+    return DetectionStore.load(path)
+
+@app.get("/detections/{store_id}")
+async def query_detections(store_id: str, bbox: Optional[str] = None,
+                           classification: Optional[List[str]] = Query(None),
+                           min_confidence: float = 0.0, offset: int = Query(0, ge=0),
+                           limit: int = Query(1000, ge=1, le=10000)):
+    """Page through one result's panels, optionally only those overlapping `bbox`
+    (`x1,y1,x2,y2` in mosaic pixels), of the given classes, or above a confidence"""
+    path = processor.detections_path(store_id)
+    if "/" in store_id or ".." in store_id or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Detections not found")
+    region = None
+    if bbox:
+        try:
+            region = tuple(int(v) for v in bbox.split(","))
+        except ValueError:
+            region = ()
+        if len(region) != 4:
+            raise HTTPException(status_code=400, detail="bbox must be x1,y1,x2,y2")
+
+    store = load_detection_store(path, os.path.getmtime(path))
+    total, rows = store.query(region, classification, min_confidence, offset, limit)
+    return {'total': total, 'offset': offset, 'limit': limit, 'panels': store.to_dicts(rows)}
+
+@app.get("/detections/{store_id}/locations")
+async def export_locations(store_id: str, format: str = "geojson",
+                           classification: Optional[List[str]] = Query(None), min_confidence: float = 0.0):
+    """Latitude and longitude of a georeferenced result's panels, optionally only those of the given
+    classes or above a confidence, streamed as GeoJSON points or CSV"""
+    if format not in LOCATION_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(LOCATION_FORMATS)}")
+    path = processor.detections_path(store_id)
+    if "/" in store_id or ".." in store_id or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Detections not found")
+    store = load_detection_store(path, os.path.getmtime(path))
+    if not store.georeferenced:
+        raise HTTPException(status_code=404, detail="No panel locations: the image has no usable georeference")
+
+    _, rows = store.query(None, classification, min_confidence)
+    media_type, extension = ("application/geo+json", "geojson") if format == "geojson" else ("text/csv", "csv")
+    # A sync generator: Starlette iterates it on a worker thread
+    return StreamingResponse(location_chunks(store, format, rows), media_type=media_type, headers={
+        'Content-Disposition': f'attachment; filename="{store_id}_panel_locations.{extension}"'})
+
+@app.get("/tiles/{pyramid}/{level}/{tile}")
+async def get_tile(pyramid: str, level: int, tile: str):
+    """One tile of an annotated mosaic's Deep Zoom pyramid, as `<col>_<row>.jpg`"""
+    if ".." in pyramid or not tile.endswith(".jpg") or "/" in tile or ".." in tile:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    file_path = os.path.join(OUTPUT_DIR, f"{pyramid}_files", str(level), tile)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    # Pyramids are named per job and never rewritten, so browsers may keep tiles for good
+    return FileResponse(file_path, media_type="image/jpeg",
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/metrics")
+async def metrics():
+    """Stage latencies, CPU time, item counts, job outcomes and memory since startup, for Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "models_loaded": processor.yolo_model is not None}
+    """Liveness: the process is up and serving requests"""
+    return {"status": "healthy", "models_loaded": processor.models_loaded}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: models are loaded and warmed up; 503 until then"""
+    return JSONResponse(model_status, status_code=200 if model_status['status'] == 'ready' else 503)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,172 @@
+"""
+Streaming stages joined by bounded queues, with per-stage throughput and queue-depth metrics
+"""
+
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+_END = object()
+# How often blocked stages wake up to check whether another stage failed
+_POLL_SECONDS = 0.1
+
+
+class PipelineAborted(Exception):
+    """Raised inside a stage when another stage has failed"""
+
+
+@dataclass
+class StageStats:
+    """Where one stage spent its time"""
+    name: str
+    items: int = 0
+    tiles: int = 0
+    busy: float = 0.0
+    starved: float = 0.0
+    blocked: float = 0.0
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'items': self.items,
+            'tiles': self.tiles,
+            'busy_seconds': round(self.busy, 4),
+            'starved_seconds': round(self.starved, 4),
+            'blocked_seconds': round(self.blocked, 4),
+            'tiles_per_second': round(self.tiles / self.busy, 2) if self.busy else None,
+        }
+
+
+class MeteredQueue:
+    """Bounded queue that samples its depth on every put"""
+
+    def __init__(self, name, maxsize, abort):
+        self.name = name
+        self.maxsize = maxsize
+        self.abort = abort
+        self.queue = queue.Queue(maxsize)
+        self.samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+
+    def _wait(self, call, stats, attribute):
+        start = time.perf_counter()
+        try:
+            while True:
+                if self.abort.is_set():
+                    raise PipelineAborted()
+                try:
+                    return call()
+                except (queue.Full, queue.Empty):
+                    continue
+        finally:
+            setattr(stats, attribute, getattr(stats, attribute) + time.perf_counter() - start)
+
+    def put(self, item, stats):
+        depth = self.queue.qsize()
+        self.samples += 1
+        self.depth_total += depth
+        self.max_depth = max(self.max_depth, depth)
+        self._wait(lambda: self.queue.put(item, timeout=_POLL_SECONDS), stats, 'blocked')
+
+    def get(self, stats):
+        return self._wait(lambda: self.queue.get(timeout=_POLL_SECONDS), stats, 'starved')
+
+    def to_dict(self):
+        return {
+            'queue': self.name,
+            'capacity': self.maxsize,
+            'max_depth': self.max_depth,
+            'mean_depth': round(self.depth_total / self.samples, 2) if self.samples else 0.0,
+        }
+
+
+def run_stages(source, stages, queue_size=2, size=len, inline=None):
+    """Feed items through stages that run concurrently, one thread each.
+
+    `source` is (name, iterable) and each stage is (name, func), where
+    func(item) returns the item handed to the next stage. Queues between
+    stages hold at most `queue_size` items, so a slow stage holds back the
+    ones before it rather than letting work pile up in memory. The stage
+    named `inline` (not the source) runs on the calling thread, keeping any thread-local
+    state it has (such as a YOLO predictor) across calls.
+
+    Returns the last stage's outputs in order and a metrics dict.
+    """
+    abort = threading.Event()
+    source_name, items = source
+    names = [source_name] + [name for name, _ in stages]
+    stats = {name: StageStats(name) for name in names}
+    queues = [MeteredQueue(f"{a}->{b}", queue_size, abort) for a, b in zip(names, names[1:])]
+    outputs = []
+
+    def produce():
+        own = stats[source_name]
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            item = next(iterator, _END)
+            if item is _END:
+                break
+            own.busy += time.perf_counter() - start
+            own.items += 1
+            own.tiles += size(item)
+            queues[0].put(item, own)
+        queues[0].put(_END, own)
+
+    def consume(index, name, func):
+        own = stats[name]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(queues) else None
+        while True:
+            item = inbox.get(own)
+            if item is _END:
+                break
+            start = time.perf_counter()
+            item = func(item)
+            own.busy += time.perf_counter() - start
+            own.items += 1
+            own.tiles += size(item)
+            if outbox:
+                outbox.put(item, own)
+            else:
+                outputs.append(item)
+        if outbox:
+            outbox.put(_END, own)
+
+    def guarded(func, *args):
+        try:
+            func(*args)
+        except BaseException:
+            abort.set()
+            raise
+
+    start = time.perf_counter()
+    threaded = [(produce, ())]
+    threaded += [(consume, (index, name, func)) for index, (name, func) in enumerate(stages) if name != inline]
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(threaded), thread_name_prefix="stage") as pool:
+        futures = [pool.submit(guarded, func, *args) for func, args in threaded]
+        for index, (name, func) in enumerate(stages):
+            if name == inline:
+                try:
+                    guarded(consume, index, name, func)
+                except Exception as error:
+                    errors.append(error)
+    errors += [future.exception() for future in futures]
+
+    # Report the stage that actually failed, not the ones it aborted
+    errors = [error for error in errors if error is not None and not isinstance(error, PipelineAborted)]
+    if errors:
+        raise errors[0]
+
+    busiest = max(stats.values(), key=lambda s: s.busy)
+    metrics = {
+        'wall_seconds': round(time.perf_counter() - start, 4),
+        'bottleneck': busiest.name,
+        'stages': [stats[name].to_dict() for name in names],
+        'queues': [q.to_dict() for q in queues],
+    }
+    return outputs, metrics
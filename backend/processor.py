@@ -0,0 +1,1097 @@
+"""
+Solar panel processing: the models and the streaming pipeline that turn one image into panels,
+labels and reports. The API and the inference worker processes both build on it.
+"""
+
+import os
+import cv2
+import csv
+import json
+import copy
+import contextlib
+import uuid
+import time
+import shutil
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+from PIL import Image
+from fastapi import HTTPException
+from tile_sources import open_tile_source, window_starts
+from box_merging import merge_duplicates
+from pipeline import run_stages
+from result_cache import WeightsFingerprint, cache_key, file_digest, link_or_copy
+from tile_cache import tile_key
+from tile_pyramid import build_pyramid
+from detection_store import DetectionStore
+from reports import REPORT_FORMATS, require_pyarrow, summarize, write_report
+from georeference import read_georeference
+from profiling import JobProfile, RssSampler, StackSampler, registry
+from batching import MicroBatcher
+
+# Log next to uvicorn's own startup messages
+logger = logging.getLogger("uvicorn.error")
+
+OUTPUT_DIR = "outputs"
+WORKSPACE_DIR = "workspaces"
+TILE_SIZE = 512
+# YOLO confidence and NMS IoU thresholds
+YOLO_CONF = 0.75
+YOLO_IOU = 0.84
+# Pixels shared by neighbouring tiles, so a panel on a seam is whole in at least one of them
+TILE_OVERLAP = int(os.environ.get("TILE_OVERLAP", 64))
+# Panels overlapping by more than this fraction of the smaller box are one panel seen twice
+MERGE_OVERLAP = float(os.environ.get("MERGE_OVERLAP", 0.5))
+# Per-job workspace sub-directories for the debug dumps
+TILE_DIR = "temp_tiles"
+ANNOTATED_DIR = "temp_annotated"
+BOXES_DIR = "temp_boxes"
+# Number of tiles sent through YOLO per forward pass
+YOLO_BATCH_SIZE = int(os.environ.get("YOLO_BATCH_SIZE", 16))
+# Number of panel crops sent through the classifier per forward pass
+CLASSIFIER_BATCH_SIZE = int(os.environ.get("CLASSIFIER_BATCH_SIZE", 64))
+# Threads for the per-tile CPU stages (box filtering, crop resizing, annotation)
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", os.cpu_count() or 1))
+# Tile rows decoded at once; bounds memory for streamable (TIFF) inputs
+STREAM_TILE_ROWS = int(os.environ.get("STREAM_TILE_ROWS", 1))
+# Bands allowed to wait between two pipeline stages before the earlier stage blocks
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 2))
+# Inference runtime: torch (eager), torchscript or onnx; exports are cached in EXPORT_DIR
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+# "int8" for dynamically quantized weights
+QUANTIZE = os.environ.get("QUANTIZE", "")
+# Threads each model may use per forward pass; 0 keeps the runtime's default
+INTRA_OP_THREADS = int(os.environ.get("INTRA_OP_THREADS", 0))
+EXPORT_DIR = "exported_models"
+# Report format: xlsx, csv or parquet (parquet needs pyarrow)
+REPORT_FORMAT = os.environ.get("REPORT_FORMAT", "xlsx")
+# Panels listed inline in a result; the full set is paged from /detections
+DETAIL_PREVIEW = int(os.environ.get("DETAIL_PREVIEW", 100))
+# Also write the annotated mosaic as a Deep Zoom tile pyramid, served from /tiles
+TILE_PYRAMID = os.environ.get("TILE_PYRAMID", "1") == "1"
+PYRAMID_TILE_SIZE = 256
+# Skip tiles before YOLO: "color" when no part of a tile has panel-like colours, "lowres" when YOLO
+# at PRESCREEN_IMGSZ finds nothing above PRESCREEN_CONF; empty runs every tile
+PRESCREEN = os.environ.get("PRESCREEN", "")
+PRESCREEN_MODES = ("", "color", "lowres")
+PRESCREEN_IMGSZ = int(os.environ.get("PRESCREEN_IMGSZ", 128))
+PRESCREEN_CONF = float(os.environ.get("PRESCREEN_CONF", 0.05))
+# Classify every crop with a fast first tier and rerun only the unsure ones on the full ResNet-50:
+# "lowres" is ResNet-50 itself at CASCADE_INPUT_SIZE, "resnet18" a small model from CASCADE_MODEL_PATH
+# with the same four-class head; empty classifies every crop with the full model
+CLASSIFIER_CASCADE = os.environ.get("CLASSIFIER_CASCADE", "")
+CASCADE_MODES = ("", "lowres", "resnet18")
+# First-tier softmax confidence below which a crop is escalated to the full model
+CASCADE_THRESHOLD = float(os.environ.get("CASCADE_THRESHOLD", 0.9))
+CASCADE_INPUT_SIZE = int(os.environ.get("CASCADE_INPUT_SIZE", 112))
+CASCADE_MODEL_PATH = os.environ.get("CASCADE_MODEL_PATH", "../resnet18_pv_classifier.pth")
+# Metres per pixel of drone frames, for placing their panels when EXIF and XMP don't give the
+# flight height and focal length; 0 derives it from them. GeoTIFFs carry their own transform.
+GROUND_SAMPLE_DISTANCE = float(os.environ.get("GROUND_SAMPLE_DISTANCE", 0))
+# Debug only: dump tiles, per-tile boxes and annotated tiles into the job workspace
+WRITE_INTERMEDIATES = os.environ.get("WRITE_INTERMEDIATES", "0") == "1"
+CLASSIFIER_PATH = os.environ.get("CLASSIFIER_PATH", "../resnet50_pv_classifier.pth")
+YOLO_MODEL_PATH = os.environ.get("YOLO_MODEL_PATH", "../runs/detect/train_yolo_v8_new_dataset4/weights/best.pt")
+CLASS_NAMES = ["Bird-drop", "Clean", "Dusty", "Physical-Damage"]
+weights_fingerprint = WeightsFingerprint(YOLO_MODEL_PATH, CLASSIFIER_PATH,
+                                         *([CASCADE_MODEL_PATH] if CLASSIFIER_CASCADE == "resnet18" else []))
+
+CLASSIFIER_INPUT_SIZE = 224
+Image.MAX_IMAGE_PIXELS = None
+
+def classifier_transform():
+    """Training-time preprocessing; classify_crops reproduces it on whole batches"""
+    from torchvision import transforms
+    return transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize([0.5]*3, [0.5]*3)
+    ])
+
+def import_inference_stack():
+    """Import the heavy libraries, which are deferred so the API starts serving quickly"""
+    import torch, torchvision, ultralytics  # noqa: F401
+
+
+@dataclass
+class Tile:
+    """A window of the mosaic; `image` is a BGR view into the decoded array"""
+    name: str
+    x_start: int
+    y_start: int
+    width: int
+    height: int
+    image: np.ndarray
+    boxes: List[List[int]] = field(default_factory=list)
+    scores: List[float] = field(default_factory=list)
+    panels: List[dict] = field(default_factory=list)
+    # Pixel hash, and the stored boxes and labels if this tile was processed before
+    cache_key: Optional[str] = None
+    cached: Optional[dict] = None
+    # Rejected by the pre-screen, so YOLO never ran on it
+    screened_out: bool = False
+
+@dataclass
+class PipelineResult:
+    """Detections and labels for one image, kept in memory"""
+    mosaic: np.ndarray
+    tiles: List[Tile]
+    # Per-stage throughput and queue depths from the streaming stages
+    metrics: dict = field(default_factory=dict)
+
+    @property
+    def detection_results(self):
+        return [{'tile': t.name, 'detections': len(t.boxes)} for t in self.tiles if t.boxes]
+
+    @property
+    def stats(self):
+        hits = sum(1 for t in self.tiles if t.cached is not None)
+        return {
+            'tiles': len(self.tiles),
+            'tile_cache_hits': hits,
+            'tile_cache_hit_rate': hits / len(self.tiles) if self.tiles else 0.0,
+            'prescreen_skipped': sum(1 for t in self.tiles if t.screened_out),
+            'pipeline': self.metrics
+        }
+
+    @property
+    def classification_results(self):
+        return [panel for t in self.tiles for panel in t.panels]
+
+@dataclass
+class Workspace:
+    """Scratch space owned by a single job, so concurrent jobs never share files"""
+    job_id: str
+    root: str
+    profile: JobProfile = field(default_factory=JobProfile)
+    # MicroBatchers ("detect", "classify") shared with the other jobs of a batch; empty runs the models alone
+    batchers: dict = field(default_factory=dict)
+
+    @classmethod
+    def create(cls, job_id=None, batchers=None):
+        job_id = job_id or uuid.uuid4().hex[:12]
+        root = os.path.join(WORKSPACE_DIR, job_id)
+        for folder in (TILE_DIR, BOXES_DIR, ANNOTATED_DIR):
+            os.makedirs(os.path.join(root, folder), exist_ok=True)
+        return cls(job_id=job_id, root=root, batchers=batchers or {})
+
+    @property
+    def tile_dir(self):
+        return os.path.join(self.root, TILE_DIR)
+
+    @property
+    def boxes_dir(self):
+        return os.path.join(self.root, BOXES_DIR)
+
+    @property
+    def annotated_dir(self):
+        return os.path.join(self.root, ANNOTATED_DIR)
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+def job_profile(workspace):
+    """The job's profile, or a throwaway one (still feeding /metrics) for calls outside a job"""
+    return workspace.profile if workspace else JobProfile()
+
+def job_batcher(workspace, name):
+    """The job's shared MicroBatcher for `name`, or None to run its model calls alone"""
+    return workspace.batchers.get(name) if workspace else None
+
+class SolarPanelProcessor:
+    """Stateless between jobs: safe to share across concurrent requests once models are loaded"""
+
+    def __init__(self, write_intermediates=WRITE_INTERMEDIATES, yolo_batch_size=YOLO_BATCH_SIZE,
+                 classifier_batch_size=CLASSIFIER_BATCH_SIZE, band_rows=STREAM_TILE_ROWS,
+                 cpu_workers=CPU_WORKERS, tile_overlap=TILE_OVERLAP, merge_overlap=MERGE_OVERLAP,
+                 pipeline_queue_size=PIPELINE_QUEUE_SIZE, result_cache=None, tile_cache=None,
+                 inference_backend=INFERENCE_BACKEND, quantize=QUANTIZE, intra_op_threads=INTRA_OP_THREADS,
+                 export_dir=EXPORT_DIR, inference_pool=None, tile_pyramid=TILE_PYRAMID,
+                 report_format=REPORT_FORMAT, prescreen=PRESCREEN, cascade=CLASSIFIER_CASCADE,
+                 cascade_threshold=CASCADE_THRESHOLD, cascade_input_size=CASCADE_INPUT_SIZE):
+        if prescreen not in PRESCREEN_MODES:
+            raise ValueError(f"PRESCREEN must be one of {', '.join(repr(m) for m in PRESCREEN_MODES)}")
+        if cascade not in CASCADE_MODES:
+            raise ValueError(f"CLASSIFIER_CASCADE must be one of {', '.join(repr(m) for m in CASCADE_MODES)}")
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"REPORT_FORMAT must be one of {', '.join(REPORT_FORMATS)}")
+        if report_format == "parquet":
+            # Fail at startup rather than on every report
+            require_pyarrow()
+        self.yolo_model = None
+        self.classifier_model = None
+        self.cascade_model = None
+        self.model_fingerprint = None
+        self.result_cache = result_cache
+        self.tile_cache = tile_cache
+        self.inference_backend = inference_backend
+        self.quantize = quantize
+        self.intra_op_threads = intra_op_threads
+        self.export_dir = export_dir
+        self.inference_pool = inference_pool
+        self.tile_pyramid = tile_pyramid
+        self.report_format = report_format
+        self.prescreen = prescreen
+        self.cascade = cascade
+        self.cascade_threshold = cascade_threshold
+        self.cascade_input_size = cascade_input_size
+        # Reports are written after the response is sent; in-flight ones by file name
+        self.report_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report")
+        self.pending_reports = {}
+        self.device = None
+        self.write_intermediates = write_intermediates
+        self.yolo_batch_size = yolo_batch_size
+        self.classifier_batch_size = classifier_batch_size
+        self.band_rows = band_rows
+        self.pipeline_queue_size = pipeline_queue_size
+        self.cpu_workers = cpu_workers
+        self.tile_overlap = tile_overlap
+        self.merge_overlap = merge_overlap
+        self._model_lock = threading.Lock()
+        self._thread_state = threading.local()
+        self._cpu_pool = None
+        
+    def load_models(self):
+        """Load YOLO and ResNet models once, however many jobs ask at the same time,
+        and again if the weight files change on disk"""
+        with self._model_lock:
+            fingerprint = weights_fingerprint()
+            reload = self.model_fingerprint not in (None, fingerprint)
+            if self.inference_pool:
+                # The models live in the worker processes; this one never imports torch
+                if reload:
+                    self.inference_pool.restart()
+                self.inference_pool.start()
+            else:
+                self.load_local_models(fingerprint, reload)
+
+            if self.model_fingerprint != fingerprint:
+                # Results from other weights can never be hit again
+                for cache in (self.result_cache, self.tile_cache):
+                    if cache:
+                        cache.drop_stale(fingerprint)
+            self.model_fingerprint = fingerprint
+
+    def load_local_models(self, fingerprint, reload=False):
+        """Load whichever model is missing into this process, or all of them on `reload`.
+
+        New models are built before any is swapped in, so jobs still running
+        keep the old ones and never find a model missing.
+        """
+        from ultralytics import YOLO
+        from inference_backends import configure_threads, export_detector
+
+        configure_threads(self.intra_op_threads)
+        models = {}
+        if reload or self.yolo_model is None:
+            # Only ONNX Runtime can quantize the detector; other backends quantize just the classifier
+            quantize = self.quantize if self.inference_backend == "onnx" else ""
+            models['yolo_model'] = YOLO(export_detector(YOLO_MODEL_PATH, self.inference_backend, quantize,
+                                                        self.export_dir, fingerprint[:12]), task="detect")
+
+        if reload or self.classifier_model is None:
+            models['device'], models['classifier_model'], cascade_model = self.build_classifier_model()
+            if cascade_model is not None:
+                models['cascade_model'] = cascade_model
+        if self.cascade == "resnet18" and (reload or self.cascade_model is None):
+            models['cascade_model'] = self.load_small_classifier(device=models.get('device', self.device))
+
+        for name, model in models.items():
+            setattr(self, name, model)
+
+    @property
+    def models_loaded(self):
+        if self.inference_pool:
+            return self.inference_pool.executor is not None
+        return self.yolo_model is not None
+
+    def warm_up(self):
+        """Load both models and push a dummy batch through each, returning the seconds each step took"""
+        timings = {}
+        start = time.perf_counter()
+        if not self.inference_pool:
+            import_inference_stack()
+        timings['import'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.load_models()
+        timings['load'] = time.perf_counter() - start
+
+        # First passes pay for layer fusion, kernel selection and allocator growth
+        start = time.perf_counter()
+        tiles = [np.zeros((TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8)] * min(2, self.yolo_batch_size)
+        list(self.detect_tiles(tiles))
+        self.classify_crops([np.zeros((CLASSIFIER_INPUT_SIZE, CLASSIFIER_INPUT_SIZE, 3), dtype=np.uint8)] * 2)
+        timings['warm_up'] = time.perf_counter() - start
+        return timings
+
+    def detector(self):
+        """This thread's YOLO handle; ultralytics predictors keep per-call state, the weights are shared"""
+        if not hasattr(self.yolo_model, "predictor"):
+            return self.yolo_model
+
+        detector = getattr(self._thread_state, "detector", None)
+        if detector is None or detector.model is not self.yolo_model.model:
+            detector = copy.copy(self.yolo_model)
+            detector.predictor = None
+            # The first call fuses layers in place on the shared model, so set up one thread at a time
+            with self._model_lock:
+                detector(np.zeros((TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8), verbose=False)
+            self._thread_state.detector = detector
+        return detector
+
+    def load_classifier_model(self, weights_path=CLASSIFIER_PATH):
+        """Build the classifier (see build_classifier_model) and install it"""
+        self.device, self.classifier_model, cascade_model = self.build_classifier_model(weights_path)
+        if cascade_model is not None:
+            self.cascade_model = cascade_model
+
+    def build_classifier_model(self, weights_path=CLASSIFIER_PATH):
+        """ResNet-50 with the panel-condition head, loading weights if given, on the configured backend.
+        Returns (device, classifier, lowres cascade tier or None)."""
+        import torch
+        from torchvision.models import resnet50
+        from inference_backends import load_classifier_backend
+
+        model = resnet50()
+        model.fc = torch.nn.Linear(model.fc.in_features, len(CLASS_NAMES))
+        if weights_path:
+            model.load_state_dict(torch.load(weights_path, map_location="cpu"), strict=False)
+        model.eval()
+
+        if self.inference_backend == "torch" and not self.quantize:
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            classifier = model.to(device)
+        else:
+            # Exported and quantized models run on the CPU
+            device = torch.device("cpu")
+            classifier = load_classifier_backend(model, self.inference_backend, self.quantize,
+                                                 self.export_dir, self.intra_op_threads)
+        # Eager even on other backends: exports are traced for 224-pixel inputs
+        return device, classifier, model if self.cascade == "lowres" else None
+
+    def load_small_classifier(self, weights_path=CASCADE_MODEL_PATH, device=None):
+        """The cascade's ResNet-18 first tier, e.g. one distilled from the ResNet-50, in eager torch"""
+        import torch
+        from torchvision.models import resnet18
+
+        model = resnet18()
+        model.fc = torch.nn.Linear(model.fc.in_features, len(CLASS_NAMES))
+        if weights_path:
+            model.load_state_dict(torch.load(weights_path, map_location="cpu"))
+        return model.eval().to(device or self.device)
+
+    def map_tiles(self, func, items):
+        """Apply func to every item on the CPU pool, keeping input order.
+
+        Threads rather than processes: tiles are views into one array and the
+        OpenCV calls doing the work release the GIL.
+        """
+        items = list(items)
+        if self.cpu_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+
+        with self._model_lock:
+            if self._cpu_pool is None or self._cpu_pool._max_workers != self.cpu_workers:
+                self._cpu_pool = ThreadPoolExecutor(max_workers=self.cpu_workers, thread_name_prefix="cpu")
+            pool = self._cpu_pool
+        return list(pool.map(func, items))
+
+    @property
+    def tile_stride(self):
+        return TILE_SIZE - self.tile_overlap
+
+    def tile_image_with_mapping(self, mosaic, y_offset=0, workspace=None, metadata_file="tile_metadata.csv"):
+        """Split a band of the mosaic into overlapping tiles that are views into it"""
+        height, width = mosaic.shape[:2]
+
+        tiles = []
+        for y in window_starts(height, TILE_SIZE, self.tile_stride):
+            for x in window_starts(width, TILE_SIZE, self.tile_stride):
+                right = min(x + TILE_SIZE, width)
+                lower = min(y + TILE_SIZE, height)
+                tiles.append(Tile(
+                    name=f"tile_{x}_{y + y_offset}.jpg",
+                    x_start=x,
+                    y_start=y + y_offset,
+                    width=right - x,
+                    height=lower - y,
+                    image=mosaic[y:lower, x:right]
+                ))
+
+        if self.write_intermediates and workspace:
+            metadata_path = os.path.join(workspace.tile_dir, metadata_file)
+            with open(metadata_path, mode='w' if y_offset == 0 else 'a', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                if y_offset == 0:
+                    writer.writerow(['tile_name', 'x_start', 'y_start', 'width', 'height'])
+                for tile in tiles:
+                    writer.writerow([tile.name, tile.x_start, tile.y_start, tile.width, tile.height])
+            self.map_tiles(lambda tile: cv2.imwrite(os.path.join(workspace.tile_dir, tile.name), tile.image), tiles)
+
+        return tiles
+
+    def is_likely_panel(self, crop):
+        """Filter to identify likely solar panels"""
+        hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+        brightness = np.mean(hsv[:, :, 2])
+        saturation = np.mean(hsv[:, :, 1])
+        avg_rgb = np.mean(crop, axis=(0, 1)).mean()
+        return (40 < brightness < 180) and (30 < saturation < 140) and (30 < avg_rgb < 180)
+
+    def likely_panels(self, image, boxes):
+        """is_likely_panel and the minimum size check for every box on a tile at once.
+
+        When the boxes cover more than the tile, HSV is computed once for the
+        tile and region means come from summed-area tables, so each box costs
+        O(1). The sums are exact integers, giving the same means, and so the
+        same decisions, as is_likely_panel on each crop.
+        """
+        height, width = image.shape[:2]
+        x1 = np.clip(boxes[:, 0], 0, width)
+        y1 = np.clip(boxes[:, 1], 0, height)
+        x2 = np.clip(boxes[:, 2], 0, width)
+        y2 = np.clip(boxes[:, 3], 0, height)
+        big_enough = (y2 - y1 >= 20) & (x2 - x1 >= 20)
+        if not big_enough.any():
+            return big_enough
+
+        if np.sum(((y2 - y1) * (x2 - x1))[big_enough]) < height * width:
+            # Boxes covering less than the tile are cheaper to check crop by crop
+            keep = big_enough.copy()
+            for i in np.flatnonzero(big_enough):
+                keep[i] = self.is_likely_panel(image[y1[i]:y2[i], x1[i]:x2[i]])
+            return keep
+
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        # Integral images are (height + 1) x (width + 1) x channels, int32 is plenty for 8-bit tiles
+        totals = []
+        for table in (cv2.integral(image, sdepth=cv2.CV_32S), cv2.integral(hsv, sdepth=cv2.CV_32S)):
+            table = table.reshape(height + 1, width + 1, -1)
+            corners = [table[y, x].astype(np.int64) for y, x in ((y2, x2), (y1, x2), (y2, x1), (y1, x1))]
+            totals.append(corners[0] - corners[1] - corners[2] + corners[3])
+        count = np.maximum((y2 - y1) * (x2 - x1), 1)[:, None]
+        bgr_means = totals[0] / count
+        hsv_means = totals[1] / count
+
+        brightness = hsv_means[:, 2]
+        saturation = hsv_means[:, 1]
+        avg_rgb = bgr_means.mean(axis=1)
+        return (big_enough & (40 < brightness) & (brightness < 180) & (30 < saturation) & (saturation < 140)
+                & (30 < avg_rgb) & (avg_rgb < 180))
+
+    def detect_batch(self, images, conf=YOLO_CONF, imgsz=None):
+        """One YOLO forward pass over a batch of tile images; `imgsz` runs it at a reduced input size"""
+        options = {'conf': conf, **({'imgsz': imgsz} if imgsz else {})}
+        if self.inference_pool:
+            return self.inference_pool.detect(images, **options)
+        return self.detector()(images, iou=YOLO_IOU, verbose=False, **options)
+
+    def detect_tiles(self, images, batcher=None):
+        """Run YOLO over tile images in batches, yielding one result per image in order"""
+        if batcher:
+            # Batches are shared with the tiles of other images in flight
+            yield from batcher(images)
+            return
+        for start in range(0, len(images), self.yolo_batch_size):
+            yield from self.detect_batch(images[start:start + self.yolo_batch_size])
+
+    @contextlib.contextmanager
+    def shared_batches(self, max_wait):
+        """MicroBatchers that merge the detector and classifier calls of the images given them into
+        shared batches, waiting up to `max_wait` seconds for other images to fill one. Jobs without
+        them run alone; the batchers stop when the block ends."""
+        batchers = {
+            'detect': MicroBatcher(self.detect_batch, self.yolo_batch_size, max_wait, "detect-batches"),
+            'classify': MicroBatcher(lambda crops: zip(*self.classify_batch(crops)), self.classifier_batch_size,
+                                     max_wait, "classify-batches"),
+        }
+        try:
+            yield batchers
+        finally:
+            for batcher in batchers.values():
+                batcher.close()
+
+    def may_hold_panel(self, tile):
+        """Whether any 8x8 block of the tile has the mean colours is_likely_panel accepts.
+        Roads, bare ground and no-data padding fail everywhere; texture such as grass still passes"""
+        height, width = tile.image.shape[:2]
+        size = (max(1, width // 8), max(1, height // 8))
+        bgr = cv2.resize(tile.image, size, interpolation=cv2.INTER_AREA)
+        hsv = cv2.resize(cv2.cvtColor(tile.image, cv2.COLOR_BGR2HSV), size, interpolation=cv2.INTER_AREA)
+        brightness, saturation = hsv[:, :, 2], hsv[:, :, 1]
+        avg_rgb = bgr.mean(axis=2)
+        return bool(np.any((40 < brightness) & (brightness < 180) & (30 < saturation) & (saturation < 140)
+                           & (30 < avg_rgb) & (avg_rgb < 180)))
+
+    def prescreen_tiles(self, tiles):
+        """The tiles worth running YOLO on; the rest are marked `screened_out` and keep no boxes"""
+        if self.prescreen == "color":
+            keep = self.map_tiles(self.may_hold_panel, tiles)
+        else:
+            keep = []
+            for start in range(0, len(tiles), self.yolo_batch_size):
+                results = self.detect_batch([tile.image for tile in tiles[start:start + self.yolo_batch_size]],
+                                            conf=PRESCREEN_CONF, imgsz=PRESCREEN_IMGSZ)
+                keep += [len(result.boxes.data) > 0 for result in results]
+        for tile, kept in zip(tiles, keep):
+            tile.screened_out = not kept
+        return [tile for tile, kept in zip(tiles, keep) if kept]
+
+    def filter_boxes(self, tile, tile_results, workspace=None):
+        """Keep the detections on one tile that are big enough and look like panels"""
+        img = tile.image
+        # Boxes.data is (n, 6): xyxy, conf, cls; pull it off the device in one transfer
+        data = tile_results.boxes.data
+        data = data.cpu().numpy() if hasattr(data, "cpu") else np.asarray(data)
+        boxes = data[:, :4].astype(np.int64)
+        keep = self.likely_panels(img, boxes)
+        valid_boxes = boxes[keep].tolist()
+        scores = data[keep, 4].astype(float).tolist()
+
+        if self.write_intermediates and workspace:
+            if valid_boxes:
+                with open(os.path.join(workspace.boxes_dir, tile.name.replace(".jpg", ".json")), "w") as f:
+                    json.dump(valid_boxes, f)
+            cv2.imwrite(os.path.join(workspace.annotated_dir, tile.name), img)
+
+        return valid_boxes, scores
+
+    def lookup_cached_tiles(self, tiles):
+        """Attach stored boxes and labels to tiles whose exact pixels were processed before"""
+        if not (self.tile_cache and self.tile_cache.enabled):
+            return
+        salt = json.dumps([self.model_fingerprint or weights_fingerprint(), YOLO_CONF, YOLO_IOU]
+                          + ([self.cascade_settings()] if self.cascade else [])
+                          + ([self.runtime_settings()] if self.runtime_settings() else []))
+        keys = self.map_tiles(lambda tile: tile_key(tile.image, salt), tiles)
+        cached = self.tile_cache.get_many(keys)
+        for tile, key in zip(tiles, keys):
+            tile.cache_key = key
+            tile.cached = cached.get(key)
+
+    def store_cached_tiles(self, tiles, labels):
+        """Remember boxes and labels of freshly processed tiles; `labels` maps id(tile) to [i, label, conf]"""
+        if not (self.tile_cache and self.tile_cache.enabled):
+            return
+        entries = {tile.cache_key: {'boxes': tile.boxes, 'scores': tile.scores, 'labels': labels.get(id(tile), [])}
+                   for tile in tiles if tile.cache_key and tile.cached is None and not tile.screened_out}
+        self.tile_cache.put_many(self.model_fingerprint or weights_fingerprint(), entries)
+
+    def run_yolo_and_store_boxes(self, tiles, workspace=None):
+        """Run YOLO detection and store bounding boxes on each tile; cached tiles skip it"""
+        detection_results = []
+        profile = job_profile(workspace)
+        with profile.stage("tile_cache_lookup"):
+            self.lookup_cached_tiles(tiles)
+        for tile in tiles:
+            if tile.cached is not None:
+                tile.boxes = tile.cached['boxes']
+                tile.scores = tile.cached['scores']
+
+        fresh = [tile for tile in tiles if tile.cached is None]
+        if self.prescreen and fresh:
+            with profile.stage("prescreen") as counts:
+                screened = self.prescreen_tiles(fresh)
+                counts['screened_out_tiles'] += len(fresh) - len(screened)
+            fresh = screened
+        with profile.stage("detect", inferred_tiles=len(fresh)) as counts:
+            results = list(self.detect_tiles([tile.image for tile in fresh], job_batcher(workspace, "detect")))
+            counts['detections'] += sum(len(r.boxes.data) for r in results)
+        filter_boxes = profile.timed("filter", self.filter_boxes, lambda kept: {'boxes': len(kept[0])})
+        boxes_per_tile = self.map_tiles(lambda pair: filter_boxes(*pair, workspace), zip(fresh, results))
+        for tile, (valid_boxes, scores) in zip(fresh, boxes_per_tile):
+            tile.boxes = valid_boxes
+            tile.scores = scores
+
+        for tile in tiles:
+            if tile.boxes:
+                detection_results.append({
+                    'tile': tile.name,
+                    'detections': len(tile.boxes)
+                })
+            
+        return detection_results
+
+    def preprocess_crop(self, crop):
+        """A BGR crop detached from its tile; classifier_inputs resizes it next to the model,
+        so this process needs no torch when the models run in an inference pool"""
+        return np.ascontiguousarray(crop)
+
+    def classify_crops(self, crops, batcher=None):
+        """Classify preprocessed BGR crops, returning labels and confidences"""
+        if batcher:
+            pairs = batcher(crops)
+            return [label for label, _ in pairs], [confidence for _, confidence in pairs]
+        return self.classify_batch(crops)
+
+    def classify_batch(self, crops):
+        """One classifier forward pass over a batch of crops"""
+        if self.inference_pool:
+            indices, confidences = self.inference_pool.classify(crops)
+            return [CLASS_NAMES[i] for i in indices.tolist()], confidences.tolist()
+
+        if self.cascade_model is not None:
+            confidences, indices = self.classify_cascade(crops)
+        else:
+            confidences, indices = self.class_probabilities(self.classifier_model, crops)
+        return [CLASS_NAMES[i] for i in indices.tolist()], confidences.tolist()
+
+    def classifier_inputs(self, crops, size=CLASSIFIER_INPUT_SIZE):
+        """BGR uint8 crops of any size as one normalized NCHW RGB batch, exactly as classifier_transform makes them.
+
+        Each crop goes through the same PIL bilinear resize as Resize; only the
+        tensor conversion and normalization are done once for the whole batch.
+        """
+        import torch
+        resized = np.stack([np.asarray(Image.fromarray(crop[:, :, ::-1]).resize((size, size), Image.BILINEAR))
+                            for crop in crops])
+        batch = torch.from_numpy(resized).to(self.device).permute(0, 3, 1, 2).float()
+        # Same arithmetic as ToTensor + Normalize(0.5, 0.5), so the result is bit-identical
+        return batch.div_(255).sub_(0.5).div_(0.5)
+
+    def class_probabilities(self, model, crops, size=CLASSIFIER_INPUT_SIZE):
+        """Top softmax confidence and class index tensors of `model` over crops resized to `size`"""
+        import torch
+        batch = self.classifier_inputs(crops, size)
+        with torch.no_grad():
+            probabilities = torch.softmax(model(batch), dim=1)
+            return torch.max(probabilities, dim=1)
+
+    def cascade_first_tier(self, crops):
+        size = self.cascade_input_size if self.cascade == "lowres" else CLASSIFIER_INPUT_SIZE
+        return self.class_probabilities(self.cascade_model, crops, size)
+
+    def classify_cascade(self, crops):
+        """Every crop through the fast tier; those below cascade_threshold again through the full model"""
+        # Not tied to a job: counted in /metrics only
+        profile = JobProfile()
+        with profile.stage("cascade_fast", crops=len(crops)):
+            confidences, indices = self.cascade_first_tier(crops)
+        unsure = (confidences < self.cascade_threshold).nonzero().flatten()
+        if len(unsure):
+            with profile.stage("cascade_full", escalated_crops=len(unsure)):
+                full_confidences, full_indices = self.class_probabilities(
+                    self.classifier_model, [crops[i] for i in unsure.tolist()])
+            confidences[unsure], indices[unsure] = full_confidences, full_indices
+        return confidences, indices
+
+    def extract_crops(self, tile):
+        """Preprocessed classifier inputs for the boxes on one tile, as (index, bbox, crop)"""
+        crops = []
+        for i, box in enumerate(tile.boxes):
+            x1, y1, x2, y2 = map(int, box)
+            crop = tile.image[y1:y2, x1:x2]
+            
+            if crop.shape[0] < 20 or crop.shape[1] < 20:
+                continue
+
+            crops.append((i, [x1, y1, x2, y2], self.preprocess_crop(crop)))
+        return crops
+
+    def classify_detected_panels(self, tiles, workspace=None):
+        """Classify detected solar panels using ResNet, batching crops across tiles"""
+        pending = []
+        fresh_labels = {}
+        profile = job_profile(workspace)
+
+        def add_panel(tile, i, label, max_conf):
+            x1, y1, x2, y2 = bbox = [int(v) for v in tile.boxes[i]]
+            tile.panels.append({
+                'panel_id': f"{tile.name}_{i}",
+                'classification': label,
+                'confidence': max_conf,
+                'detection_confidence': tile.scores[i],
+                'bbox': bbox,
+                'mosaic_bbox': [x1 + tile.x_start, y1 + tile.y_start, x2 + tile.x_start, y2 + tile.y_start]
+            })
+
+        def flush():
+            with profile.stage("classify", crops=len(pending)):
+                labels, confidences = self.classify_crops([crop for _, _, crop in pending],
+                                                          job_batcher(workspace, "classify"))
+            for (tile, i, _), label, max_conf in zip(pending, labels, confidences):
+                add_panel(tile, i, label, max_conf)
+                fresh_labels.setdefault(id(tile), []).append([i, label, max_conf])
+            pending.clear()
+
+        all_tiles = tiles
+        tiles = [tile for tile in tiles if tile.boxes]
+        for tile in tiles:
+            tile.panels = []
+            if tile.cached is not None:
+                for i, label, max_conf in tile.cached['labels']:
+                    add_panel(tile, i, label, max_conf)
+
+        fresh = [tile for tile in tiles if tile.cached is None]
+        extract_crops = profile.timed("crops", self.extract_crops)
+        for tile, crops in zip(fresh, self.map_tiles(extract_crops, fresh)):
+            for i, bbox, crop in crops:
+                pending.append((tile, i, crop))
+                if len(pending) == self.classifier_batch_size:
+                    flush()
+
+        if pending:
+            flush()
+
+        with profile.stage("tile_cache_store"):
+            self.store_cached_tiles(all_tiles, fresh_labels)
+        return [panel for tile in tiles for panel in tile.panels]
+
+    def merge_duplicate_panels(self, tiles, width, height):
+        """Drop panels seen twice where tiles overlap, comparing boxes across the whole mosaic"""
+        panels = [(tile, panel) for tile in tiles for panel in tile.panels]
+        if not panels:
+            return []
+
+        boxes = np.array([panel['mosaic_bbox'] for _, panel in panels], dtype=np.float64)
+        scores = np.array([panel['detection_confidence'] for _, panel in panels])
+        bounds = np.array([[tile.x_start, tile.y_start, tile.x_start + tile.width, tile.y_start + tile.height]
+                           for tile, _ in panels], dtype=np.float64)
+
+        # A box touching a tile edge that isn't the image edge is a clipped view of the
+        # panel; rank it below any box from a neighbour that sees the panel whole
+        clipped = (((boxes[:, 0] <= bounds[:, 0] + 1) & (bounds[:, 0] > 0)) |
+                   ((boxes[:, 1] <= bounds[:, 1] + 1) & (bounds[:, 1] > 0)) |
+                   ((boxes[:, 2] >= bounds[:, 2] - 1) & (bounds[:, 2] < width)) |
+                   ((boxes[:, 3] >= bounds[:, 3] - 1) & (bounds[:, 3] < height)))
+        keep = merge_duplicates(boxes, scores - clipped, self.merge_overlap)
+
+        kept_ids = {id(panel) for (_, panel), kept in zip(panels, keep) if kept}
+        for tile in tiles:
+            tile.panels = [panel for panel in tile.panels if id(panel) in kept_ids]
+        return [panel for tile in tiles for panel in tile.panels]
+
+    def panel_label(self, panel):
+        return f"{panel['classification']} ({panel['confidence']:.2f})"
+
+    def panel_extent(self, panel):
+        """Mosaic pixels touched by a panel's box and label"""
+        x1, y1, x2, y2 = panel['mosaic_bbox']
+        (text_width, text_height), baseline = cv2.getTextSize(
+            self.panel_label(panel), cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
+        text_x = x1 + (x2 - x1) // 2 - 30
+        text_y = y1 + (y2 - y1) // 2
+        return (min(x1, text_x) - 2, min(y1, text_y - text_height) - 2,
+                max(x2, text_x + text_width) + 2, max(y2, text_y + baseline) + 2)
+
+    def draw_panel(self, image, panel, x_offset=0, y_offset=0):
+        """Draw one panel's box and label, shifted by the offset of `image` within the mosaic"""
+        x1, y1, x2, y2 = panel['mosaic_bbox']
+        x1, y1, x2, y2 = x1 - x_offset, y1 - y_offset, x2 - x_offset, y2 - y_offset
+        label = panel['classification']
+        color = (0, 255, 0) if label == "Clean" else (0, 0, 255)
+        center_x = x1 + (x2 - x1) // 2
+        center_y = y1 + (y2 - y1) // 2
+        
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(image, self.panel_label(panel), (center_x - 30, center_y), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+
+    def annotate_mosaic(self, canvas, panels):
+        """Draw panels onto the canvas, one grid cell per worker.
+
+        Each panel is drawn into every cell its box or label reaches, clipped to
+        that cell, so workers never write the same pixels and the result matches
+        drawing the panels one after another onto the whole canvas.
+        """
+        height, width = canvas.shape[:2]
+        cells = {}
+        for panel in panels:
+            x1, y1, x2, y2 = self.panel_extent(panel)
+            for cell_y in range(max(y1, 0) // TILE_SIZE, min(y2, height - 1) // TILE_SIZE + 1):
+                for cell_x in range(max(x1, 0) // TILE_SIZE, min(x2, width - 1) // TILE_SIZE + 1):
+                    cells.setdefault((cell_x, cell_y), []).append(panel)
+
+        def draw(cell):
+            (cell_x, cell_y), cell_panels = cell
+            x, y = cell_x * TILE_SIZE, cell_y * TILE_SIZE
+            view = canvas[y:y + TILE_SIZE, x:x + TILE_SIZE]
+            for panel in cell_panels:
+                self.draw_panel(view, panel, x, y)
+
+        self.map_tiles(draw, sorted(cells.items()))
+
+    def restitch_tiles(self, mosaic, save_path):
+        """Write the annotated mosaic; tiles are views into it so there is nothing to copy back"""
+        cv2.imwrite(save_path, mosaic)
+
+    def generate_report(self, store, report_path, cache_entry=None, profile=None):
+        """Write the report in the background, then cache the finished result"""
+        name = os.path.basename(report_path)
+        profile = profile or JobProfile()
+
+        def write():
+            with profile.stage("report", report_rows=len(store)):
+                write_report(store, report_path, self.report_format)
+            if cache_entry:
+                self.result_cache.put(*cache_entry)
+
+        def done(future):
+            if future.exception() is None:
+                self.pending_reports.pop(name, None)
+            else:
+                # Kept, so downloads report the error instead of a missing file
+                logger.error("Report %s failed: %s", name, future.exception())
+
+        future = self.report_pool.submit(write)
+        self.pending_reports[name] = future
+        future.add_done_callback(done)
+        return future
+
+    def run_pipeline(self, image_path, workspace=None, progress=None):
+        """Tile, detect and classify one image, streaming bands of tile rows through concurrent stages"""
+        progress = progress or (lambda stage, done, total: None)
+        profile = job_profile(workspace)
+        # JPEG and PNG are decoded whole here; TIFFs only read their header until bands are requested
+        with profile.stage("decode"):
+            source = open_tile_source(image_path)
+        try:
+            canvas = source.create_canvas(workspace.root if workspace else None)
+            stride = self.tile_stride
+            total_tiles = (len(window_starts(source.width, TILE_SIZE, stride)) *
+                           len(window_starts(source.height, TILE_SIZE, stride)))
+            classified = []
+
+            def decode():
+                # Consecutive bands share the overlap rows so tiles keep one stride across them
+                band_height = (self.band_rows - 1) * stride + TILE_SIZE
+                bands = profile.timed_iter("decode", source.bands(band_height, step=self.band_rows * stride))
+                for y, band in bands:
+                    with profile.stage("tile") as counts:
+                        if not np.may_share_memory(canvas, band):
+                            canvas[y:y + band.shape[0]] = band
+                        # Tiles view the canvas, so the band itself can be released straight away
+                        band_tiles = self.tile_image_with_mapping(canvas[y:y + band.shape[0]], y_offset=y,
+                                                                  workspace=workspace)
+                        counts['tiles'] += len(band_tiles)
+                    yield band_tiles
+
+            def detect(band_tiles):
+                self.run_yolo_and_store_boxes(band_tiles, workspace)
+                return band_tiles
+
+            def classify(band_tiles):
+                self.classify_detected_panels(band_tiles, workspace)
+                classified.extend(band_tiles)
+                progress("classifying", len(classified), total_tiles)
+                return band_tiles
+
+            progress("detecting", 0, total_tiles)
+            # Detection stays on this (long-lived) thread so it keeps its YOLO predictor
+            bands, metrics = run_stages(("decode", decode()), [("detect", detect), ("classify", classify)],
+                                        queue_size=self.pipeline_queue_size, inline="detect")
+            tiles = [tile for band_tiles in bands for tile in band_tiles]
+        finally:
+            source.close()
+
+        progress("annotating", len(tiles), total_tiles)
+        with profile.stage("merge") as counts:
+            panels = self.merge_duplicate_panels(tiles, source.width, source.height)
+            counts['panels'] += len(panels)
+        with profile.stage("annotate"):
+            self.annotate_mosaic(canvas, panels)
+        if self.write_intermediates and workspace:
+            for tile in tiles:
+                if tile.boxes:
+                    cv2.imwrite(os.path.join(workspace.annotated_dir, tile.name), tile.image)
+
+        return PipelineResult(mosaic=canvas, tiles=tiles, metrics=metrics)
+
+    def cache_settings(self):
+        """Everything besides the image and weights that changes a result"""
+        settings = {'tile_size': TILE_SIZE, 'tile_overlap': self.tile_overlap, 'merge_overlap': self.merge_overlap,
+                    'conf': YOLO_CONF, 'iou': YOLO_IOU}
+        if self.prescreen:
+            # Only when on, so results cached before the pre-screen existed stay valid
+            settings['prescreen'] = [self.prescreen, PRESCREEN_IMGSZ, PRESCREEN_CONF]
+        if self.cascade:
+            settings['cascade'] = self.cascade_settings()
+        if self.runtime_settings():
+            # Exported and quantized models give slightly different boxes and confidences
+            settings['runtime'] = self.runtime_settings()
+        # Always present: results cached before panels had locations are missing them
+        settings['ground_sample_distance'] = GROUND_SAMPLE_DISTANCE
+        return settings
+
+    def runtime_settings(self):
+        """Backend and quantization, or None for eager torch at full precision, whose entries predate the key"""
+        if (self.inference_backend, self.quantize) == ("torch", ""):
+            return None
+        return [self.inference_backend, self.quantize]
+
+    def cascade_settings(self):
+        return [self.cascade, self.cascade_threshold, self.cascade_input_size if self.cascade == "lowres" else None]
+
+    def output_paths(self, base_name):
+        return (os.path.join(OUTPUT_DIR, f"{base_name}_annotated.jpg"),
+                os.path.join(OUTPUT_DIR, f"{base_name}_report.{self.report_format}"))
+
+    def detections_path(self, base_name):
+        return os.path.join(OUTPUT_DIR, f"{base_name}_detections.npz")
+
+    def pyramid_paths(self, base_name):
+        """The Deep Zoom descriptor and the directory of tiles next to it"""
+        dzi_path = os.path.join(OUTPUT_DIR, f"{base_name}_annotated.dzi")
+        return dzi_path, os.path.splitext(dzi_path)[0] + "_files"
+
+    def build_tile_pyramid(self, mosaic, base_name, workspace=None):
+        pyramid = build_pyramid(mosaic, self.pyramid_paths(base_name)[0], PYRAMID_TILE_SIZE,
+                                map_tiles=self.map_tiles, workdir=workspace.root if workspace else None)
+        return {**pyramid, 'url': f"/tiles/{base_name}_annotated"}
+
+    def restore_cached_result(self, cached, base_name):
+        """Give a cached result this job's output files, or None if the entry was just evicted"""
+        result, files = cached
+        output_image_path, report_path = self.output_paths(base_name)
+        dzi_path, tiles_dir = self.pyramid_paths(base_name)
+        try:
+            link_or_copy(files['annotated.jpg'], output_image_path)
+            link_or_copy(files[f'report.{self.report_format}'], report_path)
+            link_or_copy(files['detections.npz'], self.detections_path(base_name))
+            if self.tile_pyramid:
+                link_or_copy(files['pyramid.dzi'], dzi_path)
+                link_or_copy(files['pyramid_files'], tiles_dir)
+        except (OSError, KeyError):
+            # KeyError: an entry from before detection stores, in another report format or without the pyramid
+            return None
+
+        # Entries written before profiles were kept out still hold the profile of the job that cached them
+        result = {k: v for k, v in result.items() if k not in ('profile', 'profile_file')}
+        pyramid = result.get('tile_pyramid') if self.tile_pyramid else None
+        detections = {**result['detections'], 'url': f"/detections/{base_name}"}
+        if 'locations_url' in detections:
+            detections['locations_url'] = f"/detections/{base_name}/locations"
+        return {
+            **result,
+            'tile_pyramid': pyramid and {**pyramid, 'url': f"/tiles/{base_name}_annotated"},
+            'detections': detections,
+            'annotated_image': f"/outputs/{os.path.basename(output_image_path)}",
+            'excel_report': f"/reports/{os.path.basename(report_path)}",
+            'summary': {**result['summary'], 'file_path': report_path},
+            'cache_hit': True
+        }
+
+    def process_image(self, image_path, image_name, job_id=None, progress=None, image_digest=None,
+                      sample_stacks=False, batchers=None):
+        """Main processing pipeline; `progress(stage, tiles_done, tiles_total)` is called as it goes.
+        `image_digest` is the file's SHA-256 when the caller already has it, e.g. hashed during upload.
+        `sample_stacks` also writes a collapsed-stack profile of the job next to its outputs.
+        `batchers` are shared_batches() to merge this image's model calls with other images'"""
+        progress = progress or (lambda stage, done, total: None)
+        # Each job gets its own scratch space, so concurrent jobs can't clobber each other
+        workspace = Workspace.create(job_id, batchers)
+        profile = workspace.profile
+        
+        # Generate output paths
+        base_name = f"{os.path.splitext(image_name)[0]}_{workspace.job_id}"
+        profile_path = os.path.join(OUTPUT_DIR, f"{base_name}_profile.txt")
+
+        status = "failed"
+        rss = RssSampler()
+        try:
+            with rss, StackSampler(profile_path) if sample_stacks else contextlib.nullcontext():
+                response = self.analyze_image(image_path, workspace, base_name, progress, image_digest)
+            status = "cache_hit" if response['cache_hit'] else "done"
+        finally:
+            profile.peak_rss = rss.peak
+            registry.observe_job(status, time.perf_counter() - profile.started, rss.peak)
+
+        response['profile'] = profile.to_dict()
+        if sample_stacks:
+            response['profile_file'] = f"/outputs/{os.path.basename(profile_path)}"
+        return response
+
+    def analyze_image(self, image_path, workspace, base_name, progress, image_digest=None):
+        """The work of process_image, recording its stages in `workspace.profile`"""
+        profile = workspace.profile
+        output_image_path, report_path = self.output_paths(base_name)
+
+        # Re-uploads of an image already processed with these weights and settings skip inference
+        if self.result_cache and self.result_cache.enabled:
+            progress("checking cache", 0, 0)
+            with profile.stage("cache_lookup"):
+                image_digest = image_digest or file_digest(image_path)
+                cached = self.result_cache.get(cache_key(image_digest, weights_fingerprint(), self.cache_settings()))
+                restored = cached and self.restore_cached_result(cached, base_name)
+            if restored:
+                workspace.cleanup()
+                return restored
+        
+        # Load models
+        progress("loading models", 0, 0)
+        with profile.stage("load_models"):
+            self.load_models()
+        
+        # GeoTIFF tags or EXIF, from the header only; the pixels are decoded once, by the pipeline
+        with profile.stage("georeference"):
+            georeference = read_georeference(image_path, GROUND_SAMPLE_DISTANCE)
+        latitude, longitude = georeference.center() if georeference else (None, None)
+
+        try:
+            # Run pipeline
+            result = self.run_pipeline(image_path, workspace, progress)
+            classification_results = result.classification_results
+            tiles_total = len(result.tiles)
+            progress("stitching", tiles_total, tiles_total)
+            with profile.stage("stitch"):
+                self.restitch_tiles(result.mosaic, output_image_path)
+            pyramid = None
+            if self.tile_pyramid:
+                progress("tiling", tiles_total, tiles_total)
+                with profile.stage("pyramid"):
+                    pyramid = self.build_tile_pyramid(result.mosaic, base_name, workspace)
+            
+            # Clients page through the full set instead of receiving it all in this response
+            progress("reporting", tiles_total, tiles_total)
+            height, width = result.mosaic.shape[:2]
+            with profile.stage("detection_store"):
+                store = DetectionStore.from_panels(classification_results, width, height, CLASS_NAMES)
+                if georeference and georeference.maps_panels:
+                    store.add_locations(georeference)
+                store.save(self.detections_path(base_name))
+            detections = {'url': f"/detections/{base_name}", 'count': len(classification_results)}
+            if store.georeferenced:
+                detections['locations_url'] = f"/detections/{base_name}/locations"
+            
+            response = {
+                'success': True,
+                'annotated_image': f"/outputs/{os.path.basename(output_image_path)}",
+                'excel_report': f"/reports/{os.path.basename(report_path)}",
+                'summary': {**summarize(store), 'file_path': report_path},
+                # From the store, so the preview carries the panel locations too
+                'detailed_results': store.to_dicts(store.query(limit=DETAIL_PREVIEW)[1]),
+                'detections': detections,
+                'gps_latitude': latitude,
+                'gps_longitude': longitude,
+                'georeference': georeference and georeference.to_dict(),
+                'cache_hit': False,
+                'stats': result.stats,
+                'tile_pyramid': pyramid
+            }
+            cache_entry = None
+            if self.result_cache and self.result_cache.enabled:
+                # Keyed by the weights actually loaded, in case the files changed since the lookup
+                key = cache_key(image_digest, self.model_fingerprint, self.cache_settings())
+                files = {'annotated.jpg': output_image_path, f'report.{self.report_format}': report_path,
+                         'detections.npz': self.detections_path(base_name)}
+                if pyramid:
+                    files['pyramid.dzi'], files['pyramid_files'] = self.pyramid_paths(base_name)
+                # A snapshot: process_image adds this job's profile to `response` while the report
+                # thread may still be serializing the entry
+                cache_entry = (key, self.model_fingerprint, copy.deepcopy(response), files)
+            # The result is cached once its report exists
+            # Finishes after the response, so its time reaches /metrics but not this job's profile
+            self.generate_report(store, report_path, cache_entry, profile)
+            return response
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+
+        finally:
+            # Debug dumps are kept for inspection
+            if not self.write_intermediates:
+                workspace.cleanup()
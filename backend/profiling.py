@@ -0,0 +1,239 @@
+"""
+Hot-path instrumentation: per-job stage timers and counters, process-wide Prometheus metrics,
+peak-RSS sampling and an optional stack-sampling profile of a single job
+"""
+
+import os
+import sys
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+JOB_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+_END = object()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        prefix = f"{labels}," if labels else ""
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {total}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {total}"
+
+
+class MetricsRegistry:
+    """Process-wide totals since startup, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_latency = {}
+        self.stage_cpu = Counter()
+        self.items = Counter()
+        self.jobs = Counter()
+        self.job_latency = Histogram(JOB_BUCKETS)
+        self.peak_rss = 0
+
+    def observe_stage(self, stage, wall, cpu, items):
+        with self.lock:
+            self.stage_latency.setdefault(stage, Histogram(LATENCY_BUCKETS)).observe(wall)
+            self.stage_cpu[stage] += cpu
+            for kind, count in items.items():
+                self.items[kind] += count
+
+    def observe_job(self, status, wall, peak_rss):
+        with self.lock:
+            self.jobs[status] += 1
+            self.job_latency.observe(wall)
+            self.peak_rss = max(self.peak_rss, peak_rss or 0)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines += ["# HELP solar_stage_seconds Wall time of one call of a processing stage",
+                      "# TYPE solar_stage_seconds histogram"]
+            for stage, histogram in sorted(self.stage_latency.items()):
+                lines += histogram.lines("solar_stage_seconds", f'stage="{stage}"')
+            lines += ["# HELP solar_stage_cpu_seconds_total CPU time spent in a processing stage",
+                      "# TYPE solar_stage_cpu_seconds_total counter"]
+            lines += [f'solar_stage_cpu_seconds_total{{stage="{stage}"}} {cpu:.6f}'
+                      for stage, cpu in sorted(self.stage_cpu.items())]
+            lines += ["# HELP solar_items_total Tiles, detections, crops and panels handled",
+                      "# TYPE solar_items_total counter"]
+            lines += [f'solar_items_total{{kind="{kind}"}} {count}' for kind, count in sorted(self.items.items())]
+            lines += ["# HELP solar_jobs_total Images processed, by outcome", "# TYPE solar_jobs_total counter"]
+            lines += [f'solar_jobs_total{{status="{status}"}} {count}' for status, count in sorted(self.jobs.items())]
+            lines += ["# HELP solar_job_seconds Wall time of one image", "# TYPE solar_job_seconds histogram"]
+            lines += list(self.job_latency.lines("solar_job_seconds", ""))
+            lines += ["# HELP solar_job_peak_rss_bytes Highest resident memory seen during any job",
+                      "# TYPE solar_job_peak_rss_bytes gauge", f"solar_job_peak_rss_bytes {self.peak_rss}"]
+        rss = current_rss()
+        if rss is not None:
+            lines += ["# HELP solar_process_rss_bytes Resident memory now",
+                      "# TYPE solar_process_rss_bytes gauge", f"solar_process_rss_bytes {rss}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class JobProfile:
+    """Where one job spent its time: wall and CPU seconds, calls and item counts per stage.
+
+    Stages may run on several threads at once, so wall seconds are summed over
+    calls (busy time) and can exceed the job's elapsed time. CPU seconds are
+    those of the thread running each call. Every call also feeds `registry`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.items = Counter()
+        self.peak_rss = None
+
+    @contextmanager
+    def stage(self, name, **items):
+        """Time a block; counts given here or added to the yielded Counter"""
+        counts = Counter(items)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield counts
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            with self.lock:
+                stats = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+                stats['calls'] += 1
+                stats['wall_seconds'] += wall
+                stats['cpu_seconds'] += cpu
+                self.items.update(counts)
+            registry.observe_stage(name, wall, cpu, counts)
+
+    def timed(self, name, func, items=None):
+        """`func` wrapped in a stage, with `items(result)` giving the counts it handled"""
+        def wrapper(*args, **kwargs):
+            with self.stage(name) as counts:
+                result = func(*args, **kwargs)
+                if items:
+                    counts.update(items(result))
+                return result
+        return wrapper
+
+    def timed_iter(self, name, iterable):
+        """Yield from `iterable`, timing how long each item takes to produce"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _END)
+            if item is _END:
+                return
+            yield item
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'wall_seconds': round(time.perf_counter() - self.started, 4),
+                'peak_rss_bytes': self.peak_rss,
+                'stages': {name: {'calls': s['calls'], 'wall_seconds': round(s['wall_seconds'], 4),
+                                  'cpu_seconds': round(s['cpu_seconds'], 4)} for name, s in self.stages.items()},
+                'counts': dict(self.items),
+            }
+
+
+def current_rss():
+    """Resident bytes of this process, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """Highest process RSS seen while active, sampled from a background thread"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+
+# Innermost frames in these modules mean a thread is waiting, not working
+_IDLE_MODULES = ("threading.py", "queue.py", "selectors.py", "socket.py", "base_events.py")
+
+
+class StackSampler:
+    """Samples every thread's Python stack and writes them as collapsed stacks.
+
+    The output is the `frame;frame;... count` format of py-spy's `--format raw`,
+    which speedscope and flamegraph.pl read. Unlike cProfile it sees the
+    pipeline's stage and pool threads too; it samples the whole process, so
+    profile with no other jobs running for a clean picture.
+    """
+
+    def __init__(self, path, interval=0.005):
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join([names.get(ident, str(ident))] + frames[::-1])] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        with open(self.path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,188 @@
+"""
+Panel reports written straight from detection stores: one pass, constant memory, xlsx, CSV or Parquet
+"""
+
+import io
+import os
+import csv
+import json
+from datetime import datetime
+import numpy as np
+
+REPORT_FORMATS = ("xlsx", "csv", "parquet")
+COLUMNS = ["panel_id", "classification", "confidence", "detection_confidence", "bbox", "mosaic_bbox"]
+LOCATION_FORMATS = ("geojson", "csv")
+LOCATION_COLUMNS = ["panel_id", "classification", "confidence", "detection_confidence", "latitude", "longitude",
+                    "mosaic_bbox"]
+# Rows converted to Python objects at a time
+CHUNK_ROWS = 10000
+
+
+def summarize(store):
+    """Total and per-class panel counts in one pass over the label column"""
+    counts = np.bincount(store.panels['label'], minlength=len(store.class_names))
+    return {
+        'total_panels': len(store),
+        'class_distribution': {name: int(count) for name, count in zip(store.class_names, counts)},
+    }
+
+
+def summary_rows(summary):
+    rows = [("Metric", "Value"), ("Total Panels Detected", summary['total_panels'])]
+    rows += [(f"{name} Panels", count) for name, count in summary['class_distribution'].items()]
+    rows.append(("Processing Date", datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return rows
+
+
+def batch_summary_rows(images, class_names):
+    """One row per image from `images` as [(name, summary)], then the totals"""
+    rows = [("Image", "Total Panels", *class_names)]
+    totals = np.zeros(len(class_names) + 1, dtype=np.int64)
+    for name, summary in images:
+        counts = [summary['total_panels']] + [summary['class_distribution'].get(c, 0) for c in class_names]
+        totals += counts
+        rows.append((name, *counts))
+    rows.append(("All images", *totals.tolist()))
+    rows.append(("Processing Date", datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return rows
+
+
+def panel_chunks(store, rows=None):
+    """Panel dicts of `rows` (default: all) in run order, CHUNK_ROWS at a time"""
+    rows = store.panels if rows is None else rows
+    order = np.argsort(rows['id'], kind='stable')
+    for start in range(0, len(order), CHUNK_ROWS):
+        yield store.to_dicts(rows[order[start:start + CHUNK_ROWS]])
+
+
+def row_chunks(parts, by_image):
+    """Detail rows of every (image, store) part, led by the image name in batch reports"""
+    for image, store in parts:
+        lead = [image] if by_image else []
+        for chunk in panel_chunks(store):
+            yield [lead + [str(panel[c]) if c.endswith("bbox") else panel[c] for c in COLUMNS] for panel in chunk]
+
+
+def write_xlsx(summary, parts, path, by_image=False):
+    # write_only streams rows to the file instead of building every cell in memory
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Summary")
+    for row in summary:
+        sheet.append(list(row))
+    sheet = workbook.create_sheet("Detailed Results")
+    sheet.append((["image"] if by_image else []) + COLUMNS)
+    for rows in row_chunks(parts, by_image):
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
+
+
+def write_csv(summary, parts, path, by_image=False):
+    """Detailed rows only; the summary is in the API response"""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow((["image"] if by_image else []) + COLUMNS)
+        for rows in row_chunks(parts, by_image):
+            writer.writerows(rows)
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Parquet reports need pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def write_parquet(summary, parts, path, by_image=False):
+    """Typed columns, with the mosaic box as x1..y2 and the tile origin instead of text boxes;
+    one row group per store"""
+    pa = require_pyarrow()
+    import pyarrow.parquet as pq
+    writer = None
+    try:
+        for image, store in parts:
+            rows = store.panels[np.argsort(store.panels['id'], kind='stable')]
+            columns = {'image': pa.array([image] * len(rows), pa.string()).dictionary_encode()} if by_image else {}
+            table = pa.table({
+                **columns,
+                'panel_id': [f"tile_{x}_{y}.jpg_{b}" for x, y, b in zip(rows['tile_x'].tolist(),
+                                                                        rows['tile_y'].tolist(), rows['box'].tolist())],
+                'classification': pa.DictionaryArray.from_arrays(np.ascontiguousarray(rows['label']),
+                                                                 store.class_names),
+                # Fields of a structured array are strided views; Arrow wants contiguous buffers
+                **{name: np.ascontiguousarray(rows[name])
+                   for name in ('confidence', 'detection_confidence', 'x1', 'y1', 'x2', 'y2', 'tile_x', 'tile_y')},
+            })
+            writer = writer or pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer:
+            writer.close()
+
+
+WRITERS = {"xlsx": write_xlsx, "csv": write_csv, "parquet": write_parquet}
+
+
+def write_atomic(path, write):
+    """Run `write(scratch_path)`, then move the result into place: readers see no file until it is complete"""
+    scratch = f"{path}.tmp"
+    try:
+        write(scratch)
+        os.replace(scratch, path)
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+
+
+def check_format(report_format):
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format {report_format!r}")
+
+
+def write_report(store, path, report_format):
+    """Write the report for a store, atomically"""
+    check_format(report_format)
+    summary = summarize(store)
+    write_atomic(path, lambda scratch: WRITERS[report_format](summary_rows(summary), [(None, store)], scratch))
+    return summary
+
+
+def write_batch_report(images, parts, path, report_format, class_names):
+    """One report for many images: `images` is [(name, summary)] for the summary sheet and
+    `parts` yields (name, store) for the detail rows, which gain an `image` column"""
+    check_format(report_format)
+    write_atomic(path, lambda scratch: WRITERS[report_format](batch_summary_rows(images, class_names), parts,
+                                                              scratch, by_image=True))
+
+
+def location_chunks(store, location_format, rows=None):
+    """Panel locations of a georeferenced store as GeoJSON points or CSV rows, yielded as text
+    CHUNK_ROWS panels at a time so a response can stream them"""
+    if location_format == "geojson":
+        yield '{"type": "FeatureCollection", "features": [\n'
+        separator = ""
+        for chunk in panel_chunks(store, rows):
+            features = ",\n".join(json.dumps({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [panel['longitude'], panel['latitude']]},
+                'properties': {c: panel[c] for c in LOCATION_COLUMNS if c not in ("latitude", "longitude")},
+            }) for panel in chunk)
+            yield separator + features
+            separator = ",\n"
+        yield "\n]}\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(LOCATION_COLUMNS)
+    for chunk in panel_chunks(store, rows):
+        writer.writerows([str(panel[c]) if c == "mosaic_bbox" else panel[c] for c in LOCATION_COLUMNS]
+                         for panel in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # The header alone, for a store without panels
+    if buffer.tell():
+        yield buffer.getvalue()
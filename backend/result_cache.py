@@ -0,0 +1,152 @@
+"""
+Persistent cache of finished results, keyed by image content, model weights and settings
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+HASH_CHUNK = 1 << 20
+
+
+def file_digest(path):
+    """SHA-256 of a file, read in chunks so large mosaics never sit in memory"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class WeightsFingerprint:
+    """Hash of the model weight files, recomputed only when one of them changes on disk"""
+
+    def __init__(self, *paths):
+        self.paths = paths
+        self._stats = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def __call__(self):
+        stats = tuple(self._stat(path) for path in self.paths)
+        with self._lock:
+            if stats != self._stats:
+                digest = hashlib.sha256()
+                for path, stat in zip(self.paths, stats):
+                    digest.update((file_digest(path) if stat else "missing").encode())
+                self._stats, self._value = stats, digest.hexdigest()
+            return self._value
+
+
+def cache_key(image_digest, weights, settings):
+    """Key for one image processed by the given weights with the given settings"""
+    payload = json.dumps({'image': image_digest, 'weights': weights, 'settings': settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def link_or_copy(source, destination):
+    """Hard-link where the filesystem allows it, so cached mosaics aren't duplicated.
+    Directories, such as tile pyramids, are recreated with each file linked"""
+    if os.path.isdir(source):
+        shutil.copytree(source, destination, copy_function=link_or_copy, dirs_exist_ok=True)
+        return
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ResultCache:
+    """Finished results on disk, one directory per key, evicted least recently used first.
+
+    Each entry holds `result.json` plus the output files it refers to. Entries
+    are written to a scratch directory and renamed into place, so readers never
+    see a half-written entry. A hit touches the entry; eviction drops the
+    stalest entries until the cache fits in `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """(result, {name: path}) for a cached key, or None"""
+        if not self.enabled:
+            return None
+        entry = self._entry_dir(key)
+        with self.lock:
+            try:
+                with open(os.path.join(entry, "result.json")) as f:
+                    stored = json.load(f)
+                os.utime(entry)
+            except (OSError, ValueError):
+                return None
+        files = {name: os.path.join(entry, name) for name in stored['files']}
+        return stored['result'], files
+
+    def put(self, key, weights, result, files):
+        """Store a result and copies of its output files or directories, given as {name: path}"""
+        if not self.enabled:
+            return
+        scratch = os.path.join(self.cache_dir, f".{key}.{threading.get_ident()}.tmp")
+        os.makedirs(scratch, exist_ok=True)
+        try:
+            for name, path in files.items():
+                link_or_copy(path, os.path.join(scratch, name))
+            with open(os.path.join(scratch, "result.json"), "w") as f:
+                json.dump({'weights': weights, 'files': list(files), 'result': result}, f)
+            with self.lock:
+                entry = self._entry_dir(key)
+                if os.path.exists(entry):
+                    shutil.rmtree(entry)
+                os.replace(scratch, entry)
+                self._evict()
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def drop_stale(self, weights):
+        """Remove entries produced by other model weights; they can never be hit again"""
+        with self.lock:
+            for entry in self._entries():
+                try:
+                    with open(os.path.join(entry, "result.json")) as f:
+                        stale = json.load(f)['weights'] != weights
+                except (OSError, ValueError, KeyError):
+                    stale = True
+                if stale:
+                    shutil.rmtree(entry, ignore_errors=True)
+
+    def _entries(self):
+        return [entry.path for entry in os.scandir(self.cache_dir)
+                if entry.is_dir() and not entry.name.startswith(".")]
+
+    def _size(self, entry):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(entry) for name in names)
+
+    def _evict(self):
+        entries = sorted((os.stat(entry).st_mtime, entry, self._size(entry)) for entry in self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
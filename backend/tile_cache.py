@@ -0,0 +1,77 @@
+"""
+Per-tile cache of detections and labels, so repeat flights only re-run changed tiles
+"""
+
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+
+def tile_key(image, salt):
+    """Exact hash of a tile's pixels and shape, salted with the weights and settings"""
+    digest = hashlib.blake2b(salt.encode(), digest_size=20)
+    digest.update(str(image.shape).encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+class TileCache:
+    """Boxes, scores and labels per tile hash in SQLite, evicted least recently used first.
+
+    Entries are small (a few boxes each), so the cap is a number of tiles rather
+    than bytes. Keys already include the weights, so entries from old weights
+    are never hit; `drop_stale` just reclaims their space.
+    """
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS tiles "
+                        "(key TEXT PRIMARY KEY, weights TEXT, value TEXT, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tiles_used ON tiles (used)")
+        self.db.commit()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get_many(self, keys):
+        """{key: entry} for the keys that are cached"""
+        if not self.enabled or not keys:
+            return {}
+        found = {}
+        with self.lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.db.execute(f"SELECT key, value FROM tiles WHERE key IN ({','.join('?' * len(chunk))})",
+                                       chunk).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            now = time.time()
+            self.db.executemany("UPDATE tiles SET used = ? WHERE key = ?", [(now, key) for key in found])
+            self.db.commit()
+        return found
+
+    def put_many(self, weights, entries):
+        """Store {key: entry} and evict the least recently used tiles beyond the cap"""
+        if not self.enabled or not entries:
+            return
+        now = time.time()
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                                [(key, weights, json.dumps(entry), now) for key, entry in entries.items()])
+            excess = self.db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.db.execute("DELETE FROM tiles WHERE key IN "
+                                "(SELECT key FROM tiles ORDER BY used LIMIT ?)", (excess,))
+            self.db.commit()
+
+    def drop_stale(self, weights):
+        """Remove tiles cached with other model weights"""
+        with self.lock:
+            self.db.execute("DELETE FROM tiles WHERE weights != ?", (weights,))
+            self.db.commit()
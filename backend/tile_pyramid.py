@@ -0,0 +1,89 @@
+"""
+Deep Zoom tile pyramid of the annotated mosaic, so viewers fetch only the tiles on screen
+at the resolution they show them
+"""
+
+import os
+import math
+import tempfile
+import cv2
+import numpy as np
+
+DZI_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="0" '
+                'TileSize="{tile_size}">\n  <Size Width="{width}" Height="{height}"/>\n</Image>\n')
+
+
+def level_count(width, height):
+    """Deep Zoom levels: level 0 is 1x1 pixel, the last one is full resolution"""
+    return math.ceil(math.log2(max(width, height, 1))) + 1
+
+
+def tile_grid(width, height, tile_size):
+    """(x, y, col, row) of every tile on one level"""
+    return [(x, y, x // tile_size, y // tile_size)
+            for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+
+def halve(image, band_rows, map_bands, workdir=None):
+    """Next level down: a 2x2 box filter, done in bands of rows written into a new array.
+
+    Odd edges repeat their last row or column, giving Deep Zoom's ceil(size / 2).
+    The result is disk-backed when the input is, so big mosaics stay out of RAM.
+    """
+    height, width = image.shape[:2]
+    shape = ((height + 1) // 2, (width + 1) // 2, 3)
+    if isinstance(image, np.memmap):
+        smaller = np.memmap(tempfile.TemporaryFile(dir=workdir), dtype=np.uint8, mode="w+", shape=shape)
+    else:
+        smaller = np.empty(shape, dtype=np.uint8)
+
+    def band(y):
+        source = image[y:y + 2 * band_rows]
+        pad = ((0, source.shape[0] % 2), (0, width % 2), (0, 0))
+        if any(after for _, after in pad):
+            source = np.pad(source, pad, mode="edge")
+        # An exact factor of two makes INTER_AREA a plain 2x2 average
+        smaller[y // 2:y // 2 + source.shape[0] // 2] = cv2.resize(
+            source, (source.shape[1] // 2, source.shape[0] // 2), interpolation=cv2.INTER_AREA)
+
+    map_bands(band, range(0, height, 2 * band_rows))
+    return smaller
+
+
+def write_level(image, directory, tile_size, quality, map_tiles):
+    os.makedirs(directory, exist_ok=True)
+    height, width = image.shape[:2]
+
+    def write(position):
+        x, y, col, row = position
+        ok, encoded = cv2.imencode(".jpg", image[y:y + tile_size, x:x + tile_size],
+                                   [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise RuntimeError(f"Could not encode tile {col}_{row}")
+        encoded.tofile(os.path.join(directory, f"{col}_{row}.jpg"))
+
+    map_tiles(write, tile_grid(width, height, tile_size))
+
+
+def build_pyramid(mosaic, dzi_path, tile_size=256, quality=85, map_tiles=None, workdir=None):
+    """Write `mosaic` as a Deep Zoom image: `dzi_path` plus a `<name>_files/<level>/<col>_<row>.jpg` tree.
+
+    Each level is made from the one above it, so the full-resolution mosaic is
+    read once. `map_tiles(func, items)` spreads the work, e.g. over a thread pool.
+    Returns the pyramid's description for API responses.
+    """
+    map_tiles = map_tiles or (lambda func, items: [func(item) for item in items])
+    height, width = mosaic.shape[:2]
+    levels = level_count(width, height)
+    files_dir = os.path.splitext(dzi_path)[0] + "_files"
+
+    image = mosaic
+    for level in reversed(range(levels)):
+        write_level(image, os.path.join(files_dir, str(level)), tile_size, quality, map_tiles)
+        if level:
+            image = halve(image, tile_size, map_tiles, workdir)
+
+    with open(dzi_path, "w") as f:
+        f.write(DZI_TEMPLATE.format(tile_size=tile_size, width=width, height=height))
+    return {'width': width, 'height': height, 'tile_size': tile_size, 'levels': levels}
@@ -0,0 +1,173 @@
+"""
+Tile sources: hand the pipeline a mosaic one band of tile rows at a time
+"""
+
+import os
+import tempfile
+import zlib
+import cv2
+import numpy as np
+from PIL import Image
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+# TIFF compression codes of zlib streams: Adobe Deflate and the older PKZIP Deflate
+DEFLATE = (8, 32946)
+# Compressed bytes read per step when inflating a strip
+READ_CHUNK = 1 << 20
+TO_BGR = {1: cv2.COLOR_GRAY2BGR, 3: cv2.COLOR_RGB2BGR, 4: cv2.COLOR_RGBA2BGR}
+
+
+def window_starts(length, size, step):
+    """Start offsets of `size`-long windows every `step` pixels, until one reaches the end"""
+    return range(0, max(length - (size - step), 1), step)
+
+
+class ArrayTileSource:
+    """Decodes the whole image once; bands are views into it, so it is its own canvas"""
+
+    def __init__(self, image_path):
+        # cv2 decodes straight into one BGR array; PIL covers formats it can't read
+        self.mosaic = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if self.mosaic is None:
+            with Image.open(image_path) as img:
+                mosaic = np.array(img.convert("RGB"))
+            self.mosaic = cv2.cvtColor(mosaic, cv2.COLOR_RGB2BGR, dst=mosaic)
+        self.height, self.width = self.mosaic.shape[:2]
+
+    def bands(self, band_height, step=None):
+        """Yield (y_start, BGR band) pairs from top to bottom, a band every `step` rows"""
+        for y in window_starts(self.height, band_height, step or band_height):
+            yield y, self.mosaic[y:y + band_height]
+
+    def create_canvas(self, workdir=None):
+        """Array the annotated bands are assembled into"""
+        return self.mosaic
+
+    def close(self):
+        self.mosaic = None
+
+
+class TiffTileSource:
+    """Streams the strips or tiles of a (Geo)TIFF so only one band is decoded at a time"""
+
+    def __init__(self, image_path):
+        try:
+            import tifffile
+        except ImportError:
+            raise RuntimeError("Streaming TIFF input needs tifffile: pip install tifffile")
+
+        self.path = image_path
+        self.tiff = tifffile.TiffFile(image_path)
+        self.page = self.tiff.pages[0]
+        self.height, self.width = self.page.imagelength, self.page.imagewidth
+        self.samples = self.page.samplesperpixel
+
+        if self.page.dtype != np.uint8 or self.samples not in (1, 3, 4):
+            raise ValueError("Only 8-bit grayscale, RGB or RGBA TIFFs are supported")
+        if self.samples > 1 and self.page.planarconfig != 1:
+            raise ValueError("Only TIFFs with interleaved (contiguous) samples are supported")
+
+    def bands(self, band_height, step=None):
+        """Yield (y_start, BGR band) pairs from top to bottom, a band every `step` rows"""
+        step = step or band_height
+        if self.page.is_memmappable:
+            # Uncompressed pixels stored in one run: map them and let the OS page bands in and out
+            pixels = np.memmap(self.path, dtype=np.uint8, mode="r", offset=self.page.dataoffsets[0],
+                               shape=(self.height, self.width, self.samples))
+            for y in window_starts(self.height, band_height, step):
+                yield y, cv2.cvtColor(pixels[y:y + band_height], TO_BGR[self.samples])
+            return
+
+        last_start = window_starts(self.height, band_height, step)[-1]
+        page = self.page
+        if not page.is_tiled and page.compression in DEFLATE and page.predictor in (1, 2):
+            # Deflate strips inflate incrementally, so even a single-strip file is read a window at a time
+            chunk_height = min(band_height, self.height)
+            chunks = self._inflate_strips(chunk_height)
+        else:
+            # Other codecs (LZW, JPEG, ...) decode a whole strip or tile at once
+            chunk_height = min(page.tilelength if page.is_tiled else page.rowsperstrip, self.height)
+            chunks = self._segments(band_height)
+        # One band plus the chunk that may straddle into the next one
+        buffer = np.zeros((band_height + chunk_height, self.width, 3), dtype=np.uint8)
+        band_y = 0
+
+        for y, x, pixels in chunks:
+            while y >= band_y + band_height:
+                yield band_y, self._take_band(buffer, band_y, band_height, step)
+                band_y += step
+
+            if pixels is None:
+                continue
+            rows, cols = pixels.shape[:2]
+            if pixels.shape[-1] == 1:
+                pixels = np.repeat(pixels, 3, axis=-1)
+            buffer[y - band_y:y - band_y + rows, x:x + cols] = pixels[..., :3]
+
+        while band_y <= last_start:
+            yield band_y, self._take_band(buffer, band_y, band_height, step)
+            band_y += step
+
+    def _segments(self, band_height):
+        """(y, x, rows x cols x samples) pieces from tifffile, strips top to bottom, tiles row by row"""
+        # Cap tifffile's read-ahead at about one band of compressed data
+        read_ahead = self.width * band_height * 3
+        for segment, (_, _, y, x, _), _ in self.page.segments(maxworkers=1, buffersize=read_ahead):
+            if segment is None:
+                yield y, x, None
+                continue
+            # Segments are (depth, rows, cols, samples), padded at the image edges
+            yield y, x, segment[0, :self.height - y, :self.width - x]
+
+    def _inflate_strips(self, chunk_height):
+        """(y, 0, rows x width x samples) pieces of at most `chunk_height` rows from deflate strips"""
+        page = self.page
+        row_bytes = self.width * self.samples
+        strip_starts = range(0, self.height, page.rowsperstrip)
+        with open(self.path, "rb") as fh:
+            for y_strip, offset, count in zip(strip_starts, page.dataoffsets, page.databytecounts):
+                strip_end = min(y_strip + page.rowsperstrip, self.height)
+                fh.seek(offset)
+                remaining = count
+                inflater = zlib.decompressobj()
+                for y in range(y_strip, strip_end, chunk_height):
+                    want = min(chunk_height, strip_end - y) * row_bytes
+                    data = bytearray()
+                    while len(data) < want:
+                        compressed = inflater.unconsumed_tail
+                        if not compressed and remaining:
+                            compressed = fh.read(min(remaining, READ_CHUNK))
+                            remaining -= len(compressed)
+                        inflated = inflater.decompress(compressed, want - len(data))
+                        if not inflated and not compressed:
+                            raise ValueError(f"Truncated TIFF strip at row {y}")
+                        data += inflated
+                    pixels = np.frombuffer(data, dtype=np.uint8).reshape(-1, self.width, self.samples)
+                    if page.predictor == 2:
+                        # Horizontal differencing: each sample was stored as the change from its left neighbour
+                        pixels = np.cumsum(pixels, axis=1, dtype=np.uint8)
+                    yield y, 0, pixels
+
+    def _take_band(self, buffer, band_y, band_height, step):
+        """Copy the finished band out as BGR and move the rows the next band reuses to the top"""
+        rows = min(band_height, self.height - band_y)
+        band = cv2.cvtColor(buffer[:rows], cv2.COLOR_RGB2BGR)
+        keep = len(buffer) - step
+        buffer[:keep] = buffer[step:]
+        buffer[keep:] = 0
+        return band
+
+    def create_canvas(self, workdir=None):
+        """Disk-backed canvas so the annotated mosaic never has to sit in RAM"""
+        return np.memmap(tempfile.TemporaryFile(dir=workdir), dtype=np.uint8, mode="w+",
+                         shape=(self.height, self.width, 3))
+
+    def close(self):
+        self.tiff.close()
+
+
+def open_tile_source(image_path):
+    """Pick a streaming reader where the format allows windowed reads"""
+    if os.path.splitext(image_path)[1].lower() in TIFF_EXTENSIONS:
+        return TiffTileSource(image_path)
+    return ArrayTileSource(image_path)
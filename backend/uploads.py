@@ -0,0 +1,130 @@
+"""
+Streaming multipart uploads: each file goes to disk in chunks and is hashed on the way,
+and is handed over as soon as it has landed rather than after the whole request
+"""
+
+import os
+import uuid
+import hashlib
+from dataclasses import dataclass
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Bytes buffered per file before they are hashed and written off the event loop
+UPLOAD_CHUNK = 1 << 20
+
+
+class UploadError(ValueError):
+    """The request body is not a usable multipart upload"""
+
+
+@dataclass
+class SavedUpload:
+    """One uploaded file, fully written to disk"""
+    upload_id: str
+    filename: str
+    path: str
+    digest: str
+    size: int
+
+
+class _PartWriter:
+    """Hashes and writes one file part, flushing in UPLOAD_CHUNK pieces"""
+
+    def __init__(self, upload_id, filename, path):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.path = path
+        self.file = open(path, "wb")
+        self.digest = hashlib.sha256()
+        self.buffer = bytearray()
+        self.size = 0
+
+    def _write(self, data):
+        self.digest.update(data)
+        self.file.write(data)
+
+    async def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= UPLOAD_CHUNK:
+            await self.flush()
+
+    async def flush(self):
+        if self.buffer:
+            data, self.buffer = bytes(self.buffer), bytearray()
+            self.size += len(data)
+            await run_in_threadpool(self._write, data)
+
+    async def finish(self):
+        await self.flush()
+        self.file.close()
+        return SavedUpload(self.upload_id, self.filename, self.path, self.digest.hexdigest(), self.size)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def stream_uploads(stream, content_type, directory, extensions):
+    """Yield a SavedUpload for each file part whose name ends with one of `extensions`.
+
+    `stream` is the raw request body as an async iterator of bytes. Files are
+    saved as `<upload id>_<name>` in `directory`; other fields and unsupported
+    files are skipped without being stored. Only the file currently arriving
+    is buffered, at most UPLOAD_CHUNK bytes of it.
+    """
+    kind, params = parse_options_header(content_type or "")
+    if kind != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data upload")
+
+    # The parser's callbacks are synchronous, so they only record events;
+    # the writes happen between chunks where they can be awaited
+    events = []
+    header = {}
+    callbacks = {
+        "on_part_begin": lambda: events.append(("begin", None)),
+        "on_part_data": lambda data, start, end: events.append(("data", bytes(data[start:end]))),
+        "on_part_end": lambda: events.append(("end", None)),
+        "on_header_field": lambda data, start, end: header.update(field=header.get("field", b"") + data[start:end]),
+        "on_header_value": lambda data, start, end: header.update(value=header.get("value", b"") + data[start:end]),
+        "on_header_end": lambda: events.append(("header", (header.pop("field", b""), header.pop("value", b"")))),
+        "on_headers_finished": lambda: events.append(("headers_finished", None)),
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+
+    disposition = b""
+    part = None
+    try:
+        async for chunk in stream:
+            try:
+                parser.write(chunk)
+            except Exception as e:
+                raise UploadError(f"Invalid multipart data: {e}") from e
+            for event, value in events:
+                if event == "begin":
+                    disposition = b""
+                elif event == "header" and value[0].lower() == b"content-disposition":
+                    disposition = value[1]
+                elif event == "headers_finished":
+                    filename = parse_options_header(disposition)[1].get(b"filename", b"").decode("utf-8", "replace")
+                    if filename.lower().endswith(extensions):
+                        upload_id = uuid.uuid4().hex[:12]
+                        path = os.path.join(directory, f"{upload_id}_{os.path.basename(filename)}")
+                        part = _PartWriter(upload_id, filename, path)
+                elif event == "data" and part:
+                    await part.write(value)
+                elif event == "end" and part:
+                    upload, part = await part.finish(), None
+                    yield upload
+            events.clear()
+        parser.finalize()
+    finally:
+        # A client that disconnects mid-file leaves no partial upload behind
+        if part:
+            part.discard()
@@ -3,8 +3,21 @@ import FileUpload from './components/FileUpload';
 import ProcessingStatus from './components/ProcessingStatus';
 import ResultsDisplay from './components/ResultsDisplay';
 
+const POLL_INTERVAL_MS = 1000;
+
+const isFinished = (job) => job.status === 'done' || job.status === 'failed';
+
+const fetchJson = async (url, options) => {
+  const response = await fetch(url, options);
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
+  return response.json();
+};
+
 function App() {
   const [files, setFiles] = useState([]);
+  const [jobs, setJobs] = useState([]);
   const [isProcessing, setIsProcessing] = useState(false);
   const [results, setResults] = useState(null);
   const [error, setError] = useState(null);
@@ -30,26 +43,35 @@ function App() {
     });
 
     try {
-      const response = await fetch('/process-upload', {
+      // Jobs run in the background; poll their progress until all have finished
+      const { jobs: submitted } = await fetchJson('/jobs', {
         method: 'POST',
         body: formData,
       });
+      setJobs(submitted);
 
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
+      let statuses = submitted;
+      while (!statuses.every(isFinished)) {
+        await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+        statuses = await Promise.all(statuses.map((job) => fetchJson(`/jobs/${job.job_id}`)));
+        setJobs(statuses);
       }
 
-      const data = await response.json();
-      setResults(data);
+      const jobResults = await Promise.all(
+        statuses.map((job) => fetchJson(`/jobs/${job.job_id}/result`))
+      );
+      setResults({ results: jobResults });
     } catch (err) {
       setError('Processing failed: ' + err.message);
     } finally {
       setIsProcessing(false);
+      setJobs([]);
     }
   };
 
   const handleReset = () => {
     setFiles([]);
+    setJobs([]);
     setResults(null);
     setError(null);
     setIsProcessing(false);
@@ -148,7 +170,7 @@ function App() {
 
           {/* Results Section */}
           <div>
-            {isProcessing && <ProcessingStatus />}
+            {isProcessing && <ProcessingStatus jobs={jobs} />}
             {results && <ResultsDisplay results={results} />}
           </div>
         </div>
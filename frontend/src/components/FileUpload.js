@@ -6,7 +6,7 @@ const FileUpload = ({ onFilesSelected, selectedFiles, disabled }) => {
     // Filter to only allow image files
     const imageFiles = acceptedFiles.filter(file => 
       file.type.startsWith('image/') && 
-      (file.type.includes('jpeg') || file.type.includes('jpg') || file.type.includes('png'))
+      (file.type.includes('jpeg') || file.type.includes('jpg') || file.type.includes('png') || file.type.includes('tiff'))
     );
     
     onFilesSelected(imageFiles);
@@ -15,7 +15,7 @@ const FileUpload = ({ onFilesSelected, selectedFiles, disabled }) => {
   const { getRootProps, getInputProps, isDragActive } = useDropzone({
     onDrop,
     accept: {
-      'image/*': ['.jpeg', '.jpg', '.png']
+      'image/*': ['.jpeg', '.jpg', '.png', '.tif', '.tiff']
     },
     multiple: true,
     disabled
@@ -62,7 +62,7 @@ const FileUpload = ({ onFilesSelected, selectedFiles, disabled }) => {
                   <span className="font-medium text-blue-600">Click to upload</span> or drag and drop
                 </p>
                 <p className="text-sm text-gray-500 mt-1">
-                  JPG, JPEG, PNG files (max 50MB each)
+                  JPG, JPEG, PNG, TIFF files (max 50MB each)
                 </p>
               </div>
             )}
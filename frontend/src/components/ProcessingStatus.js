@@ -1,6 +1,20 @@
 import React from 'react';
 
-const ProcessingStatus = () => {
+const STAGE_LABELS = {
+  queued: 'Waiting in queue',
+  'checking cache': 'Checking for a previous result',
+  'loading models': 'Loading models',
+  detecting: 'Detecting solar panels with YOLO',
+  classifying: 'Classifying panel conditions',
+  annotating: 'Merging overlaps and drawing panels',
+  stitching: 'Writing annotated image',
+  tiling: 'Building zoomable image tiles',
+  reporting: 'Generating reports',
+  done: 'Done',
+  failed: 'Failed',
+};
+
+const ProcessingStatus = ({ jobs = [] }) => {
   return (
     <div className="bg-white rounded-lg shadow p-6">
       <div className="text-center">
@@ -31,42 +45,35 @@ const ProcessingStatus = () => {
           This may take a few minutes depending on image size and quantity
         </p>
         
-        {/* Processing Steps */}
-        <div className="space-y-3 text-left max-w-md mx-auto">
-          <div className="flex items-center space-x-3">
-            <div className="flex-shrink-0 w-6 h-6">
-              <div className="w-2 h-2 bg-blue-600 rounded-full animate-pulse"></div>
-            </div>
-            <span className="text-sm text-gray-700">Tiling large images</span>
-          </div>
-          
-          <div className="flex items-center space-x-3">
-            <div className="flex-shrink-0 w-6 h-6">
-              <div className="w-2 h-2 bg-blue-600 rounded-full animate-pulse" style={{animationDelay: '0.5s'}}></div>
-            </div>
-            <span className="text-sm text-gray-700">Detecting solar panels with YOLO</span>
-          </div>
-          
-          <div className="flex items-center space-x-3">
-            <div className="flex-shrink-0 w-6 h-6">
-              <div className="w-2 h-2 bg-blue-600 rounded-full animate-pulse" style={{animationDelay: '1s'}}></div>
-            </div>
-            <span className="text-sm text-gray-700">Classifying panel conditions</span>
-          </div>
-          
-          <div className="flex items-center space-x-3">
-            <div className="flex-shrink-0 w-6 h-6">
-              <div className="w-2 h-2 bg-blue-600 rounded-full animate-pulse" style={{animationDelay: '1.5s'}}></div>
-            </div>
-            <span className="text-sm text-gray-700">Generating reports</span>
-          </div>
-        </div>
-        
-        {/* Progress Bar */}
-        <div className="mt-6">
-          <div className="bg-gray-200 rounded-full h-2">
-            <div className="bg-blue-600 h-2 rounded-full animate-pulse" style={{width: '60%'}}></div>
-          </div>
+        {/* Per-image Progress */}
+        <div className="space-y-4 text-left max-w-md mx-auto">
+          {jobs.length === 0 && (
+            <div className="text-sm text-gray-700 text-center">Uploading images</div>
+          )}
+          {jobs.map((job) => {
+            const percent = Math.round((job.progress || 0) * 100);
+            return (
+              <div key={job.job_id}>
+                <div className="flex items-center justify-between text-sm mb-1">
+                  <span className="text-gray-900 truncate">{job.filename}</span>
+                  <span className={job.status === 'failed' ? 'text-red-600' : 'text-gray-600'}>
+                    {STAGE_LABELS[job.stage] || job.stage}
+                  </span>
+                </div>
+                <div className="bg-gray-200 rounded-full h-2">
+                  <div
+                    className={`h-2 rounded-full ${job.status === 'failed' ? 'bg-red-600' : 'bg-blue-600'}`}
+                    style={{ width: `${percent}%` }}
+                  ></div>
+                </div>
+                {job.tiles_total > 0 && (
+                  <div className="text-xs text-gray-500 mt-1">
+                    {job.tiles_done} / {job.tiles_total} tiles
+                  </div>
+                )}
+              </div>
+            );
+          })}
         </div>
       </div>
     </div>
@@ -1,4 +1,5 @@
 import React, { useState } from 'react';
+import TiledImageViewer from './TiledImageViewer';
 
 const ResultsDisplay = ({ results }) => {
   const [selectedImageIndex, setSelectedImageIndex] = useState(0);
@@ -19,6 +20,11 @@ const ResultsDisplay = ({ results }) => {
     document.body.removeChild(link);
   };
 
+  // detailed_results is only a preview; the full set is paged from the detections endpoint
+  const panelCount = (result) => (
+    result.detections ? result.detections.count : result.detailed_results.length
+  );
+
   const getClassificationColor = (classification) => {
     switch (classification) {
       case 'Clean':
@@ -88,14 +94,30 @@ const ResultsDisplay = ({ results }) => {
                   </div>
                 )}
 
-                {/* Annotated Image */}
+                {/* Cache reuse */}
+                {(successfulResults[selectedImageIndex].cache_hit || successfulResults[selectedImageIndex].stats) && (
+                  <div className="mb-2 text-sm text-gray-700">
+                    {successfulResults[selectedImageIndex].cache_hit
+                      ? 'Served from the result cache'
+                      : `Tiles reused from earlier uploads: ${Math.round(successfulResults[selectedImageIndex].stats.tile_cache_hit_rate * 100)}%`}
+                  </div>
+                )}
+
+                {/* Annotated Image: tiles of the visible region when a pyramid exists, else the whole JPEG */}
                 <div className="mb-4">
-                  <img
-                    src={successfulResults[selectedImageIndex].annotated_image}
-                    alt="Annotated"
-                    className="max-w-full h-auto rounded-lg border"
-                    style={{ maxHeight: '400px' }}
-                  />
+                  {successfulResults[selectedImageIndex].tile_pyramid ? (
+                    <TiledImageViewer
+                      key={successfulResults[selectedImageIndex].tile_pyramid.url}
+                      pyramid={successfulResults[selectedImageIndex].tile_pyramid}
+                    />
+                  ) : (
+                    <img
+                      src={successfulResults[selectedImageIndex].annotated_image}
+                      alt="Annotated"
+                      className="max-w-full h-auto rounded-lg border"
+                      style={{ maxHeight: '400px' }}
+                    />
+                  )}
                 </div>
 
                 {/* Summary Statistics */}
@@ -137,14 +159,14 @@ const ResultsDisplay = ({ results }) => {
                   <button
                     onClick={() => handleDownload(
                       successfulResults[selectedImageIndex].excel_report,
-                      `${successfulResults[selectedImageIndex].filename.split('.')[0]}_report.xlsx`
+                      `${successfulResults[selectedImageIndex].filename.split('.')[0]}_report.${successfulResults[selectedImageIndex].excel_report.split('.').pop()}`
                     )}
                     className="flex items-center px-4 py-2 bg-green-600 text-white text-sm font-medium rounded-md hover:bg-green-700"
                   >
                     <svg className="w-4 h-4 mr-2" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                       <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M9 12h6m-6 4h6m2 5H7a2 2 0 01-2-2V5a2 2 0 012-2h5.586a1 1 0 01.707.293l5.414 5.414a1 1 0 01.293.707V19a2 2 0 01-2 2z" />
                     </svg>
-                    Download Excel Report
+                    Download Report
                   </button>
                 </div>
 
@@ -153,7 +175,7 @@ const ResultsDisplay = ({ results }) => {
                  successfulResults[selectedImageIndex].detailed_results.length > 0 && (
                   <div className="mt-4 p-4 bg-gray-50 rounded-lg">
                     <h5 className="font-medium text-gray-900 mb-2">
-                      Detected Panels ({successfulResults[selectedImageIndex].detailed_results.length})
+                      Detected Panels ({panelCount(successfulResults[selectedImageIndex])})
                     </h5>
                     <div className="space-y-2 max-h-40 overflow-y-auto">
                       {successfulResults[selectedImageIndex].detailed_results.slice(0, 10).map((panel, index) => (
@@ -169,9 +191,9 @@ const ResultsDisplay = ({ results }) => {
                           </div>
                         </div>
                       ))}
-                      {successfulResults[selectedImageIndex].detailed_results.length > 10 && (
+                      {panelCount(successfulResults[selectedImageIndex]) > 10 && (
                         <div className="text-xs text-gray-500 text-center">
-                          ... and {successfulResults[selectedImageIndex].detailed_results.length - 10} more panels
+                          ... and {panelCount(successfulResults[selectedImageIndex]) - 10} more panels
                         </div>
                       )}
                     </div>
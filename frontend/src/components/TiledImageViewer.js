@@ -0,0 +1,152 @@
+import React, { useCallback, useEffect, useRef, useState } from 'react';
+
+// Pan and zoom over a Deep Zoom pyramid, loading only the tiles in view at the level the zoom needs
+const TiledImageViewer = ({ pyramid, height = 400 }) => {
+  const containerRef = useRef(null);
+  const dragRef = useRef(null);
+  const [size, setSize] = useState({ width: 0, height });
+  const [view, setView] = useState(null);
+
+  const fit = useCallback(() => {
+    const container = containerRef.current;
+    if (!container) return;
+    const width = container.clientWidth;
+    const scale = Math.min(width / pyramid.width, height / pyramid.height);
+    setSize({ width, height });
+    setView({
+      scale,
+      x: (width - pyramid.width * scale) / 2,
+      y: (height - pyramid.height * scale) / 2,
+    });
+  }, [pyramid, height]);
+
+  useEffect(() => {
+    fit();
+    window.addEventListener('resize', fit);
+    return () => window.removeEventListener('resize', fit);
+  }, [fit]);
+
+  const zoomAt = useCallback((factor, screenX, screenY) => {
+    setView((current) => {
+      const minScale = Math.min(size.width / pyramid.width, size.height / pyramid.height) / 2;
+      const scale = Math.min(Math.max(current.scale * factor, minScale), 4);
+      const applied = scale / current.scale;
+      // Keep the image point under the cursor where it is
+      return {
+        scale,
+        x: screenX - (screenX - current.x) * applied,
+        y: screenY - (screenY - current.y) * applied,
+      };
+    });
+  }, [size, pyramid]);
+
+  // React registers wheel listeners as passive, so scrolling the page can't be prevented through onWheel
+  useEffect(() => {
+    const container = containerRef.current;
+    if (!container) return undefined;
+    const onWheel = (event) => {
+      event.preventDefault();
+      const rect = container.getBoundingClientRect();
+      zoomAt(event.deltaY < 0 ? 1.25 : 0.8, event.clientX - rect.left, event.clientY - rect.top);
+    };
+    container.addEventListener('wheel', onWheel, { passive: false });
+    return () => container.removeEventListener('wheel', onWheel);
+  }, [zoomAt]);
+
+  const onMouseDown = (event) => {
+    dragRef.current = { x: event.clientX, y: event.clientY };
+  };
+
+  const onMouseMove = (event) => {
+    if (!dragRef.current) return;
+    const dx = event.clientX - dragRef.current.x;
+    const dy = event.clientY - dragRef.current.y;
+    dragRef.current = { x: event.clientX, y: event.clientY };
+    setView((current) => ({ ...current, x: current.x + dx, y: current.y + dy }));
+  };
+
+  const stopDragging = () => {
+    dragRef.current = null;
+  };
+
+  const visibleTiles = () => {
+    if (!view || !size.width) return [];
+    const top = pyramid.levels - 1;
+    // The coarsest level that still has at least one pixel per screen pixel
+    const level = Math.min(top, Math.max(0, top + Math.ceil(Math.log2(view.scale))));
+    const levelScale = Math.pow(2, level - top);
+    const levelWidth = Math.ceil(pyramid.width * levelScale);
+    const levelHeight = Math.ceil(pyramid.height * levelScale);
+    const tileSize = pyramid.tile_size;
+    const screenPerLevelPixel = view.scale / levelScale;
+
+    const firstCol = Math.max(0, Math.floor((-view.x / screenPerLevelPixel) / tileSize));
+    const lastCol = Math.min(Math.ceil(levelWidth / tileSize) - 1,
+      Math.floor(((size.width - view.x) / screenPerLevelPixel) / tileSize));
+    const firstRow = Math.max(0, Math.floor((-view.y / screenPerLevelPixel) / tileSize));
+    const lastRow = Math.min(Math.ceil(levelHeight / tileSize) - 1,
+      Math.floor(((size.height - view.y) / screenPerLevelPixel) / tileSize));
+
+    const tiles = [];
+    for (let row = firstRow; row <= lastRow; row++) {
+      for (let col = firstCol; col <= lastCol; col++) {
+        tiles.push({
+          key: `${level}/${col}_${row}`,
+          src: `${pyramid.url}/${level}/${col}_${row}.jpg`,
+          left: view.x + col * tileSize * screenPerLevelPixel,
+          top: view.y + row * tileSize * screenPerLevelPixel,
+          width: Math.min(tileSize, levelWidth - col * tileSize) * screenPerLevelPixel,
+          height: Math.min(tileSize, levelHeight - row * tileSize) * screenPerLevelPixel,
+        });
+      }
+    }
+    return tiles;
+  };
+
+  return (
+    <div className="relative">
+      <div
+        ref={containerRef}
+        className="relative overflow-hidden rounded-lg border bg-gray-100 cursor-move select-none"
+        style={{ height: `${height}px` }}
+        onMouseDown={onMouseDown}
+        onMouseMove={onMouseMove}
+        onMouseUp={stopDragging}
+        onMouseLeave={stopDragging}
+      >
+        {visibleTiles().map((tile) => (
+          <img
+            key={tile.key}
+            src={tile.src}
+            alt=""
+            draggable={false}
+            className="absolute max-w-none"
+            style={{ left: tile.left, top: tile.top, width: tile.width, height: tile.height }}
+          />
+        ))}
+      </div>
+      <div className="absolute top-2 right-2 flex space-x-1">
+        <button
+          onClick={() => zoomAt(1.5, size.width / 2, size.height / 2)}
+          className="px-2 py-1 bg-white text-gray-700 text-sm rounded shadow hover:bg-gray-100"
+        >
+          +
+        </button>
+        <button
+          onClick={() => zoomAt(1 / 1.5, size.width / 2, size.height / 2)}
+          className="px-2 py-1 bg-white text-gray-700 text-sm rounded shadow hover:bg-gray-100"
+        >
+          −
+        </button>
+        <button
+          onClick={fit}
+          className="px-2 py-1 bg-white text-gray-700 text-sm rounded shadow hover:bg-gray-100"
+        >
+          Fit
+        </button>
+      </div>
+    </div>
+  );
+};
+
+export default TiledImageViewer;